@@ -1,3 +1,4 @@
 from django.contrib import admin
-from .models import CrawledPage
-admin.site.register(CrawledPage)
\ No newline at end of file
+from .models import CrawledPage, CrawlJob
+admin.site.register(CrawledPage)
+admin.site.register(CrawlJob)
@@ -0,0 +1,79 @@
+import gzip
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from django.conf import settings
+
+# Raw responses are kept in append-only WARC segment files. Every record is its
+# own gzip member, so one can be read back from its (segment, offset, length)
+# without decompressing the rest of the segment.
+
+
+def _record(url, content_type, body):
+    headers = [
+        'WARC/1.0',
+        'WARC-Type: resource',
+        f'WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>',
+        f'WARC-Date: {datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")}',
+        f'WARC-Target-URI: {url}',
+        f'Content-Type: {content_type or "application/octet-stream"}',
+        f'Content-Length: {len(body)}',
+    ]
+    return '\r\n'.join(headers).encode() + b'\r\n\r\n' + body + b'\r\n\r\n'
+
+
+class ArchiveWriter:
+    """Appends records to this process's current segment, rolling over at max_segment_bytes."""
+
+    def __init__(self, directory, max_segment_bytes):
+        self.directory = Path(directory)
+        self.max_segment_bytes = max_segment_bytes
+        self._file = None
+        self._segment = None
+
+    def _open_segment(self):
+        if self._file is not None:
+            self._file.close()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._segment = f'{socket.gethostname()}-{os.getpid()}-{time.time_ns()}.warc.gz'
+        self._file = open(self.directory / self._segment, 'ab')
+
+    def write(self, url, content_type, body):
+        """Append one record and return its (segment, offset, length)."""
+        if self._file is None or self._file.tell() >= self.max_segment_bytes:
+            self._open_segment()
+        data = gzip.compress(_record(url, content_type, body), compresslevel=6)
+        offset = self._file.tell()
+        self._file.write(data)
+        self._file.flush()
+        return self._segment, offset, len(data)
+
+
+def read(segment, offset, length, directory=None):
+    """Return (content_type, body) of the record at offset in segment."""
+    path = Path(directory or settings.CRAWLER_ARCHIVE_DIR) / segment
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        record = gzip.decompress(f.read(length))
+    head, _, rest = record.partition(b'\r\n\r\n')
+    headers = dict(
+        line.split(': ', 1) for line in head.decode().split('\r\n')[1:] if ': ' in line
+    )
+    return headers.get('Content-Type', ''), rest[:int(headers['Content-Length'])]
+
+
+_writer = None
+
+
+def archive_result(result):
+    """Archive a fetched response and return the CrawledPage fields that reference it."""
+    global _writer
+    if not settings.CRAWLER_ARCHIVE_DIR:
+        return {'archive_segment': '', 'archive_offset': None, 'archive_length': None}
+    if _writer is None:
+        _writer = ArchiveWriter(settings.CRAWLER_ARCHIVE_DIR, settings.CRAWLER_ARCHIVE_SEGMENT_BYTES)
+    segment, offset, length = _writer.write(result.url, result.content_type, result.body)
+    return {'archive_segment': segment, 'archive_offset': offset, 'archive_length': length}
@@ -0,0 +1,124 @@
+import time
+from collections import Counter
+from django.conf import settings
+from .frontier import READY_KEY
+from .politeness import NEXT_FETCH_KEY, host_of
+from .redis_client import get_redis
+
+# Per-host circuit breaker shared by all workers. Fetch outcomes are counted in
+# a hash per host over a CRAWLER_BREAKER_WINDOW-second window; once a host has
+# CRAWLER_BREAKER_MIN_REQUESTS requests and a failure share (timeouts,
+# connection errors, 429 and 5xx) of CRAWLER_BREAKER_FAILURE_RATE, it trips.
+# A tripped host's frontier ready time is pushed past the cool-down, so the
+# politeness scheduler stops handing out its URLs, and the cool-down doubles
+# with each trip inside CRAWLER_BREAKER_MAX_COOLDOWN. When it ends, the host
+# is tried again with fresh counts.
+STATS_KEY = 'crawler:breaker:stats:'
+OPEN_KEY = 'crawler:breaker:open:'
+TRIPS_KEY = 'crawler:breaker:trips:'
+
+# KEYS are READY_KEY, then each host's stats, trips, open and next-fetch key;
+# ARGV are the time and thresholds, then each host's request and failure counts.
+RECORD_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local min_requests = tonumber(ARGV[3])
+local rate = tonumber(ARGV[4])
+local cooldown = tonumber(ARGV[5])
+local max_cooldown = tonumber(ARGV[6])
+local tripped = {}
+for j = 0, (#ARGV - 6) / 3 - 1 do
+    local host = ARGV[7 + 3 * j]
+    local stats, trips_key, open_key, next_fetch = KEYS[2 + 4 * j], KEYS[3 + 4 * j], KEYS[4 + 4 * j], KEYS[5 + 4 * j]
+    local requests = redis.call('HINCRBY', stats, 'requests', tonumber(ARGV[8 + 3 * j]))
+    local failures = redis.call('HINCRBY', stats, 'failures', tonumber(ARGV[9 + 3 * j]))
+    if redis.call('TTL', stats) < 0 then
+        redis.call('EXPIRE', stats, window)
+    end
+    if requests >= min_requests and failures >= rate * requests then
+        local trips = redis.call('INCR', trips_key)
+        local seconds = math.min(cooldown * 2 ^ (trips - 1), max_cooldown)
+        -- Trips are forgotten once a host stays healthy for a full maximum cool-down.
+        redis.call('EXPIRE', trips_key, math.ceil(seconds + max_cooldown))
+        local ready_at = tostring(now + seconds)
+        redis.call('SET', open_key, ready_at, 'EX', math.ceil(seconds))
+        redis.call('DEL', stats)
+        redis.call('SET', next_fetch, ready_at, 'PX', math.ceil(seconds * 1000))
+        redis.call('ZADD', KEYS[1], 'XX', 'GT', ready_at, host)
+        tripped[#tripped + 1] = host
+    end
+end
+return tripped
+"""
+
+_record_script = None
+
+
+class Outcomes:
+    """Fetch outcomes per host collected during one task, recorded in one script call."""
+
+    def __init__(self):
+        self.requests = Counter()
+        self.failures = Counter()
+
+    def add(self, url, failed):
+        host = host_of(url)
+        self.requests[host] += 1
+        if failed:
+            self.failures[host] += 1
+
+    def record(self):
+        """Count the outcomes and trip every host over the threshold; returns the tripped hosts."""
+        global _record_script
+        if not self.requests:
+            return []
+        if _record_script is None:
+            _record_script = get_redis().register_script(RECORD_SCRIPT)
+        keys = [READY_KEY]
+        args = [
+            time.time(), settings.CRAWLER_BREAKER_WINDOW, settings.CRAWLER_BREAKER_MIN_REQUESTS,
+            settings.CRAWLER_BREAKER_FAILURE_RATE, settings.CRAWLER_BREAKER_COOLDOWN,
+            settings.CRAWLER_BREAKER_MAX_COOLDOWN,
+        ]
+        for host, requests in self.requests.items():
+            keys += [STATS_KEY + host, TRIPS_KEY + host, OPEN_KEY + host, NEXT_FETCH_KEY + host]
+            args += [host, requests, self.failures[host]]
+        tripped = _record_script(keys=keys, args=args)
+        self.requests.clear()
+        self.failures.clear()
+        return [host.decode() for host in tripped]
+
+
+def open_until(urls):
+    """{host: time its cool-down ends} for the hosts of urls whose breaker is open."""
+    hosts = list(dict.fromkeys(host_of(url) for url in urls))
+    if not hosts:
+        return {}
+    values = get_redis().mget([OPEN_KEY + host for host in hosts])
+    return {host: float(value) for host, value in zip(hosts, values) if value is not None}
+
+
+def open_hosts():
+    """{host: seconds left} for every host whose breaker is open."""
+    r = get_redis()
+    now = time.time()
+    keys = list(r.scan_iter(match=OPEN_KEY + '*', count=1000))
+    values = r.mget(keys) if keys else []
+    return {
+        key.decode()[len(OPEN_KEY):]: max(float(value) - now, 0)
+        for key, value in zip(keys, values) if value is not None
+    }
+
+
+def close(hosts):
+    """Close the breakers of hosts, forgetting their trips, and make them due now; returns how many were open."""
+    r = get_redis()
+    now = time.time()
+    with r.pipeline() as pipe:
+        for host in hosts:
+            pipe.delete(OPEN_KEY + host)
+        for host in hosts:
+            pipe.delete(STATS_KEY + host, TRIPS_KEY + host, NEXT_FETCH_KEY + host)
+            pipe.zadd(READY_KEY, {host: now}, xx=True)
+        results = pipe.execute()
+    return sum(results[:len(hosts)])
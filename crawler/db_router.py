@@ -0,0 +1,83 @@
+import contextvars
+import random
+import time
+from contextlib import contextmanager
+from functools import wraps
+from django.conf import settings
+
+# Search, listing and presentation views read crawler tables from a replica
+# (DB_REPLICA_HOSTS) chosen once per request; everything else, including all
+# Celery tasks and every write, stays on the primary. A session that has just
+# started a crawl reads from the primary for CRAWLER_REPLICA_STICKY_SECONDS so
+# it is not shown a replica that is behind its own writes. The search cache
+# (crawler.search) checks replica_alias() and stuck_to_primary() so neither
+# kind of read leaks stale results to the other.
+STICKY_SESSION_KEY = 'db_primary_until'
+
+_replica = contextvars.ContextVar('crawler_replica', default=None)
+_sticky = contextvars.ContextVar('crawler_sticky', default=False)
+
+
+def replicas():
+    return [alias for alias in settings.DATABASES if alias.startswith('replica_')]
+
+
+@contextmanager
+def replica_reads():
+    """Route crawler reads in the enclosed block to one randomly chosen replica, if any are configured."""
+    aliases = replicas()
+    token = _replica.set(random.choice(aliases) if aliases else None)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def replica_alias():
+    """The replica crawler reads are routed to in this context, or None for the primary."""
+    return _replica.get()
+
+
+def stuck_to_primary():
+    """Whether the current request's session is reading from the primary after its own writes."""
+    return _sticky.get()
+
+
+def stick_to_primary(request):
+    """Make request's session read from the primary for the next CRAWLER_REPLICA_STICKY_SECONDS."""
+    if settings.CRAWLER_REPLICA_STICKY_SECONDS and replicas():
+        request.session[STICKY_SESSION_KEY] = time.time() + settings.CRAWLER_REPLICA_STICKY_SECONDS
+
+
+def read_from_replica(view):
+    """Run view with its crawler reads routed to a replica, unless its session is stuck to the primary."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.session.get(STICKY_SESSION_KEY, 0) > time.time():
+            token = _sticky.set(True)
+            try:
+                return view(request, *args, **kwargs)
+            finally:
+                _sticky.reset(token)
+        with replica_reads():
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    """Sends crawler reads inside replica_reads() to the chosen replica and everything else to default."""
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == 'crawler':
+            return _replica.get()
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
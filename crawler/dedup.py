@@ -0,0 +1,110 @@
+import hashlib
+import re
+from collections import Counter
+from itertools import combinations
+from django.conf import settings
+from .models import CrawledPage
+
+# 64-bit SimHash split into BLOCKS blocks. Two fingerprints within
+# BLOCKS - 2 bits of each other (CRAWLER_NEAR_DUPLICATE_DISTANCE up to 3)
+# differ in at most three blocks, so they agree exactly on at least one pair of
+# blocks. Each pair of blocks is a band of about 26 bits, so a band matches
+# roughly N / 2**26 stored pages, and candidates are found with one indexed
+# array-overlap query and then checked by distance.
+BLOCKS = 5
+BLOCK_BITS = [13, 13, 13, 13, 12]
+BLOCK_SHIFTS = [sum(BLOCK_BITS[:i]) for i in range(BLOCKS)]
+BAND_PAIRS = list(combinations(range(BLOCKS), 2))
+BAND_BITS = 26
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Bits set in each byte value, least significant first.
+BYTE_BITS = [[bit for bit in range(8) if value >> bit & 1] for value in range(256)]
+
+
+def simhash(text):
+    """64-bit SimHash over the page's words, weighted by frequency.
+
+    Token weights are summed per (byte position, byte value) of their hashes in
+    one pass, and only the distinct byte values are expanded into bits after.
+    """
+    weights = Counter(TOKEN_RE.findall(text.lower()))
+    if not weights:
+        return 0
+    sums = [[0] * 256 for _ in range(8)]
+    for token, weight in weights.items():
+        for byte_sums, value in zip(sums, hashlib.blake2b(token.encode(), digest_size=8).digest()):
+            byte_sums[value] += weight
+    total = sum(weights.values())
+    fingerprint = 0
+    # Digests are big-endian, so the first byte holds the top eight bits.
+    for position, byte_sums in enumerate(sums):
+        shift = 8 * (7 - position)
+        counts = [0] * 8
+        for value, weight in enumerate(byte_sums):
+            if weight:
+                for bit in BYTE_BITS[value]:
+                    counts[bit] += weight
+        for bit, count in enumerate(counts):
+            if 2 * count > total:
+                fingerprint |= 1 << (shift + bit)
+    return fingerprint
+
+
+def _block(fingerprint, index):
+    return (fingerprint >> BLOCK_SHIFTS[index]) & ((1 << BLOCK_BITS[index]) - 1)
+
+
+def bands(fingerprint):
+    """Band values tagged with their pair number, so equal bits in different bands don't collide."""
+    return [
+        (pair << BAND_BITS) | (_block(fingerprint, a) << BLOCK_BITS[b]) | _block(fingerprint, b)
+        for pair, (a, b) in enumerate(BAND_PAIRS)
+    ]
+
+
+def to_signed(fingerprint):
+    # BigIntegerField is a signed 64-bit column.
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+
+def to_unsigned(value):
+    return value & ((1 << 64) - 1)
+
+
+def distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def find_canonicals(fingerprints):
+    """Map each url in {url: fingerprint} to the canonical url of a near-duplicate, if any.
+
+    Candidates come from stored pages that are themselves canonical, and from
+    earlier pages in the same batch. Pages that stored near-duplicates already
+    point at stay canonical, so those duplicates never point at an empty row.
+    """
+    max_distance = settings.CRAWLER_NEAR_DUPLICATE_DISTANCE
+    candidates = []
+    wanted = sorted({band for fp in fingerprints.values() if fp for band in bands(fp)})
+    if wanted:
+        rows = CrawledPage.objects.filter(
+            simhash_bands__overlap=wanted, canonical_url=''
+        ).exclude(url__in=list(fingerprints)).values_list('url', 'simhash')
+        candidates = [(url, to_unsigned(fp)) for url, fp in rows]
+    referenced = set(
+        CrawledPage.objects.filter(canonical_url__in=list(fingerprints))
+        .values_list('canonical_url', flat=True).distinct()
+    )
+    candidates += [(url, fp) for url, fp in fingerprints.items() if fp and url in referenced]
+
+    canonicals = {}
+    for url, fp in fingerprints.items():
+        if not fp or url in referenced:
+            continue
+        match = next((c_url for c_url, c_fp in candidates if distance(fp, c_fp) <= max_distance), None)
+        if match:
+            canonicals[url] = match
+        else:
+            candidates.append((url, fp))
+    return canonicals
@@ -0,0 +1,59 @@
+from collections import namedtuple
+from bs4 import BeautifulSoup
+from django.conf import settings
+from lxml import etree, html as lxml_html
+from . import profiling
+
+ExtractedPage = namedtuple('ExtractedPage', ['title', 'content', 'links'])
+
+SKIP_TAGS = {'script', 'style'}
+
+_lxml_parser = lxml_html.HTMLParser(encoding='utf-8')
+
+
+def extract_bs4(html):
+    """Reference extractor on BeautifulSoup's pure-Python html.parser."""
+    with profiling.stage('parse'):
+        soup = BeautifulSoup(html, 'html.parser')
+    with profiling.stage('links'):
+        title = soup.title.string if soup.title else None
+        links = [a['href'] for a in soup.find_all('a', href=True)]
+
+    # Extract text content (remove scripts and styles)
+    with profiling.stage('text'):
+        for script in soup(["script", "style"]):
+            script.decompose()
+        content = soup.get_text(separator=' ', strip=True)
+    return ExtractedPage(title, content, links)
+
+
+def extract_lxml(html):
+    """Same output as extract_bs4, with the tree walks done in libxml2's C code."""
+    with profiling.stage('parse'):
+        root = lxml_html.document_fromstring(html.encode('utf-8', errors='replace'), parser=_lxml_parser)
+    with profiling.stage('links'):
+        title = root.findtext('.//title')
+        links = [href for href in (a.get('href') for a in root.iter('a')) if href is not None]
+
+    # Drop scripts, styles and comments but keep the text that follows them
+    with profiling.stage('text'):
+        etree.strip_elements(root, etree.Comment, *SKIP_TAGS, with_tail=False)
+        content = ' '.join(text for text in (part.strip() for part in root.itertext()) if text)
+    return ExtractedPage(title, content, links)
+
+
+EXTRACTORS = {
+    'lxml': extract_lxml,
+    'bs4': extract_bs4,
+}
+
+
+def extract(html):
+    """Run the configured extractor, falling back to BeautifulSoup if it can't handle the page."""
+    extractor = EXTRACTORS[settings.CRAWLER_EXTRACTOR]
+    try:
+        return extractor(html)
+    except Exception:
+        if extractor is extract_bs4:
+            raise
+        return extract_bs4(html)
@@ -0,0 +1,208 @@
+import asyncio
+import atexit
+import codecs
+import contextvars
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+import aiohttp
+from django.conf import settings
+from . import profiling
+
+CHUNK_SIZE = 64 * 1024
+# Statuses worth retrying later; any other error status is final.
+RETRY_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+
+@dataclass
+class FetchResult:
+    url: str
+    status_code: Optional[int] = None
+    text: str = ''
+    error: Optional[str] = None
+    etag: str = ''
+    last_modified: str = ''
+    content_type: str = ''
+    body: bytes = b''
+    truncated: bool = False
+    elapsed: float = 0.0
+    # The error was a timeout, a connection failure or a RETRY_STATUSES answer.
+    transient: bool = False
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class RejectedResponse(Exception):
+    pass
+
+
+def check_response(headers, allowed_types, max_bytes):
+    """Reject a response from its headers alone, before any of the body is read."""
+    content_type = headers.get('Content-Type', '')
+    mime_type = content_type.split(';', 1)[0].strip().lower()
+    if allowed_types and mime_type and mime_type not in allowed_types:
+        raise RejectedResponse(f'Content-Type {mime_type} not allowed')
+    length = headers.get('Content-Length')
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise RejectedResponse(f'Content-Length {length} exceeds {max_bytes} bytes')
+    return content_type
+
+
+def decode_body(body, content_type):
+    charset = 'utf-8'
+    for param in content_type.split(';')[1:]:
+        key, _, value = param.partition('=')
+        if key.strip().lower() == 'charset' and value.strip():
+            charset = value.strip().strip('"\'')
+    try:
+        codecs.lookup(charset)
+    except LookupError:
+        charset = 'utf-8'
+    return body.decode(charset, errors='replace')
+
+
+def read_capped(chunks, max_bytes):
+    """Join chunks until max_bytes; returns (body, truncated)."""
+    body = bytearray()
+    for chunk in chunks:
+        body += chunk
+        if len(body) > max_bytes:
+            return bytes(body[:max_bytes]), True
+    return bytes(body), False
+
+
+async def _read_capped(response, max_bytes):
+    body = bytearray()
+    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+        body += chunk
+        if len(body) > max_bytes:
+            return bytes(body[:max_bytes]), True
+    return bytes(body), False
+
+
+async def _get(session, url, headers, allowed_types, max_bytes):
+    try:
+        async with session.get(url, headers=headers) as response:
+            response.raise_for_status()
+            result = FetchResult(
+                url, response.status,
+                etag=response.headers.get('ETag', ''),
+                last_modified=response.headers.get('Last-Modified', ''),
+            )
+            if response.status == 304:
+                return result
+            result.content_type = check_response(response.headers, allowed_types, max_bytes)
+            # Stream the body so oversized or endless responses stop at the cap.
+            with profiling.stage('download', url):
+                result.body, result.truncated = await _read_capped(response, max_bytes)
+            result.text = decode_body(result.body, result.content_type)
+            return result
+    except aiohttp.ClientResponseError as e:
+        return FetchResult(url, e.status, error=str(e), transient=e.status in RETRY_STATUSES)
+    except (asyncio.TimeoutError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError) as e:
+        return FetchResult(url, error=str(e) or type(e).__name__, transient=True)
+    except Exception as e:
+        return FetchResult(url, error=str(e) or type(e).__name__)
+
+
+async def _fetch(session, semaphore, url, headers, allowed_types, max_bytes):
+    async with semaphore:
+        # Timed from the request being sent, not from queueing on the semaphore.
+        start = time.perf_counter()
+        result = await _get(session, url, headers, allowed_types, max_bytes)
+        result.elapsed = time.perf_counter() - start
+        return result
+
+
+class FetchEngine:
+    """An event loop on a daemon thread with pooled keep-alive sessions.
+
+    One engine serves a worker process for its lifetime, so connections and
+    DNS lookups are reused across batches rather than torn down after each.
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.loop = asyncio.new_event_loop()
+        self.sessions = {}
+        self.thread = threading.Thread(target=self.loop.run_forever, name='crawler-fetch', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def session(self, limit, per_host):
+        """The session pooling up to limit connections (per_host per host); only called on the loop."""
+        session = self.sessions.get((limit, per_host))
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=limit, limit_per_host=per_host, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=settings.CRAWLER_FETCH_TIMEOUT),
+                headers={'User-Agent': settings.CRAWLER_USER_AGENT},
+                trace_configs=profiling.trace_configs(),
+            )
+            self.sessions[(limit, per_host)] = session
+        return session
+
+    def run(self, coro):
+        """Run coro on the engine's loop, seeing the caller's context variables, and return its result."""
+        return asyncio.run_coroutine_threadsafe(_with_context(contextvars.copy_context(), coro), self.loop).result()
+
+    def close(self):
+        # A forked child inherits the registration but not the loop thread.
+        if self.pid != os.getpid() or not self.loop.is_running():
+            return
+        self.run(_close_sessions(list(self.sessions.values())))
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+async def _with_context(context, coro):
+    # The loop thread has its own context; carry the caller's (e.g. an active
+    # profile) over so records made during the fetch reach the calling task.
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+
+async def _close_sessions(sessions):
+    for session in sessions:
+        await session.close()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """The process's FetchEngine, started on first use (and again after a fork)."""
+    global _engine
+    with _engine_lock:
+        if _engine is None or _engine.pid != os.getpid():
+            _engine = FetchEngine()
+        return _engine
+
+
+async def fetch_all(urls, headers=None, concurrency=None, per_host=None, allowed_types=None, max_bytes=None):
+    """Fetch urls concurrently over the engine's pooled keep-alive session.
+
+    Must run on the engine's loop. headers optionally maps a URL to extra
+    request headers, e.g. conditional request validators. Responses whose
+    Content-Type is not in allowed_types (an empty tuple allows any) are
+    rejected, and bodies are cut at max_bytes.
+    """
+    headers = headers or {}
+    if allowed_types is None:
+        allowed_types = settings.CRAWLER_ALLOWED_CONTENT_TYPES
+    max_bytes = max_bytes or settings.CRAWLER_MAX_BODY_BYTES
+    concurrency = concurrency or settings.CRAWLER_FETCH_CONCURRENCY
+    session = get_engine().session(concurrency, per_host or settings.CRAWLER_FETCH_PER_HOST)
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*(
+        _fetch(session, semaphore, url, headers.get(url), allowed_types, max_bytes) for url in urls
+    ))
+
+
+def fetch_batch(urls, **kwargs):
+    return get_engine().run(fetch_all(urls, **kwargs))
@@ -0,0 +1,120 @@
+import hashlib
+from collections import namedtuple
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Case, DateTimeField, F, Value, When
+from django.db.models.functions import Greatest, Least
+from django.utils import timezone
+from .models import CrawledPage
+
+PageState = namedtuple('PageState', ['etag', 'last_modified', 'content_hash', 'refresh_interval'])
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8', errors='replace')).hexdigest()
+
+
+def load_states(urls):
+    """Return {url: PageState} for the urls that have been crawled before."""
+    rows = CrawledPage.objects.filter(url__in=urls).values_list(
+        'url', 'etag', 'last_modified', 'content_hash', 'refresh_interval'
+    )
+    return {url: PageState(*state) for url, *state in rows}
+
+
+def conditional_headers(state):
+    headers = {}
+    if state is not None:
+        if state.etag:
+            headers['If-None-Match'] = state.etag
+        if state.last_modified:
+            headers['If-Modified-Since'] = state.last_modified
+    return headers
+
+
+def is_unchanged(state, status_code, text):
+    return state is not None and (status_code == 304 or content_hash(text) == state.content_hash)
+
+
+def changed_interval(state):
+    """Refresh interval for a page that just changed: halve it, within bounds."""
+    if state is None:
+        return settings.CRAWLER_REFRESH_DEFAULT_INTERVAL
+    return max(state.refresh_interval.total_seconds() / 2, settings.CRAWLER_REFRESH_MIN_INTERVAL)
+
+
+def touch(urls):
+    """Mark unchanged pages as checked and back off their refresh interval, in one UPDATE."""
+    if not urls:
+        return 0
+    now = timezone.now()
+    interval = Least(F('refresh_interval') * 2, Value(timedelta(seconds=settings.CRAWLER_REFRESH_MAX_INTERVAL)))
+    return CrawledPage.objects.filter(url__in=urls).update(
+        last_checked_at=now,
+        refresh_interval=interval,
+        next_crawl_at=Value(now) + interval,
+        last_error='',
+        failed_at=None,
+        fail_count=0,
+    )
+
+
+def record_failures(failures):
+    """Record permanent fetch failures, given as {url: (status_code, error)}; returns the count.
+
+    Pages crawled before keep their content and validators; URLs never crawled
+    get a row holding only the failure. A page is re-checked after
+    CRAWLER_FAILED_RECHECK_INTERVAL, then after twice its previous interval on
+    each further failure (at most CRAWLER_REFRESH_MAX_INTERVAL), and not
+    scheduled again after CRAWLER_FAILED_MAX_RECHECKS failures in a row. The
+    next successful fetch clears it.
+    """
+    if not failures:
+        return 0
+    now = timezone.now()
+    recheck = timedelta(seconds=settings.CRAWLER_FAILED_RECHECK_INTERVAL)
+    max_rechecks = settings.CRAWLER_FAILED_MAX_RECHECKS
+    interval = Least(
+        Greatest(F('refresh_interval') * 2, Value(recheck)),
+        Value(timedelta(seconds=settings.CRAWLER_REFRESH_MAX_INTERVAL)),
+    )
+    CrawledPage.objects.filter(url__in=failures).update(
+        status_code=Case(*(When(url=url, then=Value(code or 0)) for url, (code, _) in failures.items())),
+        last_error=Case(*(When(url=url, then=Value(error[:500])) for url, (_, error) in failures.items())),
+        failed_at=now,
+        last_checked_at=now,
+        fail_count=F('fail_count') + 1,
+        refresh_interval=interval,
+        # fail_count here is the count before this failure.
+        next_crawl_at=Case(
+            When(fail_count__gte=max_rechecks - 1, then=Value(None)),
+            default=Value(now) + interval,
+            output_field=DateTimeField(),
+        ),
+    )
+    # Rows updated above conflict and are skipped.
+    CrawledPage.objects.bulk_create(
+        [
+            CrawledPage(
+                url=url, status_code=code or 0, last_error=error[:500], failed_at=now, fail_count=1,
+                last_checked_at=now, refresh_interval=recheck,
+                next_crawl_at=now + recheck if max_rechecks > 1 else None,
+            )
+            for url, (code, error) in failures.items()
+        ],
+        ignore_conflicts=True,
+    )
+    return len(failures)
+
+
+def claim_due(limit):
+    """Return up to limit URLs due for a refresh and push them back by the claim lease."""
+    now = timezone.now()
+    due = CrawledPage.objects.filter(next_crawl_at__lte=now).order_by('next_crawl_at')
+    urls = list(due.values_list('url', flat=True)[:limit])
+    if urls:
+        # Keeps the next beat from re-queueing pages that are still in the frontier.
+        CrawledPage.objects.filter(url__in=urls).update(
+            next_crawl_at=now + timedelta(seconds=settings.CRAWLER_REFRESH_CLAIM_LEASE)
+        )
+    return urls
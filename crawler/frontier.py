@@ -0,0 +1,348 @@
+import json
+import time
+import uuid
+from collections import namedtuple
+from urllib.parse import urljoin, urlsplit, urlunsplit
+from django.conf import settings
+from .politeness import CRAWL_DELAY_KEY, NEXT_FETCH_KEY, host_of
+from .redis_client import get_redis
+from .seen import get_seen_filter
+
+HOST_QUEUE_KEY = 'crawler:frontier:host:'
+READY_KEY = 'crawler:frontier:ready'
+SIZE_KEY = 'crawler:frontier:size'
+PULLERS_KEY = 'crawler:frontier:pullers'
+CRAWL_KEY = 'crawler:crawl:{}'
+CRAWL_TTL = 7 * 24 * 3600
+# Crawls whose hash changed since crawler.jobs last copied it to Postgres.
+ACTIVE_CRAWLS_KEY = 'crawler:crawl:active'
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+# max_length of CrawledPage.url and PageContent.url; longer URLs cannot be stored.
+MAX_URL_LENGTH = 1000
+
+# deferrals counts how often the entry was put back because its host's
+# robots.txt could not be fetched; it is only encoded once non-zero.
+FrontierEntry = namedtuple('FrontierEntry', ['crawl_id', 'depth', 'url', 'deferrals'], defaults=[0])
+
+# The frontier is one queue per host (shallowest URLs first) plus a READY_KEY
+# sorted set of hosts scored by the time they may next be fetched.
+
+# Adds members to their host queues while enforcing the crawl's depth limit and
+# page budget atomically, so concurrent workers cannot overshoot either.
+# Returns the 0-based positions of the members it queued. KEYS are the crawl
+# hash, READY_KEY and SIZE_KEY, then each member's host queue and next-fetch
+# key; ARGV are the depth and time, then each member's host and entry.
+ADD_SCRIPT = """
+local max_depth = tonumber(redis.call('HGET', KEYS[1], 'max_depth'))
+local max_pages = tonumber(redis.call('HGET', KEYS[1], 'max_pages'))
+local depth = tonumber(ARGV[1])
+if not max_depth or depth > max_depth then
+    return {}
+end
+local now = tonumber(ARGV[2])
+local queued = tonumber(redis.call('HGET', KEYS[1], 'queued') or '0')
+local added = {}
+for j = 0, (#ARGV - 2) / 2 - 1 do
+    if queued >= max_pages then
+        break
+    end
+    local host = ARGV[3 + 2 * j]
+    if redis.call('ZADD', KEYS[4 + 2 * j], 'NX', depth, ARGV[4 + 2 * j]) == 1 then
+        queued = queued + 1
+        added[#added + 1] = j
+        local ready_at = tonumber(redis.call('GET', KEYS[5 + 2 * j]) or now)
+        redis.call('ZADD', KEYS[2], 'NX', math.max(now, ready_at), host)
+    end
+end
+redis.call('HSET', KEYS[1], 'queued', queued)
+redis.call('EXPIRE', KEYS[1], %d)
+redis.call('INCRBY', KEYS[3], #added)
+return added
+""" % CRAWL_TTL
+
+# Takes one URL from each of the given hosts that is still due, and pushes each
+# host's ready time out by its delay. pop() picks the hosts (longest-waiting
+# first) with a read beforehand, so the script checks each one again in case
+# another puller took it meanwhile. KEYS are READY_KEY and SIZE_KEY, then each
+# host's queue, next-fetch and crawl-delay key; ARGV are the time, the default
+# delay and the hosts.
+POP_SCRIPT = """
+local now = tonumber(ARGV[1])
+local out = {}
+for j = 0, #ARGV - 3 do
+    local host = ARGV[3 + j]
+    local queue = KEYS[3 + 3 * j]
+    local score = tonumber(redis.call('ZSCORE', KEYS[1], host))
+    if score and score <= now then
+        local popped = redis.call('ZPOPMIN', queue)
+        if popped[1] then
+            out[#out + 1] = popped[1]
+            local delay = math.max(tonumber(ARGV[2]), tonumber(redis.call('GET', KEYS[5 + 3 * j]) or '0'))
+            local ready_at = now + delay
+            redis.call('SET', KEYS[4 + 3 * j], ready_at, 'PX', math.ceil(delay * 1000) + 1)
+            if redis.call('EXISTS', queue) == 1 then
+                redis.call('ZADD', KEYS[1], ready_at, host)
+            else
+                redis.call('ZREM', KEYS[1], host)
+            end
+        else
+            redis.call('ZREM', KEYS[1], host)
+        end
+    end
+end
+if #out > 0 then
+    redis.call('DECRBY', KEYS[2], #out)
+end
+return out
+"""
+
+# Puts popped entries back in their host queues without counting them against
+# their crawl's budget again, and makes each host due no earlier than ARGV[1].
+# KEYS are READY_KEY and SIZE_KEY, then each entry's host queue; ARGV are the
+# ready time, then each entry's host, depth and member.
+DEFER_SCRIPT = """
+local ready_at = tonumber(ARGV[1])
+local added = 0
+for j = 0, (#ARGV - 1) / 3 - 1 do
+    local host = ARGV[2 + 3 * j]
+    if redis.call('ZADD', KEYS[3 + j], 'NX', ARGV[3 + 3 * j], ARGV[4 + 3 * j]) == 1 then
+        added = added + 1
+    end
+    redis.call('ZADD', KEYS[1], 'GT', ready_at, host)
+end
+redis.call('INCRBY', KEYS[2], added)
+return added
+"""
+
+# Drops expired puller leases and leases up to the limit's worth of the given
+# tokens, one per batch of due hosts, in a single step so concurrent
+# dispatchers cannot overshoot the limit. KEYS are PULLERS_KEY and READY_KEY;
+# ARGV are the time, limit, batch size and lease, then the candidate tokens.
+# Returns the countdown followed by the leased tokens.
+LEASE_SCRIPT = """
+local now = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+local active = redis.call('ZCARD', KEYS[1])
+local due = redis.call('ZCOUNT', KEYS[2], '-inf', now)
+local wanted = math.min(tonumber(ARGV[2]) - active, math.ceil(due / tonumber(ARGV[3])))
+local countdown = 0
+if wanted <= 0 and active == 0 then
+    local first = redis.call('ZRANGE', KEYS[2], 0, 0, 'WITHSCORES')
+    if first[1] then
+        countdown = math.max(tonumber(first[2]) - now, 0)
+        wanted = 1
+    end
+end
+local out = {tostring(countdown)}
+for i = 1, math.min(wanted, #ARGV - 4) do
+    redis.call('ZADD', KEYS[1], now + countdown + tonumber(ARGV[4]), ARGV[4 + i])
+    out[#out + 1] = ARGV[4 + i]
+end
+return out
+"""
+
+_add_script = None
+_pop_script = None
+_lease_script = None
+_defer_script = None
+
+
+def normalize_url(url, base=None):
+    """Resolve url against base and canonicalize it, or return None if it is not crawlable.
+
+    URLs longer than MAX_URL_LENGTH are not crawlable: their pages could never be stored.
+    """
+    url = (url or '').strip()
+    if base:
+        url = urljoin(base, url)
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return None
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        return None
+    netloc = parts.hostname.lower()
+    if port and port != DEFAULT_PORTS[scheme]:
+        netloc = f'{netloc}:{port}'
+    url = urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+    return url if len(url) <= MAX_URL_LENGTH else None
+
+
+def _encode(crawl_id, depth, url, deferrals=0):
+    return json.dumps([crawl_id, depth, url, deferrals] if deferrals else [crawl_id, depth, url])
+
+
+def _register_crawl(kind, max_depth, max_pages, **fields):
+    crawl_id = uuid.uuid4().hex
+    with get_redis().pipeline() as pipe:
+        pipe.hset(CRAWL_KEY.format(crawl_id), mapping={
+            **fields,
+            'kind': kind,
+            'max_depth': settings.CRAWLER_MAX_DEPTH if max_depth is None else max_depth,
+            'max_pages': settings.CRAWLER_MAX_PAGES if max_pages is None else max_pages,
+            'queued': 0,
+            'fetched': 0,
+            'failed': 0,
+            'bytes': 0,
+            'created_at': time.time(),
+        })
+        pipe.expire(CRAWL_KEY.format(crawl_id), CRAWL_TTL)
+        pipe.sadd(ACTIVE_CRAWLS_KEY, crawl_id)
+        pipe.execute()
+    return crawl_id
+
+
+def start_crawl(seed_url, max_depth=None, max_pages=None):
+    """Register a new crawl and queue its seed URL; returns the crawl id."""
+    crawl_id = _register_crawl('crawl', max_depth, max_pages or settings.CRAWLER_MAX_PAGES, seed=seed_url)
+    # The seed is always fetched, even if it was seen recently.
+    get_seen_filter().mark(_queue(crawl_id, [seed_url], 0))
+    return crawl_id
+
+
+def start_seeded_crawl(max_depth=None, max_pages=None):
+    """Register a crawl whose seeds are queued later with add_seeds(); returns the crawl id.
+
+    max_pages budgets the pages discovered from the seeds; each seed batch
+    extends it by the number of seeds it queues.
+    """
+    return _register_crawl('seeds', max_depth, max_pages, seed='')
+
+
+def add_seeds(crawl_id, urls):
+    """Queue a batch of seed urls not already seen, growing the crawl's budget to fit them."""
+    seen = get_seen_filter()
+    urls = seen.unseen(urls)
+    if not urls:
+        return 0
+    get_redis().hincrby(CRAWL_KEY.format(crawl_id), 'max_pages', len(urls))
+    accepted = _queue(crawl_id, urls, 0)
+    seen.mark(accepted)
+    return len(accepted)
+
+
+def start_refresh(urls):
+    """Queue already-crawled urls for a re-crawl that does not follow links."""
+    crawl_id = _register_crawl('refresh', 0, len(urls), seed='')
+    _queue(crawl_id, urls, 0)
+    return crawl_id
+
+
+def add(crawl_id, urls, depth, dedupe=True):
+    """Queue urls for a crawl at the given depth; returns how many were accepted.
+
+    With dedupe, URLs already in the shared seen filter are dropped before they
+    reach the frontier, and only the URLs the crawl accepts are marked seen.
+    """
+    urls = list(dict.fromkeys(urls))
+    if not dedupe:
+        return len(_queue(crawl_id, urls, depth))
+    if not urls:
+        return 0
+    max_depth = get_redis().hget(CRAWL_KEY.format(crawl_id), 'max_depth')
+    # Skip the seen-filter lookup for URLs the depth limit would reject anyway.
+    if max_depth is None or depth > int(max_depth):
+        return 0
+    seen = get_seen_filter()
+    accepted = _queue(crawl_id, seen.unseen(urls), depth)
+    seen.mark(accepted)
+    return len(accepted)
+
+
+def _queue(crawl_id, urls, depth):
+    """Run ADD_SCRIPT for urls and return the ones within the crawl's depth limit and budget."""
+    global _add_script
+    urls = list(dict.fromkeys(urls))
+    if not urls:
+        return []
+    keys = [CRAWL_KEY.format(crawl_id), READY_KEY, SIZE_KEY]
+    args = [depth, time.time()]
+    for url in urls:
+        host = host_of(url)
+        keys += [HOST_QUEUE_KEY + host, NEXT_FETCH_KEY + host]
+        args += [host, _encode(crawl_id, depth, url)]
+    if _add_script is None:
+        _add_script = get_redis().register_script(ADD_SCRIPT)
+    added = _add_script(keys=keys, args=args)
+    if added:
+        get_redis().sadd(ACTIVE_CRAWLS_KEY, crawl_id)
+    return [urls[int(i)] for i in added]
+
+
+def pop(count):
+    """Take up to count entries from hosts that are due, at most one per host."""
+    global _pop_script
+    now = time.time()
+    hosts = [host.decode() for host in get_redis().zrangebyscore(READY_KEY, '-inf', now, start=0, num=count)]
+    if not hosts:
+        return []
+    if _pop_script is None:
+        _pop_script = get_redis().register_script(POP_SCRIPT)
+    keys = [READY_KEY, SIZE_KEY]
+    for host in hosts:
+        keys += [HOST_QUEUE_KEY + host, NEXT_FETCH_KEY + host, CRAWL_DELAY_KEY + host]
+    members = _pop_script(keys=keys, args=[now, settings.CRAWLER_DEFAULT_CRAWL_DELAY, *hosts])
+    return [FrontierEntry(*json.loads(member)) for member in members]
+
+
+def defer(entries, seconds):
+    """Put popped entries back on the frontier, due in seconds, counting one more deferral each."""
+    global _defer_script
+    if not entries:
+        return 0
+    keys = [READY_KEY, SIZE_KEY]
+    args = [time.time() + seconds]
+    for entry in entries:
+        host = host_of(entry.url)
+        keys.append(HOST_QUEUE_KEY + host)
+        args += [host, entry.depth, _encode(entry.crawl_id, entry.depth, entry.url, entry.deferrals + 1)]
+    if _defer_script is None:
+        _defer_script = get_redis().register_script(DEFER_SCRIPT)
+    return _defer_script(keys=keys, args=args)
+
+
+def size():
+    return int(get_redis().get(SIZE_KEY) or 0)
+
+
+def ready_hosts():
+    return get_redis().zcount(READY_KEY, '-inf', time.time())
+
+
+def next_ready_in():
+    """Seconds until the next queued host is due, or None if the frontier is empty."""
+    first = get_redis().zrange(READY_KEY, 0, 0, withscores=True)
+    return max(first[0][1] - time.time(), 0) if first else None
+
+
+def crawl_info(crawl_id):
+    """The crawl's live Redis hash: its limits, kind, seed and progress counters."""
+    return {k.decode(): v.decode() for k, v in get_redis().hgetall(CRAWL_KEY.format(crawl_id)).items()}
+
+
+def acquire_pullers(limit, batch_size):
+    """Lease tokens for new puller tasks so at most limit pull from the frontier at once.
+
+    Returns (token, countdown) pairs. When no host is due yet and nothing is
+    pulling, a single puller is leased to start once the next host is ready.
+    Leases expire after CRAWLER_FRONTIER_LEASE seconds, so pullers lost to a
+    worker crash stop counting against the limit.
+    """
+    global _lease_script
+    if _lease_script is None:
+        _lease_script = get_redis().register_script(LEASE_SCRIPT)
+    tokens = [uuid.uuid4().hex for _ in range(max(limit, 1))]
+    leased = _lease_script(
+        keys=[PULLERS_KEY, READY_KEY],
+        args=[time.time(), limit, batch_size, settings.CRAWLER_FRONTIER_LEASE, *tokens],
+    )
+    countdown = float(leased[0])
+    return [(token.decode(), countdown) for token in leased[1:]]
+
+
+def release_puller(token):
+    if token:
+        get_redis().zrem(PULLERS_KEY, token)
@@ -0,0 +1,122 @@
+import logging
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from .frontier import ACTIVE_CRAWLS_KEY, CRAWL_KEY, CRAWL_TTL
+from .models import CrawlJob
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Crawl progress lives in each crawl's Redis hash (frontier.CRAWL_KEY): the
+# frontier counts 'queued' and fetch tasks HINCRBY 'fetched', 'failed' and
+# 'bytes', one pipelined round trip per batch. flush() periodically copies the
+# crawls that changed (ACTIVE_CRAWLS_KEY) into CrawlJob rows.
+COUNTERS = ('queued', 'fetched', 'failed', 'bytes')
+
+
+class Progress:
+    """Per-crawl counter increments collected during one task."""
+
+    def __init__(self):
+        self.counts = defaultdict(Counter)
+
+    def fetched(self, crawl_id, result):
+        """Count one FetchResult against crawl_id."""
+        if result.ok:
+            self.counts[crawl_id]['fetched'] += 1
+            self.counts[crawl_id]['bytes'] += len(result.body)
+        else:
+            self.counts[crawl_id]['failed'] += 1
+
+    def failed(self, crawl_id, count=1):
+        self.counts[crawl_id]['failed'] += count
+
+    def flush(self):
+        if not self.counts:
+            return
+        with get_redis().pipeline(transaction=False) as pipe:
+            for crawl_id, counts in self.counts.items():
+                key = CRAWL_KEY.format(crawl_id)
+                for name, value in counts.items():
+                    pipe.hincrby(key, name, value)
+                pipe.expire(key, CRAWL_TTL)
+                pipe.sadd(ACTIVE_CRAWLS_KEY, crawl_id)
+            pipe.execute()
+        self.counts.clear()
+
+
+@contextmanager
+def tracking():
+    """Yield a Progress that is flushed on exit; counter failures never fail the caller."""
+    progress = Progress()
+    try:
+        yield progress
+    finally:
+        try:
+            progress.flush()
+        except Exception:
+            logger.warning('Could not record crawl progress', exc_info=True)
+
+
+def _parse(crawl_id, raw):
+    info = {k.decode(): v.decode() for k, v in raw.items()}
+    return {
+        'id': crawl_id,
+        'kind': info.get('kind', 'crawl'),
+        'seed_url': info.get('seed', ''),
+        'max_depth': int(info.get('max_depth', 0)),
+        'max_pages': int(info.get('max_pages', 0)),
+        **{name: int(info.get(name, 0)) for name in COUNTERS},
+        'created_at': datetime.fromtimestamp(float(info.get('created_at', 0)), tz=timezone.utc),
+    }
+
+
+def progress(crawl_id):
+    """A crawl's limits and counters as a dict, or None if it is unknown.
+
+    Reads the live Redis hash, falling back to the CrawlJob row once the hash
+    has expired; either is a single keyed lookup.
+    """
+    raw = get_redis().hgetall(CRAWL_KEY.format(crawl_id))
+    if raw:
+        job = _parse(crawl_id, raw)
+    else:
+        job = CrawlJob.objects.filter(id=crawl_id).values(
+            'id', 'kind', 'seed_url', 'max_depth', 'max_pages', *COUNTERS, 'created_at'
+        ).first()
+        if job is None:
+            return None
+    done = job['fetched'] + job['failed']
+    job['pending'] = max(job['queued'] - done, 0)
+    job['percent'] = round(100 * done / job['queued'], 1) if job['queued'] else 0.0
+    return job
+
+
+def flush():
+    """Copy the counters of every crawl that changed since the last flush into CrawlJob; returns the count."""
+    r = get_redis()
+    # Take the set in one step; crawls that change from here on are re-added.
+    with r.pipeline() as pipe:
+        pipe.smembers(ACTIVE_CRAWLS_KEY)
+        pipe.delete(ACTIVE_CRAWLS_KEY)
+        members, _ = pipe.execute()
+    crawl_ids = [member.decode() for member in members]
+    if not crawl_ids:
+        return 0
+    with r.pipeline(transaction=False) as pipe:
+        for crawl_id in crawl_ids:
+            pipe.hgetall(CRAWL_KEY.format(crawl_id))
+        rows = pipe.execute()
+    jobs = [CrawlJob(**_parse(crawl_id, raw)) for crawl_id, raw in zip(crawl_ids, rows) if raw]
+    try:
+        CrawlJob.objects.bulk_create(
+            jobs,
+            update_conflicts=True,
+            unique_fields=['id'],
+            update_fields=['max_pages', *COUNTERS, 'updated_at'],
+        )
+    except Exception:
+        r.sadd(ACTIVE_CRAWLS_KEY, *crawl_ids)
+        raise
+    return len(jobs)
@@ -0,0 +1,93 @@
+import logging
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Moves up to ARGV[1] items from the queue into the batch's in-flight list and
+# leases it until ARGV[2]. KEYS are the queue, the in-flight list and the leases key.
+CLAIM_SCRIPT = """
+local items = {}
+for i = 1, tonumber(ARGV[1]) do
+    local item = redis.call('LMOVE', KEYS[1], KEYS[2], 'LEFT', 'RIGHT')
+    if not item then
+        break
+    end
+    items[#items + 1] = item
+end
+if #items > 0 then
+    redis.call('ZADD', KEYS[3], ARGV[2], ARGV[3])
+end
+return items
+"""
+
+# Moves the batches of the given tokens whose lease ends by ARGV[1] back to the
+# front of the queue, in order. KEYS are the leases key, the queue and each
+# token's in-flight list; returns how many items were requeued.
+REQUEUE_SCRIPT = """
+local requeued = 0
+for j = 2, #ARGV do
+    local lease = tonumber(redis.call('ZSCORE', KEYS[1], ARGV[j]))
+    if lease and lease <= tonumber(ARGV[1]) then
+        while redis.call('LMOVE', KEYS[j + 1], KEYS[2], 'RIGHT', 'LEFT') do
+            requeued = requeued + 1
+        end
+        redis.call('ZREM', KEYS[1], ARGV[j])
+    end
+end
+return requeued
+"""
+
+
+class LeasedQueue:
+    """A Redis list whose items stay in Redis until the worker that claimed them is done.
+
+    claim() moves a batch into an in-flight list of its own, leased in a sorted
+    set; ack() drops it once it has been handled. Batches whose lease ran out
+    (the worker crashed or was killed) are moved back to the front of the
+    queue by requeue_expired().
+    """
+
+    def __init__(self, key, inflight_key, leases_key):
+        self.key = key
+        self.inflight_key = inflight_key
+        self.leases_key = leases_key
+        self._claim_script = None
+        self._requeue_script = None
+
+    def claim(self, r, size, lease):
+        """Move up to size items into a new in-flight list leased for lease seconds; returns (token, items)."""
+        if self._claim_script is None:
+            self._claim_script = r.register_script(CLAIM_SCRIPT)
+        token = uuid.uuid4().hex
+        items = self._claim_script(
+            keys=[self.key, self.inflight_key + token, self.leases_key],
+            args=[size, time.time() + lease, token],
+        )
+        return token, items
+
+    def ack(self, r, token):
+        with r.pipeline() as pipe:
+            pipe.delete(self.inflight_key + token)
+            pipe.zrem(self.leases_key, token)
+            pipe.execute()
+
+    def requeue(self, r, tokens, cutoff):
+        """Put back the batches of tokens whose lease ends by cutoff; returns the item count."""
+        if not tokens:
+            return 0
+        if self._requeue_script is None:
+            self._requeue_script = r.register_script(REQUEUE_SCRIPT)
+        return self._requeue_script(
+            keys=[self.leases_key, self.key, *(self.inflight_key + token for token in tokens)],
+            args=[cutoff, *tokens],
+        )
+
+    def requeue_expired(self, r):
+        """Put batches whose worker died before acking back on the queue; returns the item count."""
+        now = time.time()
+        tokens = [token.decode() for token in r.zrangebyscore(self.leases_key, '-inf', now)]
+        requeued = self.requeue(r, tokens, now)
+        if requeued:
+            logger.warning('Requeued %d items on %s from %d unfinished batches', requeued, self.key, len(tokens))
+        return requeued
@@ -0,0 +1,186 @@
+import json
+import math
+import time
+import uuid
+from collections import Counter
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from crawler import frontier, metrics, stages
+from crawler.models import CrawledPage
+from crawler.synthetic_site import SyntheticSite, serve
+from crawler.tasks import dispatch_frontier_pullers
+
+# Results compared against a --compare baseline: higher is better for rates,
+# lower is better for latencies.
+HIGHER_IS_BETTER = ('pages_per_sec', 'rows_per_sec')
+LOWER_IS_BETTER = ('fetch_p99', 'parse_p99')
+
+
+class Command(BaseCommand):
+    help = 'Crawl a local synthetic site with the running workers and report throughput and latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=1000)
+        parser.add_argument('--sites', type=int, default=8, help='Separate hosts the pages are spread over')
+        parser.add_argument('--links', type=int, default=8, help='Random links per page')
+        parser.add_argument('--page-kb', type=float, default=20, help='Median page size')
+        parser.add_argument('--latency-ms', type=float, default=50, help='Mean server response delay')
+        parser.add_argument('--error-rate', type=float, default=0.01, help='Share of pages answering 500')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--bind', default='127.0.0.1', help='Address the site servers listen on')
+        parser.add_argument('--host', default=None, help='Name the workers reach the servers by (default: --bind)')
+        parser.add_argument('--timeout', type=float, default=600)
+        parser.add_argument('--keep', action='store_true', help='Keep the crawled pages in the database')
+        parser.add_argument('--save', help='Write the results as JSON to this file')
+        parser.add_argument('--compare', help='Fail if results regress against this saved JSON baseline')
+        parser.add_argument('--tolerance', type=float, default=0.1, help='Allowed regression (default 10%%)')
+        parser.add_argument('--max-duplicate-rate', type=float, default=0.01,
+                            help='Fail if more of the stored pages are marked near-duplicates (default 1%%)')
+
+    def handle(self, *args, **options):
+        if settings.CRAWLER_DEFAULT_CRAWL_DELAY:
+            self.stderr.write(
+                f'Warning: CRAWLER_DEFAULT_CRAWL_DELAY={settings.CRAWLER_DEFAULT_CRAWL_DELAY}s limits each of the '
+                f'{options["sites"]} sites to one fetch per delay; run the workers with CRAWLER_DEFAULT_CRAWL_DELAY=0'
+            )
+        pages = options['pages']
+        site = SyntheticSite(
+            pages, sites=options['sites'], links=options['links'], page_kb=options['page_kb'],
+            latency_ms=options['latency_ms'], error_rate=options['error_rate'], seed=options['seed'],
+            # A fresh path per run keeps the seen filter from skipping pages crawled by earlier runs.
+            prefix=f'/run-{uuid.uuid4().hex[:8]}',
+        )
+        servers = serve(site, options['bind'], options['host'])
+        try:
+            results = self._crawl(site, options)
+        finally:
+            for server in servers:
+                server.shutdown()
+        results['duplicate_rate'] = self._duplicate_rate(site)
+        if not options['keep']:
+            self._delete_pages(site)
+
+        self._report(results)
+        if options['save']:
+            with open(options['save'], 'w') as f:
+                json.dump(results, f, indent=2)
+        # Synthetic pages share no text beyond their vocabulary, so near-duplicates
+        # mean the fingerprints or the band lookup are wrong.
+        if results['duplicate_rate'] is not None and results['duplicate_rate'] > options['max_duplicate_rate']:
+            raise CommandError(
+                f'{results["duplicate_rate"]:.1%} of pages were marked near-duplicates, '
+                f'above --max-duplicate-rate {options["max_duplicate_rate"]:.1%}'
+            )
+        if options['compare']:
+            self._compare(results, options['compare'], options['tolerance'])
+
+    def _crawl(self, site, options):
+        before = Counter(metrics.totals())
+        started = time.time()
+        # Every page is at most log2(pages) tree hops from page 0.
+        max_depth = math.ceil(math.log2(site.pages + 1))
+        crawl_id = frontier.start_crawl(site.url(0), max_depth=max_depth, max_pages=site.pages)
+        dispatch_frontier_pullers()
+
+        settled = 0
+        last_progress = started
+        while time.time() - started < options['timeout']:
+            time.sleep(1)
+            queued = int(frontier.crawl_info(crawl_id).get('queued', 0))
+            depths = stages.queue_depths()
+            idle = site.served['requests'] >= queued and not depths['parse'] and not depths['persist']
+            # Require two idle polls in a row, as a parse task may still be adding links.
+            settled = settled + 1 if idle else 0
+            if settled >= 2:
+                break
+            if time.time() - last_progress >= 5:
+                last_progress = time.time()
+                self.stderr.write(
+                    f'{site.served["requests"]}/{queued} fetched, '
+                    f'{depths["parse"]} waiting to parse, {depths["persist"]} to write'
+                )
+        else:
+            self.stderr.write(f'Timed out after {options["timeout"]:.0f}s; reporting partial results')
+        elapsed = time.time() - started
+
+        delta = Counter(metrics.totals())
+        delta.subtract(before)
+        rows = int(delta['rows_written'])
+        write_seconds = delta['persist_seconds:sum']
+
+        def percentile(name, q):
+            value = metrics.quantile(delta, name, q)
+            return None if value is None else round(value, 4)
+
+        return {
+            'params': {
+                name: options[name]
+                for name in ('pages', 'sites', 'links', 'page_kb', 'latency_ms', 'error_rate', 'seed')
+            },
+            'elapsed': round(elapsed, 2),
+            'requests': site.served['requests'],
+            'errors': site.served['errors'],
+            'megabytes': round(site.served['bytes'] / 1e6, 2),
+            'pages_per_sec': round(site.served['requests'] / elapsed, 2),
+            'fetch_p50': percentile('fetch_seconds', 0.5),
+            'fetch_p99': percentile('fetch_seconds', 0.99),
+            'parse_p50': percentile('parse_seconds', 0.5),
+            'parse_p99': percentile('parse_seconds', 0.99),
+            'rows_written': rows,
+            'rows_per_sec': round(rows / elapsed, 2),
+            'rows_per_write_sec': round(rows / write_seconds, 1) if write_seconds else None,
+            'worker_max_rss_mb': {
+                process: round(rss / 2 ** 20, 1) for process, rss in metrics.process_memory().items()
+            },
+        }
+
+    def _stored_pages(self, site):
+        """Querysets over the site's pages, 1000 URLs at a time."""
+        urls = [site.url(page) for page in range(site.pages)]
+        for start in range(0, len(urls), 1000):
+            yield CrawledPage.objects.filter(url__in=urls[start:start + 1000])
+
+    def _duplicate_rate(self, site):
+        """Share of the site's stored pages that were marked near-duplicates of another page."""
+        stored = duplicates = 0
+        for pages in self._stored_pages(site):
+            stored += pages.count()
+            duplicates += pages.exclude(canonical_url='').count()
+        return round(duplicates / stored, 4) if stored else None
+
+    def _delete_pages(self, site):
+        for pages in self._stored_pages(site):
+            pages.delete()
+
+    def _report(self, results):
+        def ms(value):
+            return '-' if value is None else f'{value * 1000:.1f} ms'
+
+        self.stdout.write(
+            f'{results["requests"]} requests ({results["errors"]} errors, {results["megabytes"]} MB) '
+            f'in {results["elapsed"]}s: {results["pages_per_sec"]} pages/s'
+        )
+        self.stdout.write(f'fetch p50 {ms(results["fetch_p50"])}, p99 {ms(results["fetch_p99"])}')
+        self.stdout.write(f'parse p50 {ms(results["parse_p50"])}, p99 {ms(results["parse_p99"])}')
+        self.stdout.write(
+            f'{results["rows_written"]} rows written: {results["rows_per_sec"]} rows/s overall, '
+            f'{results["rows_per_write_sec"] or "-"} rows/s while writing'
+        )
+        if results['duplicate_rate'] is not None:
+            self.stdout.write(f'{results["duplicate_rate"]:.2%} of stored pages marked near-duplicates')
+        for process, rss in sorted(results['worker_max_rss_mb'].items()):
+            self.stdout.write(f'{process:>30}: {rss} MB peak RSS')
+
+    def _compare(self, results, path, tolerance):
+        with open(path) as f:
+            baseline = json.load(f)
+        regressions = []
+        for name in HIGHER_IS_BETTER:
+            if baseline.get(name) and results[name] is not None and results[name] < baseline[name] * (1 - tolerance):
+                regressions.append(f'{name} {results[name]} < baseline {baseline[name]}')
+        for name in LOWER_IS_BETTER:
+            if baseline.get(name) and results[name] is not None and results[name] > baseline[name] * (1 + tolerance):
+                regressions.append(f'{name} {results[name]} > baseline {baseline[name]}')
+        if regressions:
+            raise CommandError('Regressed against baseline: ' + '; '.join(regressions))
+        self.stdout.write(f'No regression against {path} beyond {tolerance:.0%}')
@@ -0,0 +1,40 @@
+import time
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from crawler.extractors import EXTRACTORS
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the HTML extractors on a saved corpus of .html files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('corpus', help='Directory searched recursively for *.html files')
+        parser.add_argument('--limit', type=int, default=0, help='Use at most this many files')
+        parser.add_argument('--repeat', type=int, default=3, help='Passes over the corpus per extractor')
+
+    def handle(self, *args, **options):
+        paths = sorted(Path(options['corpus']).rglob('*.html'))
+        if options['limit']:
+            paths = paths[:options['limit']]
+        if not paths:
+            raise CommandError(f"No .html files under {options['corpus']}")
+        pages = [path.read_text(errors='replace') for path in paths]
+        size_mb = sum(len(page.encode()) for page in pages) / 1e6
+        self.stdout.write(f'{len(pages)} pages, {size_mb:.1f} MB, {options["repeat"]} passes')
+
+        reference = [EXTRACTORS['bs4'](page) for page in pages]
+        for name, extractor in EXTRACTORS.items():
+            best = None
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                results = [extractor(page) for page in pages]
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            matching = sum(
+                result.content == ref.content and result.links == ref.links
+                for result, ref in zip(results, reference)
+            )
+            self.stdout.write(
+                f'{name:>5}: {len(pages) / best:8.1f} pages/s  {size_mb / best:6.2f} MB/s  '
+                f'{best / len(pages) * 1000:6.2f} ms/page  {matching}/{len(pages)} match bs4'
+            )
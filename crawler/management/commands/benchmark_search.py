@@ -0,0 +1,232 @@
+import json
+import re
+import time
+from django.contrib.postgres.search import SearchQuery
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from crawler import pipeline, search
+from crawler.models import CrawledPage, PageContent
+from crawler.synthetic_site import VOCABULARY
+
+URL_PREFIX = 'https://bench.invalid/page/'
+SIZE_SUFFIXES = {'k': 1_000, 'm': 1_000_000}
+
+# Query classes by how many documents match. Words are drawn with a cubic skew
+# towards the start of VOCABULARY, so early words appear in nearly every page
+# and late ones in a few percent of them.
+QUERY_MIX = {
+    'common': [VOCABULARY[0], VOCABULARY[1], VOCABULARY[2]],
+    'medium': [VOCABULARY[100], VOCABULARY[150], VOCABULARY[200]],
+    'rare': [VOCABULARY[1900], VOCABULARY[1950], VOCABULARY[1990]],
+    'two_terms': [f'{VOCABULARY[100]} {VOCABULARY[1900]}', f'{VOCABULARY[3]} {VOCABULARY[1950]}'],
+    'missing': ['zzzqqqxxx'],
+}
+# For common words a sequential scan can legitimately beat the index; every
+# other class must be answered from the GIN index.
+GIN_REQUIRED = ('medium', 'rare', 'two_terms', 'missing')
+
+EXECUTION_TIME_RE = re.compile(r'Execution Time: ([\d.]+) ms')
+BUFFERS_RE = re.compile(r'Buffers: shared(?: hit=(\d+))?(?: read=(\d+))?')
+# A query that must use the GIN index fails if any page partition is read
+# sequentially, even when the other partitions use their index.
+PAGE_SEQ_SCAN_RE = re.compile(rf'Seq Scan on ({CrawledPage._meta.db_table}(?:_p\d+)?)\b')
+
+GENERATED = {
+    'title': "'Benchmark page ' || g",
+    # Newest first in g order, one second apart.
+    'crawled_at': "now() - g * interval '1 second'",
+    'updated_at': 'now()',
+}
+
+
+def parse_size(value):
+    value = value.strip().lower()
+    multiplier = SIZE_SUFFIXES.get(value[-1:], 1)
+    number = value[:-1] if value[-1:] in SIZE_SUFFIXES else value
+    return int(float(number) * multiplier)
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def index_names(fields):
+    """The model index on fields plus its per-partition copies, which are what plans name."""
+    name = next(index.name for index in CrawledPage._meta.indexes if list(index.fields) == fields)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = %s::regclass',
+            [name],
+        )
+        return [name] + [row[0] for row in cursor.fetchall()]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark full-text search and the latest-pages listing on a synthetic corpus'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=parse_size, default=parse_size('10k'),
+                            help='Synthetic corpus size, e.g. 10k, 1M or 10M (only missing rows are generated)')
+        parser.add_argument('--words', type=int, default=200, help='Mean words per synthetic page')
+        parser.add_argument('--batch-size', type=int, default=50_000, help='Rows inserted per statement')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per query and operation')
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every EXPLAIN plan in full')
+        parser.add_argument('--save', help='Write the results as JSON to this file')
+        parser.add_argument('--drop', action='store_true', help='Delete the synthetic corpus and exit')
+
+    def handle(self, *args, **options):
+        if options['drop']:
+            deleted = self._delete_corpus()
+            self.stdout.write(f'Deleted {deleted} synthetic pages')
+            return
+        self._generate(options['rows'], options['words'], options['batch_size'])
+        latencies = self._time_queries(options['repeat'])
+        plans, failures = self._explain(options['verbose_plans'])
+        if options['save']:
+            with open(options['save'], 'w') as f:
+                json.dump({'rows': options['rows'], 'latency_ms': latencies, 'plans': plans}, f, indent=2)
+        if failures:
+            raise CommandError('Index not used: ' + '; '.join(failures))
+
+    def _delete_corpus(self):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {PageContent._meta.db_table} WHERE url LIKE %s', [URL_PREFIX + '%'])
+            cursor.execute(
+                f'DELETE FROM {CrawledPage._meta.db_table} WHERE url LIKE %s', [URL_PREFIX + '%']
+            )
+            return cursor.rowcount
+
+    def _generate(self, rows, words, batch_size):
+        existing = CrawledPage.objects.filter(url__startswith=URL_PREFIX).count()
+        if existing >= rows:
+            self.stdout.write(f'Corpus has {existing} synthetic pages')
+            return
+        self.stdout.write(f'Generating {rows - existing} synthetic pages ({existing} exist)')
+
+        # Synthetic values for the columns that matter to search; everything
+        # else takes the model's default, so new columns need no changes here.
+        expressions, params = [], []
+        for field in CrawledPage._meta.concrete_fields:
+            if field.primary_key or field.name == 'search_vector':
+                continue
+            if field.name == 'url':
+                expressions.append('%s || g')
+                params.append(URL_PREFIX)
+            elif field.name in GENERATED:
+                expressions.append(GENERATED[field.name])
+            else:
+                expressions.append(f'%s::{field.db_type(connection)}')
+                params.append(field.get_db_prep_save(field.get_default(), connection))
+        columns = [
+            connection.ops.quote_name(field.column) for field in CrawledPage._meta.concrete_fields
+            if not field.primary_key and field.name != 'search_vector'
+        ]
+        sql = (
+            f'INSERT INTO {CrawledPage._meta.db_table} ({", ".join(columns)}) '
+            f'SELECT {", ".join(expressions)} FROM generate_series(%s, %s) AS g'
+        )
+        # Content goes in first, as in the crawl pipeline, so the search_vector
+        # trigger tokenizes it when the page row is inserted; like the pipeline,
+        # each batch tells the content trigger not to refresh the pages itself.
+        content_sql = (
+            f'WITH v AS (SELECT %s::text[] AS words) '
+            f'INSERT INTO {PageContent._meta.db_table} (url, content) '
+            f'SELECT %s || g, '
+            # An aggregate over only outer columns would belong to the outer
+            # query, so the words are collected with ARRAY() per page instead.
+            f'array_to_string(ARRAY(SELECT v.words[1 + floor(power(random(), 3) * cardinality(v.words))::int] '
+            f"FROM generate_series(1, %s + g %% %s) AS i), ' ') "
+            f'FROM v, generate_series(%s, %s) AS g'
+        )
+
+        started = time.perf_counter()
+        for start in range(existing + 1, rows + 1, batch_size):
+            end = min(start + batch_size - 1, rows)
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(pipeline.UPSERT_FOLLOWS_SQL, ['on'])
+                cursor.execute(content_sql, [VOCABULARY, URL_PREFIX, words // 2, words + 1, start, end])
+                cursor.execute(sql, params + [start, end])
+            rate = (end - existing) / (time.perf_counter() - started)
+            self.stderr.write(f'{end}/{rows} pages ({rate:.0f} rows/s)')
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {CrawledPage._meta.db_table}')
+            cursor.execute(f'ANALYZE {PageContent._meta.db_table}')
+
+    def _time_queries(self, repeat):
+        cursors = {
+            query: search.search_after(query, fields=('id',))[1]
+            for queries in QUERY_MIX.values() for query in queries
+        }
+        operations = {
+            'search page 1': lambda q: search.search_pages(q, 1),
+            'search page 10': lambda q: search.search_pages(q, 10),
+            'search_after first': lambda q: search.search_after(q),
+            'search_after next': lambda q: search.search_after(q, cursors[q]),
+        }
+        latencies = {}
+        self.stdout.write(f'{"operation":<20} {"query class":<10} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}')
+        for operation, run in operations.items():
+            for query_class, queries in QUERY_MIX.items():
+                latencies[f'{operation} / {query_class}'] = self._measure(
+                    operation, query_class, [lambda q=q: run(q) for q in queries], repeat
+                )
+        latencies['latest'] = self._measure('latest', '-', [search.latest_pages], repeat)
+        return latencies
+
+    def _measure(self, operation, query_class, calls, repeat):
+        for call in calls:
+            call()  # warm up caches and the connection
+        samples = []
+        for _ in range(repeat):
+            for call in calls:
+                start = time.perf_counter()
+                call()
+                samples.append((time.perf_counter() - start) * 1000)
+        result = {f'p{int(q * 100)}': round(percentile(samples, q), 2) for q in (0.5, 0.95, 0.99)}
+        self.stdout.write(
+            f'{operation:<20} {query_class:<10} {result["p50"]:>9.2f} {result["p95"]:>9.2f} {result["p99"]:>9.2f}'
+        )
+        return result
+
+    def _explain(self, verbose):
+        gin_index = index_names(['search_vector'])
+        crawled_index = index_names(['-crawled_at'])
+        checks = [
+            (f'search / {query_class}', search.ranked_ids(SearchQuery(queries[0]), 0, search.RESULTS_PER_PAGE + 1),
+             gin_index if query_class in GIN_REQUIRED else None)
+            for query_class, queries in QUERY_MIX.items()
+        ]
+        checks.append(('latest', search.latest_queryset(), crawled_index))
+
+        plans = {}
+        failures = []
+        self.stdout.write('')
+        self.stdout.write(f'{"plan":<20} {"exec ms":>9} {"hit":>9} {"read":>9}  index')
+        for name, queryset, required in checks:
+            plan = queryset.explain(analyze=True, buffers=True)
+            execution = EXECUTION_TIME_RE.search(plan)
+            buffers = BUFFERS_RE.search(plan)
+            plans[name] = {
+                'execution_ms': float(execution.group(1)) if execution else None,
+                'shared_hit': int(buffers.group(1) or 0) if buffers else 0,
+                'shared_read': int(buffers.group(2) or 0) if buffers else 0,
+                'plan': plan,
+            }
+            seq_scans = sorted(set(PAGE_SEQ_SCAN_RE.findall(plan))) if required else []
+            used = required is None or (any(index in plan for index in required) and not seq_scans)
+            if seq_scans:
+                problem = f'Seq Scan on {", ".join(seq_scans)}'
+            elif not used:
+                problem = f'does not use {required[0]}'
+            if not used:
+                failures.append(f'{name} {problem}')
+            status = '-' if required is None else ('ok' if used else f'NOT USED: {problem}')
+            self.stdout.write(
+                f'{name:<20} {plans[name]["execution_ms"] or 0:>9.2f} '
+                f'{plans[name]["shared_hit"]:>9} {plans[name]["shared_read"]:>9}  {status}'
+            )
+            if verbose or not used:
+                self.stdout.write(plan)
+        return plans, failures
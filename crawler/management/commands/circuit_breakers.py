@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from crawler import breaker
+
+
+class Command(BaseCommand):
+    help = 'List hosts whose circuit breaker is open, or close the breakers of the given hosts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--close', nargs='+', metavar='HOST', help='Hosts to fetch again right away')
+
+    def handle(self, *args, **options):
+        if options['close']:
+            closed = breaker.close(options['close'])
+            self.stdout.write(f'Closed {closed} open circuit breakers')
+            return
+        hosts = breaker.open_hosts()
+        for host, seconds in sorted(hosts.items(), key=lambda item: -item[1]):
+            self.stdout.write(f'{host:>40}: {seconds:.0f}s left')
+        self.stdout.write(f'{len(hosts)} hosts open')
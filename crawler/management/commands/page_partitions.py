@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError
+from crawler import partitions
+
+
+class Command(BaseCommand):
+    help = 'List, create, detach or re-attach the partitions of the page and content tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', nargs='?', default='list', choices=['list', 'ensure', 'detach', 'attach'])
+        parser.add_argument('names', nargs='*', help='Content partitions to detach or attach')
+        parser.add_argument('--older-than', type=int, metavar='MONTHS',
+                            help='Detach every content partition older than this many months')
+        parser.add_argument('--ahead', type=int, help='Months of content partitions to create in advance')
+
+    def handle(self, *args, **options):
+        action = options['action']
+        if action == 'list':
+            self._list()
+        elif action == 'ensure':
+            ahead = options['ahead'] if options['ahead'] is not None else settings.CRAWLER_CONTENT_PARTITIONS_AHEAD
+            for name in partitions.ensure_content_partitions(ahead):
+                self.stdout.write(f'Created {name}')
+        else:
+            names = options['names']
+            if action == 'detach' and options['older_than'] is not None:
+                names = names + partitions.stale_partitions(options['older_than'])
+            if not names:
+                hint = ' or pass --older-than' if action == 'detach' else ''
+                raise CommandError(f'Name the partitions to {action}{hint}')
+            for name in names:
+                try:
+                    getattr(partitions, action)(name)
+                except ValueError as e:
+                    raise CommandError(str(e))
+                except OperationalError as e:
+                    raise CommandError(f'Could not {action} {name}, retry when page writes are quieter: {e}')
+                self.stdout.write(f'{action.capitalize()}ed {name}')
+
+    def _list(self):
+        self.stdout.write('Page partitions (hash on url):')
+        for name, size, rows in partitions.page_partitions():
+            self.stdout.write(f'  {name:<36} {rows:>12} rows {size / 2 ** 20:>10.1f} MB')
+        self.stdout.write('Content partitions (by month written):')
+        for partition in partitions.content_partitions():
+            state = '' if partition['attached'] else '  (detached)'
+            self.stdout.write(
+                f'  {partition["name"]:<36} {partition["rows"]:>12} rows '
+                f'{partition["bytes"] / 2 ** 20:>10.1f} MB{state}'
+            )
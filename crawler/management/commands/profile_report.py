@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from crawler import profiling
+
+GROUPS = ('worker', 'domain', 'stage')
+
+
+class Command(BaseCommand):
+    help = 'Show where profiled crawl tasks spent their time (run workers with CRAWLER_PROFILE=True)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--by', default='stage',
+                            help=f'Comma-separated grouping, any of {", ".join(GROUPS)} (default: stage)')
+        parser.add_argument('--top', type=int, default=30, help='Rows to show')
+        parser.add_argument('--functions', type=int, default=0,
+                            help='Also show this many functions from the cProfile samples')
+        parser.add_argument('--sort', choices=profiling.FUNCTION_STATS, default='tottime')
+        parser.add_argument('--reset', action='store_true', help='Clear the recorded profile and exit')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            profiling.reset()
+            self.stdout.write('Profile cleared')
+            return
+        group_by = tuple(name.strip() for name in options['by'].split(',') if name.strip())
+        unknown = set(group_by) - set(GROUPS)
+        if unknown or not group_by:
+            raise CommandError(f'--by takes {", ".join(GROUPS)}')
+
+        rows = profiling.stage_report(group_by)
+        if not rows:
+            self.stdout.write('Nothing recorded yet')
+            return
+        total = sum(seconds for _, _, seconds in rows)
+        self.stdout.write(f'{" / ".join(group_by):<50} {"calls":>10} {"seconds":>10} {"ms/call":>9} {"share":>6}')
+        for key, calls, seconds in rows[:options['top']]:
+            label = ' / '.join(part or '-' for part in key)
+            self.stdout.write(
+                f'{label[:50]:<50} {calls:>10} {seconds:>10.2f} '
+                f'{seconds / calls * 1000 if calls else 0:>9.2f} {seconds / total:>6.1%}'
+            )
+
+        if options['functions']:
+            self.stdout.write('')
+            self.stdout.write(f'{"function":<70} {"calls":>10} {"tottime":>9} {"cumtime":>9}')
+            for function, calls, tottime, cumtime in profiling.function_report(options['functions'], options['sort']):
+                self.stdout.write(f'{function[-70:]:<70} {calls:>10} {tottime:>9.3f} {cumtime:>9.3f}')
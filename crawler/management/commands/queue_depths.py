@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from crawler.stages import queue_depths
+
+
+class Command(BaseCommand):
+    help = 'Show how many items are waiting in front of each crawl stage'
+
+    def handle(self, *args, **options):
+        for name, depth in queue_depths().items():
+            self.stdout.write(f'{name:>14}: {depth}')
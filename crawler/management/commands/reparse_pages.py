@@ -0,0 +1,47 @@
+import time
+from django.core.management.base import BaseCommand
+from crawler import archive, stages
+from crawler.models import CrawledPage
+from crawler.tasks import parse_pages_task
+from crawler.fetcher import decode_body
+
+
+class Command(BaseCommand):
+    help = 'Re-extract stored pages from the raw archive without re-fetching them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        rows = CrawledPage.objects.exclude(archive_segment='').order_by('id').values(
+            'url', 'status_code', 'etag', 'last_modified', 'content_hash', 'last_checked_at',
+            'refresh_interval', 'archive_segment', 'archive_offset', 'archive_length',
+        )
+        batch = []
+        queued = 0
+        for row in rows.iterator(chunk_size=options['batch_size']):
+            try:
+                content_type, body = archive.read(row['archive_segment'], row['archive_offset'], row['archive_length'])
+            except OSError as e:
+                self.stderr.write(f"Skipping {row['url']}: {e}")
+                continue
+            checked_at = row.pop('last_checked_at')
+            batch.append({
+                **row,
+                'text': decode_body(body, content_type),
+                'checked_at': checked_at.timestamp() if checked_at else time.time(),
+                'refresh_interval': row['refresh_interval'].total_seconds(),
+                'store': True,
+                'crawl': None,
+            })
+            if len(batch) >= options['batch_size']:
+                queued += self._queue(batch)
+                batch = []
+        if batch:
+            queued += self._queue(batch)
+        self.stdout.write(f'Queued {queued} archived pages for the parse stage')
+
+    def _queue(self, batch):
+        stages.push_raw(batch)
+        parse_pages_task.delay()
+        return len(batch)
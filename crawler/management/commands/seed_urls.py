@@ -0,0 +1,43 @@
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from crawler import seeds
+from crawler.tasks import dispatch_frontier_pullers
+
+
+class Command(BaseCommand):
+    help = 'Start a crawl seeded from a list of URLs, one per line (plain or gzipped; "-" reads stdin)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-')
+        parser.add_argument('--max-depth', type=int, default=None)
+        parser.add_argument('--max-pages', type=int, default=None,
+                            help='Budget for pages discovered from the seeds (the seeds themselves are extra)')
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        if options['path'] == '-':
+            fileobj = sys.stdin.buffer
+        else:
+            try:
+                fileobj = open(options['path'], 'rb')
+            except OSError as e:
+                raise CommandError(e)
+        started = time.perf_counter()
+
+        def progress(result):
+            dispatch_frontier_pullers()
+            self.stderr.write(f'{result.read} read, {result.queued} queued')
+
+        with fileobj:
+            result = seeds.ingest(
+                seeds.open_seed_stream(fileobj),
+                max_depth=options['max_depth'],
+                max_pages=options['max_pages'],
+                batch_size=options['batch_size'],
+                on_batch=progress,
+            )
+        self.stdout.write(
+            f'Crawl {result.crawl_id}: queued {result.queued} of {result.read} URLs '
+            f'in {time.perf_counter() - started:.1f}s'
+        )
@@ -0,0 +1,357 @@
+import logging
+import os
+import resource
+import socket
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Workers add to two hashes: one per CRAWLER_METRICS_BUCKET_SECONDS window, which
+# expires after CRAWLER_METRICS_RETENTION and feeds the dashboard's time series,
+# and a running total that backs the Prometheus counters.
+BUCKET_KEY = 'crawler:metrics:{}'
+TOTALS_KEY = 'crawler:metrics:totals'
+# Peak resident memory in bytes of each worker process, one key per 'host:pid'
+# that expires CRAWLER_METRICS_PROCESS_TTL seconds after the process last recorded it.
+MEMORY_KEY = 'crawler:metrics:max_rss:'
+# psycopg pool statistics of each process: one hash per 'host:pid' with
+# 'database|stat' fields, expiring like MEMORY_KEY.
+POOL_KEY = 'crawler:metrics:db_pool:'
+# Pool stats that are current levels; the rest count up from the pool's creation.
+POOL_GAUGES = ('pool_min', 'pool_max', 'pool_size', 'pool_available', 'requests_waiting')
+POOL_COUNTERS = (
+    'requests_num', 'requests_queued', 'requests_wait_ms', 'requests_errors',
+    'connections_num', 'connections_ms', 'connections_errors', 'connections_lost',
+)
+
+# Histogram upper bounds in seconds. Each observation increments the
+# '<name>:le:<bound>' field of the first bound it fits under.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+HISTOGRAMS = ('fetch_seconds', 'parse_seconds', 'persist_seconds')
+
+WORKER = socket.gethostname()
+
+# Counts made outside a Recorder since this process last flushed metrics:
+# connections opened outside a pool and robots.txt lookups.
+_pending = Counter()
+
+
+def count(name, amount=1):
+    """Add to a counter that is written with this process's next metrics flush."""
+    _pending[name] += amount
+
+
+def _take_pending():
+    global _pending
+    pending, _pending = _pending, Counter()
+    return pending
+
+
+def _count_connection(sender, connection, **kwargs):
+    if not connection.settings_dict['OPTIONS'].get('pool'):
+        count('db_connections_opened')
+
+
+connection_created.connect(_count_connection)
+
+
+class Recorder:
+    """Collects counters and latencies locally and writes them in one pipelined round trip."""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.sums = Counter()
+
+    def incr(self, name, amount=1):
+        self.counts[name] += amount
+
+    def observe(self, name, seconds):
+        bound = next((b for b in LATENCY_BUCKETS if seconds <= b), '+Inf')
+        self.counts[f'{name}:le:{bound}'] += 1
+        self.counts[f'{name}:count'] += 1
+        self.sums[f'{name}:sum'] += seconds
+
+    def fetched(self, result):
+        """Record one FetchResult."""
+        self.observe('fetch_seconds', result.elapsed)
+        self.incr(f'status:{result.status_code or "error"}')
+        if result.ok:
+            self.incr('pages_fetched')
+            self.incr(f'worker:{WORKER}:pages_fetched')
+            self.incr('bytes_fetched', len(result.body))
+        else:
+            self.incr('fetch_errors')
+
+    def flush(self):
+        if not self.counts and not self.sums:
+            return
+        self.counts.update(_take_pending())
+        bucket = int(time.time() // settings.CRAWLER_METRICS_BUCKET_SECONDS)
+        key = BUCKET_KEY.format(bucket)
+        with get_redis().pipeline(transaction=False) as pipe:
+            for target in (key, TOTALS_KEY):
+                for field, value in self.counts.items():
+                    pipe.hincrby(target, field, value)
+                for field, value in self.sums.items():
+                    pipe.hincrbyfloat(target, field, value)
+            pipe.expire(key, settings.CRAWLER_METRICS_RETENTION)
+            _add_process_stats(pipe)
+            pipe.execute()
+        self.counts.clear()
+        self.sums.clear()
+
+
+def max_rss():
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def db_pool_stats():
+    """{database alias: psycopg pool stats} for the pools this process has opened."""
+    return {
+        connection.alias: connection.pool.get_stats()
+        for connection in connections.all(initialized_only=True)
+        if connection.settings_dict['OPTIONS'].get('pool')
+    }
+
+
+def _add_process_stats(pipe):
+    process = f'{WORKER}:{os.getpid()}'
+    pipe.set(MEMORY_KEY + process, max_rss(), ex=settings.CRAWLER_METRICS_PROCESS_TTL)
+    fields = {
+        f'{alias}|{stat}': stats.get(stat, 0)
+        for alias, stats in db_pool_stats().items() for stat in POOL_GAUGES + POOL_COUNTERS
+    }
+    if fields:
+        pipe.hset(POOL_KEY + process, mapping=fields)
+        pipe.expire(POOL_KEY + process, settings.CRAWLER_METRICS_PROCESS_TTL)
+
+
+def record_process():
+    """Save this process's peak memory, pool stats and pending counts.
+
+    Workers do this on every metrics flush; web processes call it when serving /metrics.
+    """
+    with get_redis().pipeline(transaction=False) as pipe:
+        _add_process_stats(pipe)
+        for field, value in _take_pending().items():
+            pipe.hincrby(TOTALS_KEY, field, value)
+        pipe.execute()
+
+
+def pool_stats():
+    """{(process, database): {stat: value}} as last recorded by each process that recorded recently."""
+    r = get_redis()
+    keys = list(r.scan_iter(match=POOL_KEY + '*', count=1000))
+    with r.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.hgetall(key)
+        hashes = pipe.execute()
+    stats = defaultdict(dict)
+    for key, fields in zip(keys, hashes):
+        process = key.decode()[len(POOL_KEY):]
+        for field, value in fields.items():
+            database, stat = field.decode().split('|')
+            stats[process, database][stat] = int(value)
+    return stats
+
+
+def process_memory():
+    """Peak RSS in bytes of each process that recorded metrics recently, keyed 'host:pid'."""
+    r = get_redis()
+    keys = list(r.scan_iter(match=MEMORY_KEY + '*', count=1000))
+    values = r.mget(keys) if keys else []
+    return {
+        key.decode()[len(MEMORY_KEY):]: int(value)
+        for key, value in zip(keys, values) if value is not None
+    }
+
+
+def totals():
+    return _decode(get_redis().hgetall(TOTALS_KEY))
+
+
+@contextmanager
+def recording():
+    """Yield a Recorder that is flushed on exit; metrics failures never fail the caller."""
+    recorder = Recorder()
+    try:
+        yield recorder
+    finally:
+        try:
+            recorder.flush()
+        except Exception:
+            logger.warning('Could not record crawl metrics', exc_info=True)
+
+
+def _decode(raw):
+    return {k.decode(): float(v) for k, v in raw.items()}
+
+
+def quantile(values, name, q):
+    """Estimate the q-quantile of a histogram, interpolating inside the bucket it falls in."""
+    total = values.get(f'{name}:count', 0)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    lower = 0
+    for bound in LATENCY_BUCKETS:
+        count = values.get(f'{name}:le:{bound}', 0)
+        if seen + count >= rank:
+            return lower + (bound - lower) * (rank - seen) / count
+        seen += count
+        lower = bound
+    return LATENCY_BUCKETS[-1]
+
+
+def _summarize(values, seconds):
+    summary = {
+        'pages_fetched': int(values.get('pages_fetched', 0)),
+        'pages_parsed': int(values.get('pages_parsed', 0)),
+        'rows_written': int(values.get('rows_written', 0)),
+        'fetch_errors': int(values.get('fetch_errors', 0)),
+        'bytes_fetched': int(values.get('bytes_fetched', 0)),
+        'pages_per_sec': round(values.get('pages_fetched', 0) / seconds, 2),
+    }
+    for name in HISTOGRAMS:
+        for label, q in (('p50', 0.5), ('p99', 0.99)):
+            value = quantile(values, name, q)
+            summary[f'{name}_{label}'] = None if value is None else round(value, 4)
+    return summary
+
+
+def series(buckets=30):
+    """Per-bucket summaries of the last buckets windows, oldest first, including idle ones."""
+    width = settings.CRAWLER_METRICS_BUCKET_SECONDS
+    current = int(time.time() // width)
+    numbers = range(current - buckets + 1, current + 1)
+    with get_redis().pipeline(transaction=False) as pipe:
+        for number in numbers:
+            pipe.hgetall(BUCKET_KEY.format(number))
+        rows = pipe.execute()
+    points = []
+    for number, raw in zip(numbers, rows):
+        # The current bucket is still filling; rate it over the time elapsed so far.
+        seconds = time.time() - number * width if number == current else width
+        point = _summarize(_decode(raw), max(seconds, 1))
+        point['time'] = datetime.fromtimestamp(number * width).strftime('%H:%M')
+        points.append(point)
+    return points
+
+
+def window(buckets=30):
+    """One summary over the last buckets windows, plus per-worker and per-status counts."""
+    width = settings.CRAWLER_METRICS_BUCKET_SECONDS
+    current = int(time.time() // width)
+    with get_redis().pipeline(transaction=False) as pipe:
+        for number in range(current - buckets + 1, current + 1):
+            pipe.hgetall(BUCKET_KEY.format(number))
+        rows = pipe.execute()
+    values = Counter()
+    for raw in rows:
+        values.update(_decode(raw))
+    summary = _summarize(values, buckets * width)
+    summary['workers'] = {
+        field.split(':')[1]: int(value)
+        for field, value in values.items() if field.startswith('worker:') and field.endswith(':pages_fetched')
+    }
+    summary['statuses'] = {
+        field.split(':', 1)[1]: int(value)
+        for field, value in values.items() if field.startswith('status:')
+    }
+    return summary
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render_prometheus(queue_depths=None):
+    """Totals in the Prometheus text exposition format, plus the given queue depths as gauges."""
+    values = totals()
+    counters = {}
+    statuses = {}
+    robots = {}
+    workers = defaultdict(dict)
+    histograms = defaultdict(dict)
+    for field, value in values.items():
+        name, _, rest = field.partition(':')
+        if name in HISTOGRAMS:
+            histograms[name][rest] = value
+        elif name == 'status':
+            statuses[rest] = value
+        elif name == 'robots':
+            robots[rest] = value
+        elif name == 'worker':
+            worker, _, counter = rest.rpartition(':')
+            workers[counter][worker] = value
+        else:
+            counters[name] = value
+
+    lines = []
+    for name, value in sorted(counters.items()):
+        lines += [f'# TYPE crawler_{name}_total counter', f'crawler_{name}_total {_number(value)}']
+    if statuses:
+        lines.append('# TYPE crawler_fetch_status_total counter')
+        lines += [
+            f'crawler_fetch_status_total{{code="{_label(code)}"}} {_number(value)}'
+            for code, value in sorted(statuses.items())
+        ]
+    if robots:
+        lines.append('# TYPE crawler_robots_lookups_total counter')
+        lines += [
+            f'crawler_robots_lookups_total{{source="{_label(source)}"}} {_number(value)}'
+            for source, value in sorted(robots.items())
+        ]
+    for counter, by_worker in sorted(workers.items()):
+        lines.append(f'# TYPE crawler_worker_{counter}_total counter')
+        lines += [
+            f'crawler_worker_{counter}_total{{worker="{_label(worker)}"}} {_number(value)}'
+            for worker, value in sorted(by_worker.items())
+        ]
+    for name, fields in sorted(histograms.items()):
+        lines.append(f'# TYPE crawler_{name} histogram')
+        cumulative = 0
+        for bound in LATENCY_BUCKETS + ('+Inf',):
+            cumulative += fields.get(f'le:{bound}', 0)
+            lines.append(f'crawler_{name}_bucket{{le="{bound}"}} {_number(cumulative)}')
+        lines.append(f'crawler_{name}_sum {_number(fields.get("sum", 0))}')
+        lines.append(f'crawler_{name}_count {_number(fields.get("count", 0))}')
+    memory = process_memory()
+    if memory:
+        lines.append('# TYPE crawler_worker_max_rss_bytes gauge')
+        lines += [
+            f'crawler_worker_max_rss_bytes{{process="{_label(process)}"}} {value}'
+            for process, value in sorted(memory.items())
+        ]
+    pools = pool_stats()
+    for stat in POOL_GAUGES + POOL_COUNTERS if pools else ():
+        name = f'crawler_db_pool_{stat.removeprefix("pool_")}'
+        if stat in POOL_GAUGES:
+            lines.append(f'# TYPE {name} gauge')
+        else:
+            name += '_total'
+            lines.append(f'# TYPE {name} counter')
+        lines += [
+            f'{name}{{process="{_label(process)}",database="{_label(database)}"}} {_number(values.get(stat, 0))}'
+            for (process, database), values in sorted(pools.items())
+        ]
+    if queue_depths:
+        lines.append('# TYPE crawler_queue_depth gauge')
+        lines += [
+            f'crawler_queue_depth{{queue="{_label(queue)}"}} {_number(value)}'
+            for queue, value in sorted(queue_depths.items())
+        ]
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,51 @@
+from django.db import migrations
+
+
+# search_vector is maintained by the database so every write path (save(),
+# bulk_create, QuerySet.update, raw SQL) keeps it in sync in one round trip.
+# The update trigger only re-tokenizes when title or content actually change,
+# or when an ORM save() writes back a stale/NULL vector from a Python instance.
+CREATE_TRIGGER = """
+CREATE FUNCTION crawler_crawledpage_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector(COALESCE(NEW.title, '')), 'A') ||
+        setweight(to_tsvector(COALESCE(NEW.content, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER crawler_crawledpage_search_vector_insert
+    BEFORE INSERT ON crawler_crawledpage
+    FOR EACH ROW EXECUTE FUNCTION crawler_crawledpage_search_vector_update();
+
+CREATE TRIGGER crawler_crawledpage_search_vector_update
+    BEFORE UPDATE OF title, content, search_vector ON crawler_crawledpage
+    FOR EACH ROW
+    WHEN (OLD.title IS DISTINCT FROM NEW.title
+          OR OLD.content IS DISTINCT FROM NEW.content
+          OR OLD.search_vector IS DISTINCT FROM NEW.search_vector)
+    EXECUTE FUNCTION crawler_crawledpage_search_vector_update();
+
+UPDATE crawler_crawledpage SET search_vector =
+    setweight(to_tsvector(COALESCE(title, '')), 'A') ||
+    setweight(to_tsvector(COALESCE(content, '')), 'B')
+WHERE search_vector IS NULL;
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER IF EXISTS crawler_crawledpage_search_vector_update ON crawler_crawledpage;
+DROP TRIGGER IF EXISTS crawler_crawledpage_search_vector_insert ON crawler_crawledpage;
+DROP FUNCTION IF EXISTS crawler_crawledpage_search_vector_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0002_alter_crawledpage_options_crawledpage_updated_at_and_more'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:49
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0003_crawledpage_search_vector_trigger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawledpage',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='crawledpage',
+            name='etag',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='crawledpage',
+            name='last_checked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='crawledpage',
+            name='last_modified',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='crawledpage',
+            name='next_crawl_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='crawledpage',
+            name='refresh_interval',
+            field=models.DurationField(default=datetime.timedelta(days=1)),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0004_crawledpage_freshness'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawledpage',
+            name='archive_length',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='crawledpage',
+            name='archive_offset',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='crawledpage',
+            name='archive_segment',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:59
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0005_crawledpage_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawledpage',
+            name='canonical_url',
+            field=models.URLField(blank=True, max_length=1000),
+        ),
+        migrations.AddField(
+            model_name='crawledpage',
+            name='simhash',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='crawledpage',
+            name='simhash_bands',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), blank=True, default=list, size=None),
+        ),
+        migrations.AddIndex(
+            model_name='crawledpage',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['simhash_bands'], name='crawler_cra_simhash_4372d7_gin'),
+        ),
+    ]
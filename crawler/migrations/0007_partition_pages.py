@@ -0,0 +1,226 @@
+import importlib
+from datetime import datetime, timezone
+import django.utils.timezone
+from django.db import migrations, models
+
+
+# Splits extracted text out of crawler_crawledpage into crawler_pagecontent,
+# range-partitioned by the month it was written, and rebuilds the page table
+# hash-partitioned on url (see crawler.partitions). Postgres requires the
+# partition key in every unique constraint, so the primary key becomes
+# (id, url); ids still come from one sequence and stay unique, and Django
+# keeps treating id as the primary key.
+PAGE_PARTITIONS = 16
+MONTHS_AHEAD = 2
+
+CREATE_CONTENT_TABLE = """
+CREATE TABLE crawler_pagecontent (
+    url varchar(1000) NOT NULL,
+    content text NOT NULL,
+    written_at timestamp with time zone NOT NULL DEFAULT now(),
+    PRIMARY KEY (url, written_at)
+) PARTITION BY RANGE (written_at);
+"""
+
+# The page row's vector still covers title and content. Writers store the
+# content first and then upsert the page (crawler.pipeline.write_pages), which
+# always moves updated_at, so the update trigger re-tokenizes the new text.
+# Migration 0013 skips the insert trigger's work for urls that already exist
+# and refreshes the vector when content is written without a page upsert.
+CREATE_TRIGGERS = """
+CREATE OR REPLACE FUNCTION crawler_crawledpage_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector(COALESCE(NEW.title, '')), 'A') ||
+        setweight(to_tsvector(COALESCE((
+            SELECT content FROM crawler_pagecontent
+            WHERE url = NEW.url ORDER BY written_at DESC LIMIT 1
+        ), '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION crawler_crawledpage_content_delete() RETURNS trigger AS $$
+BEGIN
+    DELETE FROM crawler_pagecontent WHERE url = OLD.url;
+    RETURN OLD;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER crawler_crawledpage_search_vector_insert
+    BEFORE INSERT ON crawler_crawledpage
+    FOR EACH ROW EXECUTE FUNCTION crawler_crawledpage_search_vector_update();
+
+CREATE TRIGGER crawler_crawledpage_search_vector_update
+    BEFORE UPDATE OF title, updated_at, search_vector ON crawler_crawledpage
+    FOR EACH ROW
+    WHEN (OLD.title IS DISTINCT FROM NEW.title
+          OR OLD.updated_at IS DISTINCT FROM NEW.updated_at
+          OR OLD.search_vector IS DISTINCT FROM NEW.search_vector)
+    EXECUTE FUNCTION crawler_crawledpage_search_vector_update();
+
+CREATE TRIGGER crawler_crawledpage_content_delete
+    AFTER DELETE ON crawler_crawledpage
+    FOR EACH ROW EXECUTE FUNCTION crawler_crawledpage_content_delete();
+"""
+
+DROP_TRIGGERS = """
+DROP FUNCTION IF EXISTS crawler_crawledpage_content_delete() CASCADE;
+DROP FUNCTION IF EXISTS crawler_crawledpage_search_vector_update() CASCADE;
+"""
+
+
+def _add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def _create_content_partitions(cursor, first, last):
+    month = datetime(first.year, first.month, 1, tzinfo=timezone.utc)
+    while month <= last:
+        following = _add_months(month, 1)
+        cursor.execute(
+            f'CREATE TABLE crawler_pagecontent_y{month:%Y}m{month:%m} PARTITION OF crawler_pagecontent '
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{following.isoformat()}')"
+        )
+        month = following
+
+
+def _indexes(cursor):
+    """(name, definition, constraint type, constraint definition) of each index on the page table."""
+    cursor.execute("""
+        SELECT i.relname, pg_get_indexdef(x.indexrelid), c.contype, pg_get_constraintdef(c.oid)
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        LEFT JOIN pg_constraint c ON c.conindid = x.indexrelid AND c.conrelid = x.indrelid
+        WHERE x.indrelid = 'crawler_crawledpage'::regclass
+    """)
+    return cursor.fetchall()
+
+
+def _columns(cursor, table):
+    cursor.execute(
+        'SELECT column_name FROM information_schema.columns WHERE table_name = %s ORDER BY ordinal_position',
+        [table],
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _rebuild_page_table(cursor, quote, partitioned):
+    """Recreate crawler_crawledpage under the same index and constraint names, then copy it over.
+
+    Leaves the previous table as crawler_crawledpage_old, with its indexes
+    renamed out of the way, for the caller to read from and drop.
+    """
+    indexes = _indexes(cursor)
+    cursor.execute('ALTER TABLE crawler_crawledpage RENAME TO crawler_crawledpage_old')
+    for name, _, _, _ in indexes:
+        cursor.execute(f'ALTER INDEX {quote(name)} RENAME TO {quote(name + "_old")}')
+    # Postgres 16 does not allow identity columns on partitioned tables, so ids
+    # come from a plain sequence default either way.
+    cursor.execute('ALTER TABLE crawler_crawledpage_old ALTER COLUMN id DROP IDENTITY IF EXISTS')
+    cursor.execute('ALTER TABLE crawler_crawledpage_old ALTER COLUMN id DROP DEFAULT')
+    cursor.execute('DROP SEQUENCE IF EXISTS crawler_crawledpage_id_seq')
+
+    cursor.execute(
+        'CREATE TABLE crawler_crawledpage (LIKE crawler_crawledpage_old INCLUDING DEFAULTS INCLUDING STORAGE)'
+        + (' PARTITION BY HASH (url)' if partitioned else '')
+    )
+    if partitioned:
+        cursor.execute('ALTER TABLE crawler_crawledpage DROP COLUMN content')
+        for remainder in range(PAGE_PARTITIONS):
+            cursor.execute(
+                f'CREATE TABLE crawler_crawledpage_p{remainder} PARTITION OF crawler_crawledpage '
+                f'FOR VALUES WITH (MODULUS {PAGE_PARTITIONS}, REMAINDER {remainder})'
+            )
+    else:
+        cursor.execute("ALTER TABLE crawler_crawledpage ADD COLUMN content text NOT NULL DEFAULT ''")
+        cursor.execute('ALTER TABLE crawler_crawledpage ALTER COLUMN content DROP DEFAULT')
+    cursor.execute('CREATE SEQUENCE crawler_crawledpage_id_seq OWNED BY crawler_crawledpage.id')
+    cursor.execute("ALTER TABLE crawler_crawledpage ALTER COLUMN id SET DEFAULT nextval('crawler_crawledpage_id_seq')")
+
+    for name, definition, constraint_type, constraint in indexes:
+        if constraint_type == 'p':
+            key = 'id, url' if partitioned else 'id'
+            cursor.execute(f'ALTER TABLE crawler_crawledpage ADD CONSTRAINT {quote(name)} PRIMARY KEY ({key})')
+        elif constraint_type:
+            cursor.execute(f'ALTER TABLE crawler_crawledpage ADD CONSTRAINT {quote(name)} {constraint}')
+        else:
+            # Definitions were read before the rename, so they name the new table.
+            cursor.execute(definition)
+
+    columns = ', '.join(quote(column) for column in _columns(cursor, 'crawler_crawledpage') if column != 'content')
+    if partitioned:
+        cursor.execute(f'INSERT INTO crawler_crawledpage ({columns}) SELECT {columns} FROM crawler_crawledpage_old')
+    else:
+        cursor.execute(f"""
+            INSERT INTO crawler_crawledpage ({columns}, content)
+            SELECT {columns}, COALESCE((
+                SELECT c.content FROM crawler_pagecontent c
+                WHERE c.url = crawler_crawledpage_old.url ORDER BY c.written_at DESC LIMIT 1
+            ), '')
+            FROM crawler_crawledpage_old
+        """)
+    cursor.execute(
+        "SELECT setval('crawler_crawledpage_id_seq', COALESCE(max(id), 0) + 1, false) FROM crawler_crawledpage"
+    )
+
+
+def partition(apps, schema_editor):
+    quote = schema_editor.quote_name
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(CREATE_CONTENT_TABLE)
+        cursor.execute('SELECT min(COALESCE(updated_at, crawled_at)) FROM crawler_crawledpage')
+        oldest = cursor.fetchone()[0]
+        now = datetime.now(timezone.utc)
+        _create_content_partitions(cursor, oldest or now, _add_months(now, MONTHS_AHEAD))
+        cursor.execute("""
+            INSERT INTO crawler_pagecontent (url, content, written_at)
+            SELECT url, content, COALESCE(updated_at, crawled_at) FROM crawler_crawledpage
+            WHERE content <> ''
+        """)
+        _rebuild_page_table(cursor, quote, partitioned=True)
+        # Triggers go on after the copy, which carries search_vector over as is.
+        cursor.execute('DROP TABLE crawler_crawledpage_old')
+        cursor.execute(DROP_TRIGGERS)
+        cursor.execute(CREATE_TRIGGERS)
+        cursor.execute('ANALYZE crawler_crawledpage')
+        cursor.execute('ANALYZE crawler_pagecontent')
+
+
+def unpartition(apps, schema_editor):
+    quote = schema_editor.quote_name
+    with schema_editor.connection.cursor() as cursor:
+        _rebuild_page_table(cursor, quote, partitioned=False)
+        cursor.execute('DROP TABLE crawler_crawledpage_old')
+        cursor.execute('DROP TABLE crawler_pagecontent')
+        cursor.execute(DROP_TRIGGERS)
+        original = importlib.import_module('crawler.migrations.0003_crawledpage_search_vector_trigger')
+        cursor.execute(original.CREATE_TRIGGER)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0006_crawledpage_simhash'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(partition, unpartition)],
+            state_operations=[
+                migrations.RemoveField(
+                    model_name='crawledpage',
+                    name='content',
+                ),
+                migrations.CreateModel(
+                    name='PageContent',
+                    fields=[
+                        ('url', models.URLField(max_length=1000, primary_key=True, serialize=False)),
+                        ('content', models.TextField()),
+                        ('written_at', models.DateTimeField(default=django.utils.timezone.now)),
+                    ],
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0007_partition_pages'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CrawlJob',
+            fields=[
+                ('id', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('crawl', 'Crawl'), ('seeds', 'Seed list'), ('refresh', 'Refresh')], default='crawl', max_length=16)),
+                ('seed_url', models.URLField(blank=True, max_length=1000)),
+                ('max_depth', models.IntegerField(default=0)),
+                ('max_pages', models.IntegerField(default=0)),
+                ('queued', models.IntegerField(default=0)),
+                ('fetched', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('bytes', models.BigIntegerField(default=0)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0008_crawljob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawledpage',
+            name='failed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='crawledpage',
+            name='last_error',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+    ]
@@ -0,0 +1,64 @@
+from itertools import combinations
+from django.db import migrations, models
+
+
+# Recomputes simhash_bands for the pair-of-blocks banding in crawler.dedup (10
+# bands of about 26 bits, replacing 4 bands of 16 bits), and indexes the pages
+# that point at a canonical page so find_canonicals can tell which pages others
+# depend on. Band layouts are copied here so later changes to crawler.dedup
+# don't change what this migration writes.
+BATCH_SIZE = 2000
+
+BLOCK_BITS = [13, 13, 13, 13, 12]
+BLOCK_SHIFTS = [sum(BLOCK_BITS[:i]) for i in range(len(BLOCK_BITS))]
+BAND_PAIRS = list(combinations(range(len(BLOCK_BITS)), 2))
+
+
+def _block(fingerprint, index):
+    return (fingerprint >> BLOCK_SHIFTS[index]) & ((1 << BLOCK_BITS[index]) - 1)
+
+
+def pair_bands(fingerprint):
+    return [
+        (pair << 26) | (_block(fingerprint, a) << BLOCK_BITS[b]) | _block(fingerprint, b)
+        for pair, (a, b) in enumerate(BAND_PAIRS)
+    ]
+
+
+def quarter_bands(fingerprint):
+    return [(band << 16) | ((fingerprint >> (band * 16)) & 0xFFFF) for band in range(4)]
+
+
+def _rebuild(bands):
+    def rebuild(apps, schema_editor):
+        CrawledPage = apps.get_model('crawler', 'CrawledPage')
+        pages = CrawledPage.objects.exclude(simhash=None).exclude(simhash=0).only('id', 'simhash').order_by('id')
+        batch = []
+        for page in pages.iterator(chunk_size=BATCH_SIZE):
+            page.simhash_bands = bands(page.simhash & ((1 << 64) - 1))
+            batch.append(page)
+            if len(batch) >= BATCH_SIZE:
+                CrawledPage.objects.bulk_update(batch, ['simhash_bands'])
+                batch = []
+        if batch:
+            CrawledPage.objects.bulk_update(batch, ['simhash_bands'])
+    return rebuild
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0009_crawledpage_failures'),
+    ]
+
+    operations = [
+        migrations.RunPython(_rebuild(pair_bands), _rebuild(quarter_bands)),
+        migrations.AddIndex(
+            model_name='crawledpage',
+            index=models.Index(
+                condition=models.Q(('canonical_url', ''), _negated=True),
+                fields=['canonical_url'],
+                name='crawledpage_canonical_idx',
+            ),
+        ),
+    ]
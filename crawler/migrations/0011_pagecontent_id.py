@@ -0,0 +1,102 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+# Gives crawler_pagecontent a surrogate id, so Django's primary key matches a
+# unique row: a url can have more than one row, and the table's real key was
+# (url, written_at). Postgres requires the partition key in every unique
+# constraint, so the primary key becomes (id, written_at) and (url, written_at)
+# stays unique; Django treats id as the primary key, as it does for the page
+# table. Detached month partitions get the column too so they can be
+# re-attached. Also adds a DEFAULT partition, which catches rows written past
+# the last monthly partition if beat has not created it in time;
+# crawler.partitions.ensure_content_partitions moves them out again.
+#
+# Adding the column rewrites every content partition under an ACCESS EXCLUSIVE
+# lock, so page writes wait until the migration commits.
+ADD_ID = """
+CREATE SEQUENCE crawler_pagecontent_id_seq;
+ALTER TABLE crawler_pagecontent ADD COLUMN id bigint NOT NULL DEFAULT nextval('crawler_pagecontent_id_seq');
+ALTER SEQUENCE crawler_pagecontent_id_seq OWNED BY crawler_pagecontent.id;
+ALTER TABLE crawler_pagecontent DROP CONSTRAINT crawler_pagecontent_pkey;
+ALTER TABLE crawler_pagecontent ADD CONSTRAINT crawler_pagecontent_pkey PRIMARY KEY (id, written_at);
+ALTER TABLE crawler_pagecontent ADD CONSTRAINT crawler_pagecontent_url_written_at_uniq UNIQUE (url, written_at);
+CREATE TABLE crawler_pagecontent_default PARTITION OF crawler_pagecontent DEFAULT;
+"""
+
+DROP_ID = """
+DROP TABLE crawler_pagecontent_default;
+ALTER TABLE crawler_pagecontent DROP CONSTRAINT crawler_pagecontent_url_written_at_uniq;
+ALTER TABLE crawler_pagecontent DROP CONSTRAINT crawler_pagecontent_pkey;
+ALTER TABLE crawler_pagecontent ADD CONSTRAINT crawler_pagecontent_pkey PRIMARY KEY (url, written_at);
+ALTER TABLE crawler_pagecontent DROP COLUMN id;
+"""
+
+
+def _detached(cursor):
+    cursor.execute(
+        """
+        SELECT c.relname FROM pg_class c
+        WHERE c.relkind = 'r' AND c.relname LIKE %s
+          AND NOT EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhrelid = c.oid)
+        """,
+        [r'crawler\_pagecontent\_y%'],
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def add_id(apps, schema_editor):
+    quote = schema_editor.quote_name
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(ADD_ID)
+        for name in _detached(cursor):
+            cursor.execute(
+                f"ALTER TABLE {quote(name)} ADD COLUMN id bigint NOT NULL DEFAULT nextval('crawler_pagecontent_id_seq')"
+            )
+
+
+def drop_id(apps, schema_editor):
+    quote = schema_editor.quote_name
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT count(*) FROM crawler_pagecontent_default')
+        if cursor.fetchone()[0]:
+            raise RuntimeError(
+                'crawler_pagecontent_default has rows; run "manage.py page_partitions ensure" before migrating back'
+            )
+        for name in _detached(cursor):
+            cursor.execute(f'ALTER TABLE {quote(name)} DROP COLUMN id')
+        cursor.execute(DROP_ID)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0010_simhash_pair_bands'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(add_id, drop_id)],
+            state_operations=[
+                migrations.DeleteModel(
+                    name='PageContent',
+                ),
+                migrations.CreateModel(
+                    name='PageContent',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('url', models.URLField(max_length=1000)),
+                        ('content', models.TextField()),
+                        ('written_at', models.DateTimeField(default=django.utils.timezone.now)),
+                    ],
+                    options={
+                        'constraints': [
+                            models.UniqueConstraint(
+                                fields=('url', 'written_at'), name='crawler_pagecontent_url_written_at_uniq',
+                            ),
+                        ],
+                    },
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,72 @@
+from django.db import migrations
+
+
+# Tokenizes each page write once, and refreshes search_vector when content is
+# written on its own.
+#
+# An upsert of an existing url ran the page trigger BEFORE INSERT, tokenizing
+# title and content, and then again BEFORE UPDATE on the conflicting row, which
+# is the result kept. The INSERT trigger now skips pages whose url already
+# exists. Content inserted into crawler_pagecontent without a page write (a
+# re-parse, a manual fix) never reached search_vector; an AFTER INSERT trigger
+# now clears it, which makes the page's UPDATE trigger recompute it from the
+# new content. crawler.pipeline.write_pages upserts the pages right after their
+# content, so it sets crawler.page_upsert_follows for its transaction to skip
+# that second pass.
+CREATE_TRIGGERS = """
+CREATE OR REPLACE FUNCTION crawler_crawledpage_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' AND EXISTS (SELECT 1 FROM crawler_crawledpage WHERE url = NEW.url) THEN
+        RETURN NEW;
+    END IF;
+    NEW.search_vector :=
+        setweight(to_tsvector(COALESCE(NEW.title, '')), 'A') ||
+        setweight(to_tsvector(COALESCE((
+            SELECT content FROM crawler_pagecontent
+            WHERE url = NEW.url ORDER BY written_at DESC LIMIT 1
+        ), '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION crawler_pagecontent_search_vector_refresh() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('crawler.page_upsert_follows', true) IS DISTINCT FROM 'on' THEN
+        UPDATE crawler_crawledpage SET search_vector = NULL WHERE url = NEW.url;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER crawler_pagecontent_search_vector_refresh
+    AFTER INSERT ON crawler_pagecontent
+    FOR EACH ROW EXECUTE FUNCTION crawler_pagecontent_search_vector_refresh();
+"""
+
+# Drops the content trigger and restores 0007's page trigger function.
+DROP_TRIGGERS = """
+DROP FUNCTION IF EXISTS crawler_pagecontent_search_vector_refresh() CASCADE;
+
+CREATE OR REPLACE FUNCTION crawler_crawledpage_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector(COALESCE(NEW.title, '')), 'A') ||
+        setweight(to_tsvector(COALESCE((
+            SELECT content FROM crawler_pagecontent
+            WHERE url = NEW.url ORDER BY written_at DESC LIMIT 1
+        ), '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0012_crawledpage_fail_count'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_TRIGGERS, DROP_TRIGGERS),
+    ]
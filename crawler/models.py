@@ -1,28 +1,109 @@
+from datetime import timedelta
 from django.db import models
-from django.contrib.postgres.search import SearchVectorField, SearchVector
+from django.utils import timezone
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.search import SearchVectorField
 from django.contrib.postgres.indexes import GinIndex
 
 class CrawledPage(models.Model):
     url = models.URLField(unique=True, max_length=1000, db_index=True)
     title = models.CharField(max_length=1000, null=True, blank=True)
-    content = models.TextField(blank=True)
     status_code = models.IntegerField(default=200)
     crawled_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Validators for conditional re-crawls and the adaptive refresh schedule.
+    etag = models.CharField(max_length=255, blank=True)
+    last_modified = models.CharField(max_length=64, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True)
+    last_checked_at = models.DateTimeField(null=True, blank=True)
+    refresh_interval = models.DurationField(default=timedelta(days=1))
+    next_crawl_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    # Location of the raw response in the WARC archive (see crawler.archive).
+    archive_segment = models.CharField(max_length=255, blank=True)
+    archive_offset = models.BigIntegerField(null=True, blank=True)
+    archive_length = models.IntegerField(null=True, blank=True)
+    # SimHash of the content and its LSH bands (see crawler.dedup). Near-duplicates
+    # keep no content of their own and point at their canonical page instead.
+    simhash = models.BigIntegerField(null=True, blank=True)
+    simhash_bands = ArrayField(models.IntegerField(), default=list, blank=True)
+    canonical_url = models.URLField(max_length=1000, blank=True)
+    # Set when the last fetch failed for good (see freshness.record_failures) and
+    # cleared by the next successful one; failed pages are left out of search.
+    last_error = models.CharField(max_length=500, blank=True)
+    failed_at = models.DateTimeField(null=True, blank=True)
+    # Consecutive failed fetches; backs off and eventually stops re-checks.
+    fail_count = models.IntegerField(default=0)
+    # Maintained by database triggers (migrations 0003, 0007 and 0013) from the
+    # title and the page's latest PageContent, never set from Python.
     search_vector = SearchVectorField(null=True)
 
     class Meta:
         indexes = [
             GinIndex(fields=['search_vector']),
+            GinIndex(fields=['simhash_bands']),
             models.Index(fields=['-crawled_at']),
+            # Pages other near-duplicates point at (see dedup.find_canonicals).
+            models.Index(
+                fields=['canonical_url'], condition=~models.Q(canonical_url=''), name='crawledpage_canonical_idx',
+            ),
         ]
         ordering = ['-crawled_at']
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        CrawledPage.objects.filter(pk=self.pk).update(
-            search_vector=SearchVector('title', weight='A') + SearchVector('content', weight='B')
+    def __str__(self):
+        return self.title or self.url
+
+    @property
+    def content(self):
+        """The page's extracted text, read from PageContent on each access."""
+        return (
+            PageContent.objects.filter(url=self.url).order_by('-written_at')
+            .values_list('content', flat=True).first() or ''
         )
 
+
+class PageContent(models.Model):
+    """Extracted text of a page, kept out of CrawledPage so listing and search
+    scans stay narrow; it is only read for the rows being rendered.
+
+    The table is range-partitioned by written_at (see crawler.partitions), so
+    its primary key is (id, written_at) and Django treats id alone as the key.
+    A page normally has one row; readers take the latest if a concurrent write
+    left two.
+    """
+    url = models.URLField(max_length=1000)
+    content = models.TextField()
+    written_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['url', 'written_at'], name='crawler_pagecontent_url_written_at_uniq'),
+        ]
+
+
+class CrawlJob(models.Model):
+    """Durable copy of a crawl's progress counters.
+
+    Workers increment the live counters in the crawl's Redis hash (see
+    crawler.jobs); a periodic task copies them here, so a job's progress is a
+    single hash or primary-key read and outlives the Redis hash.
+    """
+    KINDS = [('crawl', 'Crawl'), ('seeds', 'Seed list'), ('refresh', 'Refresh')]
+
+    id = models.CharField(max_length=32, primary_key=True)
+    kind = models.CharField(max_length=16, choices=KINDS, default='crawl')
+    seed_url = models.URLField(max_length=1000, blank=True)
+    max_depth = models.IntegerField(default=0)
+    max_pages = models.IntegerField(default=0)
+    queued = models.IntegerField(default=0)
+    fetched = models.IntegerField(default=0)
+    # Frontier entries that were popped but not fetched: errors and robots.txt disallows.
+    failed = models.IntegerField(default=0)
+    bytes = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
     def __str__(self):
-        return self.title or self.url
+        return self.seed_url or self.id
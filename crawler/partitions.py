@@ -0,0 +1,165 @@
+import re
+from datetime import datetime, timezone
+from django.conf import settings
+from django.db import connection, transaction
+
+# Storage layout (migrations 0007 and 0011). crawler_crawledpage is
+# hash-partitioned on url into PAGE_PARTITIONS tables, so the ON CONFLICT (url)
+# upsert keeps working and vacuum and index maintenance run per partition.
+# Hash partitions do not bound what a query reads: search and the -crawled_at
+# listing still probe the indexes of every partition, and those indexes grow
+# with the number of pages ever crawled. Extracted text lives in
+# crawler_pagecontent, range-partitioned by the month it was written: pages
+# that have not changed in months sit in old partitions, which can be detached
+# into standalone tables and archived. Search keeps matching detached pages
+# through search_vector; they only lose their snippets. Detaching text does not
+# shrink the page table. Rows written past the last monthly partition land in
+# DEFAULT_PARTITION until ensure_content_partitions moves them out.
+PAGE_TABLE = 'crawler_crawledpage'
+CONTENT_TABLE = 'crawler_pagecontent'
+PAGE_PARTITIONS = 16
+DEFAULT_PARTITION = 'crawler_pagecontent_default'
+CONTENT_COLUMNS = 'id, url, content, written_at'
+MONTH_NAME_RE = re.compile(r'^crawler_pagecontent_y(\d{4})m(\d{2})$')
+# Postgres refuses DETACH ... CONCURRENTLY while the table has a default
+# partition, so detach and attach lock crawler_pagecontent for a short
+# transaction instead. A lock that is not granted within this time fails the
+# command rather than stalling page writes queued behind it.
+LOCK_TIMEOUT = '5s'
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(month):
+    return f'{CONTENT_TABLE}_y{month:%Y}m{month:%m}'
+
+
+def partition_month(name):
+    """The month a content partition covers, or None if name is not one."""
+    match = MONTH_NAME_RE.match(name)
+    if not match:
+        return None
+    return datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc)
+
+
+def _bounds(month):
+    return f"FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+
+
+def ensure_content_partitions(ahead=None, now=None):
+    """Create the content partitions for this month and the next ahead months; returns the new names."""
+    ahead = settings.CRAWLER_CONTENT_PARTITIONS_AHEAD if ahead is None else ahead
+    first = month_start(now or datetime.now(timezone.utc))
+    created = []
+    with connection.cursor() as cursor:
+        for offset in range(ahead + 1):
+            month = add_months(first, offset)
+            name = partition_name(month)
+            cursor.execute('SELECT to_regclass(%s)', [name])
+            if cursor.fetchone()[0] is None:
+                _create_partition(cursor, month)
+                created.append(name)
+    return created
+
+
+def _create_partition(cursor, month):
+    """Create month's content partition, moving any of its rows out of the default partition.
+
+    Postgres refuses to add a partition while the default partition holds rows
+    that belong in it, so the rows are copied into the new table before it is
+    attached.
+    """
+    name = partition_name(month)
+    end = add_months(month, 1)
+    with transaction.atomic():
+        cursor.execute(f'CREATE TABLE {name} (LIKE {CONTENT_TABLE} INCLUDING DEFAULTS)')
+        cursor.execute(
+            f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION} WHERE written_at >= %s AND written_at < %s
+                RETURNING {CONTENT_COLUMNS}
+            )
+            INSERT INTO {name} ({CONTENT_COLUMNS}) SELECT {CONTENT_COLUMNS} FROM moved
+            """,
+            [month, end],
+        )
+        cursor.execute(f'ALTER TABLE {CONTENT_TABLE} ATTACH PARTITION {name} FOR VALUES {_bounds(month)}')
+
+
+def content_partitions():
+    """Attached and detached content partitions as dicts, oldest first."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT c.relname, i.inhrelid IS NOT NULL, pg_total_relation_size(c.oid), c.reltuples::bigint
+            FROM pg_class c
+            LEFT JOIN pg_inherits i ON i.inhrelid = c.oid
+            WHERE c.relkind = 'r' AND c.relname LIKE %s
+            ORDER BY c.relname
+            """,
+            [CONTENT_TABLE + r'\_y%'],
+        )
+        rows = cursor.fetchall()
+    return [
+        {'name': name, 'month': partition_month(name), 'attached': attached, 'bytes': size, 'rows': max(rows, 0)}
+        for name, attached, size, rows in rows if partition_month(name)
+    ]
+
+
+def page_partitions():
+    """(name, bytes, estimated rows) of each hash partition of the page table."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT c.relname, pg_total_relation_size(c.oid), c.reltuples::bigint
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = %s::regclass
+            ORDER BY c.relname
+            """,
+            [PAGE_TABLE],
+        )
+        return [(name, size, max(rows, 0)) for name, size, rows in cursor.fetchall()]
+
+
+def stale_partitions(months, now=None):
+    """Attached content partitions that ended at least months full months ago."""
+    cutoff = add_months(month_start(now or datetime.now(timezone.utc)), -months)
+    return [
+        partition['name'] for partition in content_partitions()
+        if partition['attached'] and add_months(partition['month'], 1) <= cutoff
+    ]
+
+
+def _checked_month(name):
+    month = partition_month(name)
+    if month is None:
+        raise ValueError(f'{name} is not a content partition')
+    return month
+
+
+def _alter(sql):
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+        cursor.execute(sql)
+
+
+def detach(name):
+    """Detach a content partition, leaving it as a standalone table that can be dumped or dropped.
+
+    Raises OperationalError if the table could not be locked within LOCK_TIMEOUT.
+    """
+    _checked_month(name)
+    _alter(f'ALTER TABLE {CONTENT_TABLE} DETACH PARTITION {name}')
+
+
+def attach(name):
+    """Re-attach a previously detached content partition."""
+    month = _checked_month(name)
+    _alter(f'ALTER TABLE {CONTENT_TABLE} ATTACH PARTITION {name} FOR VALUES {_bounds(month)}')
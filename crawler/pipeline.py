@@ -0,0 +1,196 @@
+import json
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from django.conf import settings
+from django.db import DataError, IntegrityError, connection, transaction
+from . import metrics, profiling
+from .leases import LeasedQueue
+from .models import CrawledPage, PageContent
+from .redis_client import get_redis
+from .search import bump_generation
+
+logger = logging.getLogger(__name__)
+
+BUFFER_KEY = 'crawler:persist:buffer'
+LAST_FLUSH_KEY = 'crawler:persist:last_flush'
+TOTALS_KEY = 'crawler:persist:totals'
+# Set while a size-triggered flush task is queued, so enqueuers dispatch one.
+FLUSH_QUEUED_KEY = 'crawler:persist:flush_queued'
+# A batch being written sits in its own in-flight list, leased in LEASES_KEY
+# until the write commits. Batches whose lease ran out (the persister crashed
+# or was killed mid-write) are moved back to the front of the buffer.
+INFLIGHT_KEY = 'crawler:persist:inflight:'
+LEASES_KEY = 'crawler:persist:leases'
+_buffer = LeasedQueue(BUFFER_KEY, INFLIGHT_KEY, LEASES_KEY)
+
+# Pages the database rejects even when written on their own are moved here,
+# as {'page', 'error', 'failed_at'} JSON, so they don't block the rest of the
+# buffer. Only the newest DEAD_LETTER_MAX are kept.
+DEAD_LETTER_KEY = 'crawler:persist:dead'
+DEAD_LETTER_MAX = 10000
+# Errors caused by the pages being written rather than by the database being
+# unavailable. A batch that raises one is split to find the pages at fault;
+# anything else puts the whole batch back for a later flush.
+ROW_ERRORS = (DataError, IntegrityError, KeyError, TypeError, ValueError)
+
+UPSERT_FOLLOWS_SQL = "SELECT set_config('crawler.page_upsert_follows', %s, true)"
+
+# Columns written by the crawl pipeline; everything else keeps its DB value on upsert.
+# Buffered pages never carry last_error, failed_at or fail_count, so the model
+# defaults clear any earlier fetch failure.
+PAGE_FIELDS = [
+    'title', 'status_code', 'etag', 'last_modified', 'content_hash',
+    'last_checked_at', 'refresh_interval', 'next_crawl_at',
+    'archive_segment', 'archive_offset', 'archive_length',
+    'simhash', 'simhash_bands', 'canonical_url', 'last_error', 'failed_at', 'fail_count',
+]
+
+
+def enqueue_page(page):
+    """Buffer a parsed page for the next batched write.
+
+    Returns True once the buffer has reached the configured batch size and no
+    size-triggered flush is queued yet, so exactly one caller triggers a flush
+    without waiting for the periodic one.
+    """
+    r = get_redis()
+    length = r.rpush(BUFFER_KEY, json.dumps(page))
+    if length < settings.CRAWLER_PERSIST_BATCH_SIZE:
+        return False
+    # Expires in case the queued task is lost before it clears the flag.
+    return bool(r.set(FLUSH_QUEUED_KEY, 1, nx=True, ex=settings.CRAWLER_PERSIST_LEASE))
+
+
+def buffer_size():
+    return get_redis().llen(BUFFER_KEY)
+
+
+def _strip_nul(value):
+    # Postgres text columns cannot hold NUL bytes, which some fetched pages contain.
+    return value.replace('\x00', '') if isinstance(value, str) else value
+
+
+def _to_model(page):
+    # Buffered pages carry JSON-friendly timestamps and intervals in seconds.
+    page = {field: _strip_nul(value) for field, value in page.items() if field != 'content'}
+    checked_at = datetime.fromtimestamp(page.pop('checked_at'), tz=timezone.utc)
+    interval = timedelta(seconds=page['refresh_interval'])
+    page.update(last_checked_at=checked_at, refresh_interval=interval, next_crawl_at=checked_at + interval)
+    return CrawledPage(**page)
+
+
+def write_pages(pages):
+    """Replace the pages' content, upsert the pages on url, and return the row count.
+
+    Content is written first, in the same transaction, so the search_vector
+    trigger sees the new text when the page row is upserted. The transaction
+    sets crawler.page_upsert_follows so the content trigger leaves that to the
+    upsert instead of tokenizing the page a second time (migration 0013).
+    """
+    # ON CONFLICT cannot touch the same row twice, so keep the latest copy per URL.
+    by_url = {page['url']: page for page in pages}
+    contents = [
+        PageContent(url=url, content=_strip_nul(page['content'])) for url, page in by_url.items() if page.get('content')
+    ]
+    objs = [_to_model(page) for page in by_url.values()]
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(UPSERT_FOLLOWS_SQL, ['on'])
+        PageContent.objects.filter(url__in=by_url).delete()
+        PageContent.objects.bulk_create(contents)
+        CrawledPage.objects.bulk_create(
+            objs,
+            update_conflicts=True,
+            unique_fields=['url'],
+            update_fields=PAGE_FIELDS + ['updated_at'],
+        )
+        cursor.execute(UPSERT_FOLLOWS_SQL, ['off'])
+    return len(objs)
+
+
+def _dead_letter(r, item, exc):
+    logger.warning('Moved a page that could not be written to %s: %s', DEAD_LETTER_KEY, exc)
+    entry = {'page': item.decode(errors='replace'), 'error': f'{type(exc).__name__}: {exc}', 'failed_at': time.time()}
+    with r.pipeline() as pipe:
+        pipe.rpush(DEAD_LETTER_KEY, json.dumps(entry))
+        pipe.ltrim(DEAD_LETTER_KEY, -DEAD_LETTER_MAX, -1)
+        pipe.execute()
+
+
+def _write_batch(r, items):
+    """Write buffered pages, halving the batch until the pages the database rejects are isolated.
+
+    Returns (rows written, pages dead-lettered).
+    """
+    try:
+        return write_pages([json.loads(item) for item in items]), 0
+    except ROW_ERRORS as exc:
+        if len(items) == 1:
+            _dead_letter(r, items[0], exc)
+            return 0, 1
+    half = len(items) // 2
+    rows, dead = _write_batch(r, items[:half])
+    more_rows, more_dead = _write_batch(r, items[half:])
+    return rows + more_rows, dead + more_dead
+
+
+def requeue_expired(r=None):
+    """Put batches whose writer died before committing back on the buffer; returns the page count."""
+    return _buffer.requeue_expired(r or get_redis())
+
+
+def _record_flush(r, stats):
+    with r.pipeline() as pipe:
+        pipe.hset(LAST_FLUSH_KEY, mapping=stats)
+        pipe.hincrby(TOTALS_KEY, 'flushes', 1)
+        pipe.hincrby(TOTALS_KEY, 'rows', stats['rows'])
+        pipe.hincrbyfloat(TOTALS_KEY, 'seconds', stats['seconds'])
+        pipe.execute()
+
+
+def flush():
+    """Drain the buffer in batches and return per-flush throughput metrics.
+
+    Each batch stays in Redis until its write commits, so a persister that
+    dies mid-write loses nothing; the next flush after the lease ends retries it.
+    Pages the database rejects are moved to DEAD_LETTER_KEY instead.
+    """
+    r = get_redis()
+    r.delete(FLUSH_QUEUED_KEY)
+    requeue_expired(r)
+    size = settings.CRAWLER_PERSIST_BATCH_SIZE
+    flushes = []
+    while True:
+        token, items = _buffer.claim(r, size, settings.CRAWLER_PERSIST_LEASE)
+        if not items:
+            break
+        start = time.monotonic()
+        try:
+            with profiling.stage('write'):
+                rows, dead = _write_batch(r, items)
+        except Exception:
+            # Put the batch back now, rather than when its lease ends, so a later flush can retry it.
+            _buffer.requeue(r, [token], time.time() + settings.CRAWLER_PERSIST_LEASE)
+            raise
+        _buffer.ack(r, token)
+        elapsed = time.monotonic() - start
+        bump_generation()
+        stats = {
+            'pages': len(items),
+            'rows': rows,
+            'dead_lettered': dead,
+            'seconds': round(elapsed, 4),
+            'rows_per_sec': round(rows / elapsed, 1) if elapsed else rows,
+            'flushed_at': time.time(),
+        }
+        _record_flush(r, stats)
+        with metrics.recording() as recorder:
+            recorder.incr('rows_written', rows)
+            if dead:
+                recorder.incr('pages_dead_lettered', dead)
+            recorder.observe('persist_seconds', elapsed)
+        logger.info('Flushed %(rows)d rows (%(pages)d pages) in %(seconds).3fs, %(rows_per_sec).1f rows/s', stats)
+        flushes.append(stats)
+        if len(items) < size:
+            break
+    return flushes
@@ -0,0 +1,19 @@
+from urllib.parse import urlsplit
+from .redis_client import get_redis
+
+# Per-host state used by the frontier scripts: the earliest time the host may
+# be fetched again, and any Crawl-delay it asked for.
+NEXT_FETCH_KEY = 'crawler:politeness:next:'
+CRAWL_DELAY_KEY = 'crawler:politeness:delay:'
+
+
+def host_of(url):
+    return urlsplit(url).netloc
+
+
+def set_crawl_delay(host, seconds, ttl):
+    """Record a host's Crawl-delay for ttl seconds; the default delay applies when absent."""
+    if seconds:
+        get_redis().set(CRAWL_DELAY_KEY + host, float(seconds), ex=ttl)
+    else:
+        get_redis().delete(CRAWL_DELAY_KEY + host)
@@ -0,0 +1,213 @@
+import cProfile
+import contextvars
+import logging
+import pstats
+import random
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from urllib.parse import urlsplit
+import aiohttp
+from django.conf import settings
+from .metrics import WORKER
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Opt-in stage timings (CRAWLER_PROFILE). Totals are kept per worker, domain and
+# stage in two hashes whose fields are 'worker|domain|stage'. A sampled share of
+# tasks also runs under cProfile, aggregated per function.
+SECONDS_KEY = 'crawler:profile:seconds'
+COUNT_KEY = 'crawler:profile:count'
+FUNCTIONS_KEY = 'crawler:profile:functions:{}'
+FUNCTION_STATS = ('calls', 'tottime', 'cumtime')
+
+_active = contextvars.ContextVar('crawler_profile', default=None)
+_domain = contextvars.ContextVar('crawler_profile_domain', default='')
+_disabled = nullcontext()
+
+
+class StageProfile:
+    """Stage timings collected during one task, written to Redis in one round trip."""
+
+    def __init__(self):
+        self.seconds = Counter()
+        self.counts = Counter()
+
+    def add(self, stage, seconds, domain):
+        field = f'{WORKER}|{domain}|{stage}'
+        self.seconds[field] += seconds
+        self.counts[field] += 1
+
+    def flush(self):
+        if not self.counts:
+            return
+        with get_redis().pipeline(transaction=False) as pipe:
+            for field, seconds in self.seconds.items():
+                pipe.hincrbyfloat(SECONDS_KEY, field, seconds)
+                pipe.hincrby(COUNT_KEY, field, self.counts[field])
+            pipe.execute()
+
+
+def _host(url):
+    return (urlsplit(url).hostname or '') if url else ''
+
+
+def record(stage, seconds, url=None):
+    """Add seconds to stage for url's domain (or the current one) if profiling is active."""
+    profile = _active.get()
+    if profile is not None:
+        profile.add(stage, seconds, _host(url) or _domain.get())
+
+
+@contextmanager
+def _timed(stage, url):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start, url)
+
+
+def stage(name, url=None):
+    """Time the enclosed block as stage name; costs one lookup when profiling is off."""
+    if _active.get() is None:
+        return _disabled
+    return _timed(name, url)
+
+
+@contextmanager
+def domain(url):
+    """Attribute stages timed in the enclosed block without their own url to url's domain."""
+    token = _domain.set(_host(url))
+    try:
+        yield
+    finally:
+        _domain.reset(token)
+
+
+def _save_functions(profiler):
+    stats = pstats.Stats(profiler).stats
+    with get_redis().pipeline(transaction=False) as pipe:
+        for (filename, line, function), (_, calls, tottime, cumtime, _) in stats.items():
+            field = f'{filename}:{line}({function})'
+            pipe.hincrby(FUNCTIONS_KEY.format('calls'), field, calls)
+            pipe.hincrbyfloat(FUNCTIONS_KEY.format('tottime'), field, tottime)
+            pipe.hincrbyfloat(FUNCTIONS_KEY.format('cumtime'), field, cumtime)
+        pipe.execute()
+
+
+@contextmanager
+def profiled():
+    """Collect stage timings for the enclosed task when CRAWLER_PROFILE is on.
+
+    A CRAWLER_PROFILE_SAMPLE_RATE share of tasks also runs under cProfile.
+    Nested uses add to the outermost profile.
+    """
+    if not settings.CRAWLER_PROFILE or _active.get() is not None:
+        yield
+        return
+    profile = StageProfile()
+    token = _active.set(profile)
+    profiler = None
+    if random.random() < settings.CRAWLER_PROFILE_SAMPLE_RATE:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        _active.reset(token)
+        try:
+            profile.flush()
+            if profiler is not None:
+                _save_functions(profiler)
+        except Exception:
+            logger.warning('Could not record profile', exc_info=True)
+
+
+async def _on_dns_start(session, ctx, params):
+    ctx.dns_start = time.perf_counter()
+
+
+async def _on_dns_end(session, ctx, params):
+    ctx.dns = time.perf_counter() - ctx.dns_start
+    record('dns', ctx.dns, f'http://{params.host}')
+
+
+async def _on_connection_start(session, ctx, params):
+    ctx.connect_start = time.perf_counter()
+
+
+async def _on_connection_end(session, ctx, params):
+    ctx.connect = time.perf_counter() - ctx.connect_start
+    # aiohttp resolves the host inside connection setup, and has no separate
+    # event for the TLS handshake, so 'connect' is TCP plus TLS.
+    record('connect', ctx.connect - getattr(ctx, 'dns', 0), ctx.url)
+
+
+async def _on_request_start(session, ctx, params):
+    ctx.url = str(params.url)
+    ctx.request_start = time.perf_counter()
+
+
+async def _on_request_end(session, ctx, params):
+    elapsed = time.perf_counter() - ctx.request_start
+    record('ttfb', elapsed - getattr(ctx, 'connect', 0), ctx.url)
+
+
+def trace_configs():
+    """aiohttp TraceConfigs timing DNS, connect and time to first byte, if profiling is enabled.
+
+    Sessions outlive tasks, so the hooks are installed whenever CRAWLER_PROFILE
+    is on and only record while a profiled task is running.
+    """
+    if not settings.CRAWLER_PROFILE:
+        return []
+    config = aiohttp.TraceConfig()
+    config.on_request_start.append(_on_request_start)
+    config.on_dns_resolvehost_start.append(_on_dns_start)
+    config.on_dns_resolvehost_end.append(_on_dns_end)
+    config.on_connection_create_start.append(_on_connection_start)
+    config.on_connection_create_end.append(_on_connection_end)
+    config.on_request_end.append(_on_request_end)
+    return [config]
+
+
+def stage_report(group_by=('stage',)):
+    """Aggregate the recorded stage totals into rows of (key, calls, seconds), slowest first.
+
+    group_by picks any of 'worker', 'domain' and 'stage' as the row key.
+    """
+    r = get_redis()
+    seconds = {k.decode(): float(v) for k, v in r.hgetall(SECONDS_KEY).items()}
+    counts = {k.decode(): int(v) for k, v in r.hgetall(COUNT_KEY).items()}
+    positions = {'worker': 0, 'domain': 1, 'stage': 2}
+    totals = Counter()
+    calls = Counter()
+    for field, value in seconds.items():
+        parts = field.split('|')
+        key = tuple(parts[positions[name]] for name in group_by)
+        totals[key] += value
+        calls[key] += counts.get(field, 0)
+    return [(key, calls[key], total) for key, total in totals.most_common()]
+
+
+def function_report(limit=20, sort='tottime'):
+    """The sampled functions with the highest aggregate sort stat, as (function, calls, tottime, cumtime)."""
+    r = get_redis()
+    stats = {
+        name: {k.decode(): float(v) for k, v in r.hgetall(FUNCTIONS_KEY.format(name)).items()}
+        for name in FUNCTION_STATS
+    }
+    top = sorted(stats[sort].items(), key=lambda item: -item[1])[:limit]
+    return [
+        (function, int(stats['calls'].get(function, 0)), stats['tottime'].get(function, 0),
+         stats['cumtime'].get(function, 0))
+        for function, _ in top
+    ]
+
+
+def reset():
+    get_redis().delete(SECONDS_KEY, COUNT_KEY, *(FUNCTIONS_KEY.format(name) for name in FUNCTION_STATS))
@@ -0,0 +1,12 @@
+import redis
+from django.conf import settings
+
+_client = None
+
+
+def get_redis():
+    """Return the process-wide Redis client used for crawler coordination."""
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.CRAWLER_REDIS_URL)
+    return _client
@@ -0,0 +1,230 @@
+import json
+import re
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+from django.conf import settings
+from . import fetcher, metrics, politeness
+from .redis_client import get_redis
+
+ROBOTS_KEY = 'crawler:robots:'
+# RFC 9309 parsers must handle at least 500 KiB; anything beyond is ignored.
+ROBOTS_MAX_BYTES = 500 * 1024
+
+# Returned for hosts whose robots.txt is missing (4xx) or unreachable (5xx,
+# errors). Unreachable hosts are disallowed, but flagged so their URLs can be
+# tried again once the error is no longer cached rather than given up on.
+ALLOW_ALL = {'rules': [], 'delay': None}
+DISALLOW_ALL = {'rules': [['/', False]], 'delay': None, 'unreachable': True}
+
+# RFC 9309 product tokens: letters, underscores and hyphens.
+PRODUCT_TOKEN_RE = re.compile(r'[A-Za-z_-]+')
+
+
+def _origin(url):
+    parts = urlsplit(url)
+    return f'{parts.scheme}://{parts.netloc}'
+
+
+def _path(url):
+    parts = urlsplit(url)
+    return (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+
+
+def product_token(agent):
+    """The product token of a user agent ('ExampleBot' in 'ExampleBot/1.2 (+https://...)'), lowercased."""
+    match = PRODUCT_TOKEN_RE.match(agent.strip())
+    return match.group(0).lower() if match else ''
+
+
+def _pattern_to_regex(pattern):
+    anchored = pattern.endswith('$')
+    if anchored:
+        pattern = pattern[:-1]
+    regex = '.*'.join(re.escape(part) for part in pattern.split('*'))
+    return regex + ('$' if anchored else '')
+
+
+def parse_robots(text, agent):
+    """Return the rules of the group that applies to agent as {'rules': [[path, allow]], 'delay': float}.
+
+    Groups are matched on agent's product token, case-insensitively. Rules are
+    sorted most specific first so the first match decides, with Allow winning
+    ties, as in RFC 9309.
+    """
+    agent = product_token(agent)
+    groups = []
+    agents, in_rules = None, False
+    for line in text.splitlines():
+        line = line.split('#', 1)[0].strip()
+        if ':' not in line:
+            continue
+        field, value = (part.strip() for part in line.split(':', 1))
+        field = field.lower()
+        if field == 'user-agent':
+            if agents is None or in_rules:
+                agents = []
+                groups.append((agents, [], {}))
+                in_rules = False
+            agents.append('*' if value.strip() == '*' else product_token(value))
+        elif agents is not None and field in ('allow', 'disallow', 'crawl-delay'):
+            in_rules = True
+            _, rules, extra = groups[-1]
+            if field == 'crawl-delay':
+                try:
+                    extra['delay'] = float(value)
+                except ValueError:
+                    pass
+            elif value:
+                rules.append([value, field == 'allow'])
+
+    matched = [g for g in groups if agent and agent in g[0]]
+    if not matched:
+        matched = [g for g in groups if '*' in g[0]]
+    rules, delay = [], None
+    for _, group_rules, extra in matched:
+        rules.extend(group_rules)
+        delay = extra.get('delay', delay)
+    rules.sort(key=lambda rule: (-len(rule[0]), not rule[1]))
+    return {'rules': rules, 'delay': delay}
+
+
+class RobotsRules:
+    def __init__(self, data):
+        self.rules = [(re.compile(_pattern_to_regex(path)), allow) for path, allow in data['rules']]
+        self.delay = data['delay']
+        self.unreachable = data.get('unreachable', False)
+
+    def allowed(self, path):
+        for regex, allow in self.rules:
+            if regex.match(path):
+                return allow
+        return True
+
+
+class RobotsCache:
+    """robots.txt rules per origin: an in-process LRU in front of Redis.
+
+    Parsed rules live in Redis for CRAWLER_ROBOTS_TTL seconds, or
+    CRAWLER_ROBOTS_ERROR_TTL when the file could not be fetched, so each
+    host's robots.txt is downloaded once across all workers.
+    """
+
+    def __init__(self, maxsize, ttl, error_ttl, agent):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.agent = agent
+        self._local = OrderedDict()
+
+    def _get_local(self, origin):
+        entry = self._local.get(origin)
+        if entry is None:
+            return None
+        expires_at, rules = entry
+        if expires_at < time.monotonic():
+            del self._local[origin]
+            return None
+        self._local.move_to_end(origin)
+        return rules
+
+    def _set_local(self, origin, rules, ttl):
+        self._local[origin] = (time.monotonic() + ttl, rules)
+        self._local.move_to_end(origin)
+        if len(self._local) > self.maxsize:
+            self._local.popitem(last=False)
+
+    def _store(self, origin, data, ttl):
+        host = urlsplit(origin).netloc
+        get_redis().set(ROBOTS_KEY + origin, json.dumps(data), ex=ttl)
+        politeness.set_crawl_delay(host, data['delay'], ttl)
+        rules = RobotsRules(data)
+        self._set_local(origin, rules, ttl)
+        return rules
+
+    def _from_fetch(self, origin, result):
+        metrics.count('robots:fetch')
+        if result.ok:
+            return self._store(origin, parse_robots(result.text, self.agent), self.ttl)
+        elif result.status_code and 400 <= result.status_code < 500:
+            return self._store(origin, ALLOW_ALL, self.ttl)
+        return self._store(origin, DISALLOW_ALL, self.error_ttl)
+
+    def _lookup(self, origins):
+        """Return {origin: RobotsRules} for origins cached locally or in Redis."""
+        found = {}
+        missing = []
+        for origin in origins:
+            rules = self._get_local(origin)
+            if rules is None:
+                missing.append(origin)
+            else:
+                metrics.count('robots:local')
+                found[origin] = rules
+        if missing:
+            r = get_redis()
+            with r.pipeline(transaction=False) as pipe:
+                for origin in missing:
+                    pipe.get(ROBOTS_KEY + origin)
+                    pipe.ttl(ROBOTS_KEY + origin)
+                values = pipe.execute()
+            for origin, raw, ttl in zip(missing, values[::2], values[1::2]):
+                if raw is not None:
+                    metrics.count('robots:redis')
+                    rules = RobotsRules(json.loads(raw))
+                    self._set_local(origin, rules, max(ttl, 1))
+                    found[origin] = rules
+        return found
+
+    def _rules(self, urls):
+        """Return {origin: RobotsRules} for every origin in urls, fetching the missing files concurrently.
+
+        Each origin counts as one lookup in crawler_robots_lookups_total, by the
+        source that answered it, however many of its urls are checked.
+        """
+        origins = list(dict.fromkeys(_origin(url) for url in urls))
+        found = self._lookup(origins)
+        missing = [origin for origin in origins if origin not in found]
+        if missing:
+            results = fetcher.fetch_batch(
+                [origin + '/robots.txt' for origin in missing],
+                allowed_types=(), max_bytes=ROBOTS_MAX_BYTES,
+            )
+            for origin, result in zip(missing, results):
+                found[origin] = self._from_fetch(origin, result)
+        return found
+
+    def allowed(self, url):
+        """Return whether url may be fetched, fetching the host's robots.txt if needed."""
+        return self._rules([url])[_origin(url)].allowed(_path(url))
+
+    def filter_allowed(self, urls):
+        rules = self._rules(urls)
+        return [url for url in urls if rules[_origin(url)].allowed(_path(url))]
+
+    def split_allowed(self, urls):
+        """Return (allowed, unreachable) urls, unreachable ones being on hosts whose robots.txt could not be fetched."""
+        rules = self._rules(urls)
+        allowed, unreachable = [], []
+        for url in urls:
+            origin_rules = rules[_origin(url)]
+            if origin_rules.unreachable:
+                unreachable.append(url)
+            elif origin_rules.allowed(_path(url)):
+                allowed.append(url)
+        return allowed, unreachable
+
+
+_cache = None
+
+
+def get_robots_cache():
+    global _cache
+    if _cache is None:
+        _cache = RobotsCache(
+            settings.CRAWLER_ROBOTS_LRU_SIZE,
+            settings.CRAWLER_ROBOTS_TTL,
+            settings.CRAWLER_ROBOTS_ERROR_TTL,
+            settings.CRAWLER_ROBOTS_AGENT,
+        )
+    return _cache
@@ -0,0 +1,183 @@
+import base64
+import hashlib
+import json
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchHeadline
+from django.core.cache import cache
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import Cast, Substr
+from .db_router import replica_alias, stuck_to_primary
+from .models import CrawledPage, PageContent
+
+RESULTS_PER_PAGE = 20
+LATEST_PAGES = 20
+
+# Bumped whenever the persistence pipeline writes, which retires every cached
+# result at once without having to find and delete the affected keys.
+GENERATION_KEY = 'search:generation'
+
+
+def content_of(urls, expression):
+    """{url: expression evaluated over the url's latest PageContent} for the given pages.
+
+    Pages without content, or whose content partition has been detached, are
+    left out.
+    """
+    if not urls:
+        return {}
+    # Oldest first, so a newer row left by a concurrent write wins.
+    return dict(
+        PageContent.objects.filter(url__in=urls).order_by('written_at')
+        .annotate(value=expression).values_list('url', 'value')
+    )
+
+
+def ranked_ids(search_query, offset=0, limit=RESULTS_PER_PAGE):
+    """(id, rank) rows of canonical, not failed pages matching search_query, best first.
+
+    Matching runs against the stored tsvector so the GIN index is used.
+    """
+    return (
+        CrawledPage.objects.filter(search_vector=search_query, canonical_url='', failed_at=None)
+        .annotate(rank=SearchRank(F('search_vector'), search_query))
+        .order_by('-rank', '-id')
+        .values_list('id', 'rank')[offset:offset + limit]
+    )
+
+
+def search_pages(query, page=1, per_page=RESULTS_PER_PAGE):
+    """Return (results, has_next) for one page of ranked full-text matches."""
+    search_query = SearchQuery(query)
+    offset = (page - 1) * per_page
+
+    # Fetch one extra row to know whether a next page exists.
+    ranked = list(ranked_ids(search_query, offset, per_page + 1))
+    has_next = len(ranked) > per_page
+    ranks = dict(ranked[:per_page])
+    if not ranks:
+        return [], False
+
+    results = list(CrawledPage.objects.filter(id__in=ranks).values('id', 'url', 'title'))
+    # Headlines are expensive, so only build them for the rows being rendered.
+    headlines = content_of(
+        [result['url'] for result in results],
+        SearchHeadline('content', search_query, start_sel='<mark>', stop_sel='</mark>'),
+    )
+    for result in results:
+        result['rank'] = ranks[result['id']]
+        result['headline'] = headlines.get(result['url'], '')
+    results.sort(key=lambda r: (-r['rank'], -r['id']))
+    return results, has_next
+
+
+# Fields the search API can project; 'snippet' is a headline built on demand.
+API_FIELDS = ('id', 'url', 'title', 'rank', 'snippet', 'crawled_at')
+ROW_FIELDS = ('url', 'title', 'crawled_at')
+
+
+def encode_cursor(rank, page_id):
+    return base64.urlsafe_b64encode(json.dumps([rank, page_id]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return the (rank, id) a cursor points after; raises ValueError if it is malformed."""
+    try:
+        rank, page_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(rank), int(page_id)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def search_after(query, cursor=None, limit=RESULTS_PER_PAGE, fields=API_FIELDS, snippet_words=35):
+    """Return (results, next_cursor) for the matches ranked after cursor, keyset-paginated on (rank, id).
+
+    Only the requested fields are loaded; content is never read into Python,
+    and headlines are built only when 'snippet' is requested.
+    """
+    search_query = SearchQuery(query)
+    # ts_rank returns float4; widen it so the rank round-trips through the cursor exactly.
+    matches = CrawledPage.objects.filter(search_vector=search_query, canonical_url='', failed_at=None).annotate(
+        rank=Cast(SearchRank(F('search_vector'), search_query), FloatField())
+    )
+    if cursor:
+        rank, last_id = decode_cursor(cursor)
+        matches = matches.filter(Q(rank__lt=rank) | Q(rank=rank, id__lt=last_id))
+    row_fields = [field for field in ROW_FIELDS if field in fields or (field == 'url' and 'snippet' in fields)]
+    rows = list(matches.order_by('-rank', '-id').values('id', 'rank', *row_fields)[:limit + 1])
+    next_cursor = encode_cursor(rows[limit - 1]['rank'], rows[limit - 1]['id']) if len(rows) > limit else None
+    rows = rows[:limit]
+
+    if 'snippet' in fields and rows:
+        headlines = content_of(
+            [row['url'] for row in rows],
+            SearchHeadline(
+                'content', search_query, start_sel='<mark>', stop_sel='</mark>',
+                max_words=snippet_words, min_words=max(snippet_words // 2, 1),
+            ),
+        )
+        for row in rows:
+            row['snippet'] = headlines.get(row['url'], '')
+    return [{field: row[field] for field in fields} for row in rows], next_cursor
+
+
+def latest_queryset(limit=LATEST_PAGES):
+    """Most recently crawled pages whose last fetch succeeded, read from the page table alone."""
+    return CrawledPage.objects.filter(failed_at=None).order_by('-crawled_at').values('id', 'url', 'title')[:limit]
+
+
+def latest_pages(limit=LATEST_PAGES):
+    """Most recently crawled pages, with only the start of their content loaded."""
+    pages = list(latest_queryset(limit))
+    snippets = content_of([page['url'] for page in pages], Substr('content', 1, 200))
+    for page in pages:
+        page['snippet'] = snippets.get(page['url'], '')
+    return pages
+
+
+def bump_generation():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, timeout=None)
+
+
+def _generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, 1, timeout=None)
+        generation = cache.get(GENERATION_KEY, 1)
+    return generation
+
+
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+
+def _cached(key, compute):
+    """compute() cached under key.
+
+    A replica may lag behind the generation its result is cached under, so
+    replica reads are kept for at most CRAWLER_REPLICA_CACHE_TTL. Sessions
+    stuck to the primary never read the shared entry, which may have come from
+    a replica; their fresh result replaces it.
+    """
+    if not stuck_to_primary():
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    cached = compute()
+    timeout = settings.CRAWLER_SEARCH_CACHE_TTL
+    if replica_alias():
+        timeout = min(timeout, settings.CRAWLER_REPLICA_CACHE_TTL)
+    cache.set(key, cached, timeout)
+    return cached
+
+
+def cached_search_pages(query, page=1):
+    """search_pages() cached per normalized query and page until the next write."""
+    digest = hashlib.sha1(normalize_query(query).encode()).hexdigest()
+    return _cached(f'search:{_generation()}:{digest}:{page}', lambda: search_pages(query, page))
+
+
+def cached_latest_pages():
+    return _cached(f'search:{_generation()}:latest', latest_pages)
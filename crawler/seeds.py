@@ -0,0 +1,72 @@
+import gzip
+import io
+import os
+from collections import namedtuple
+from django.conf import settings
+from . import frontier
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+SeedResult = namedtuple('SeedResult', ['crawl_id', 'read', 'queued'])
+
+
+def open_seed_stream(fileobj):
+    """Text lines from a binary seed file, transparently gunzipped if it is compressed."""
+    if not hasattr(fileobj, 'peek'):
+        fileobj = io.BufferedReader(fileobj)
+    if fileobj.peek(2)[:2] == GZIP_MAGIC:
+        fileobj = gzip.GzipFile(fileobj=fileobj)
+    return io.TextIOWrapper(fileobj, encoding='utf-8', errors='replace')
+
+
+def save_upload(crawl_id, upload):
+    """Copy an uploaded seed file, still compressed if it was, to where workers can read it; returns the path."""
+    os.makedirs(settings.CRAWLER_SEED_UPLOAD_DIR, exist_ok=True)
+    path = os.path.join(settings.CRAWLER_SEED_UPLOAD_DIR, f'{crawl_id}.seeds')
+    with open(path, 'wb') as out:
+        for chunk in upload.chunks():
+            out.write(chunk)
+    return path
+
+
+def ingest_file(crawl_id, path, on_batch=None):
+    """Queue the seeds saved at path for crawl_id, then delete the file."""
+    with open(path, 'rb') as fileobj:
+        result = ingest(open_seed_stream(fileobj), crawl_id=crawl_id, on_batch=on_batch)
+    os.remove(path)
+    return result
+
+
+def ingest(lines, max_depth=None, max_pages=None, batch_size=None, on_batch=None, crawl_id=None):
+    """Queue every crawlable URL in lines, one per line, as the seeds of one crawl.
+
+    The crawl is crawl_id if given (from frontier.start_seeded_crawl()),
+    otherwise a new one. Blank lines and '#' comments are skipped. URLs are
+    normalized and queued batch_size at a time, so memory stays flat however
+    long the list is; on_batch(result) is called after each batch so callers
+    can start crawling before the whole list is in.
+    """
+    batch_size = batch_size or settings.CRAWLER_SEED_BATCH_SIZE
+    if crawl_id is None:
+        crawl_id = frontier.start_seeded_crawl(max_depth, max_pages)
+    read = queued = 0
+    batch = {}
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        read += 1
+        url = frontier.normalize_url(line)
+        if url:
+            batch[url] = None
+        if len(batch) >= batch_size:
+            queued += frontier.add_seeds(crawl_id, list(batch))
+            batch = {}
+            if on_batch:
+                on_batch(SeedResult(crawl_id, read, queued))
+    if batch:
+        queued += frontier.add_seeds(crawl_id, list(batch))
+    result = SeedResult(crawl_id, read, queued)
+    if on_batch:
+        on_batch(result)
+    return result
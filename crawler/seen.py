@@ -0,0 +1,89 @@
+import hashlib
+import math
+import time
+from django.conf import settings
+from .redis_client import get_redis
+
+SEEN_KEY = 'crawler:seen:{}:{}'
+
+# Max bits per shard; Redis strings cap out at 2**32 bits.
+MAX_SHARD_BITS = 2 ** 31
+
+
+class SeenFilter:
+    """Redis Bloom filter shared by all workers, sized for capacity URLs at error_rate.
+
+    Bits are spread over shards so the filter can outgrow a single Redis string,
+    and kept in windows of ttl seconds: a URL counts as seen for at least ttl and
+    at most 2 * ttl seconds after it was added.
+    """
+
+    def __init__(self, capacity, error_rate, ttl):
+        bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(bits / capacity * math.log(2)))
+        self.shards = math.ceil(bits / MAX_SHARD_BITS)
+        self.shard_bits = math.ceil(bits / self.shards)
+        self.ttl = ttl
+
+    def _locate(self, url):
+        digest = hashlib.blake2b(url.encode(), digest_size=24).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:16], 'big') | 1
+        shard = int.from_bytes(digest[16:], 'big') % self.shards
+        return shard, [(h1 + i * h2) % self.shard_bits for i in range(self.hashes)]
+
+    def unseen(self, urls):
+        """Return the urls not seen in the current or previous window, without marking them.
+
+        Callers mark() only the URLs they go on to accept, so URLs rejected later
+        (by a crawl's page budget, say) stay eligible for other crawls. Two
+        workers checking the same URL at once may both accept it.
+        """
+        urls = list(dict.fromkeys(urls))
+        if not urls:
+            return []
+        window = int(time.time() // self.ttl)
+        with get_redis().pipeline(transaction=False) as pipe:
+            for url in urls:
+                shard, offsets = self._locate(url)
+                for key in (SEEN_KEY.format(window, shard), SEEN_KEY.format(window - 1, shard)):
+                    pipe.execute_command('BITFIELD', key, *self._ops('GET', offsets))
+            results = pipe.execute()
+        return [
+            url for url, current, previous in zip(urls, results[::2], results[1::2])
+            if not all(current) and not all(previous)
+        ]
+
+    def mark(self, urls):
+        """Record urls as seen in the current window."""
+        if not urls:
+            return
+        window = int(time.time() // self.ttl)
+        with get_redis().pipeline(transaction=False) as pipe:
+            for url in urls:
+                shard, offsets = self._locate(url)
+                current = SEEN_KEY.format(window, shard)
+                pipe.execute_command('BITFIELD', current, *self._ops('SET', offsets, 1))
+                pipe.expire(current, 2 * self.ttl)
+            pipe.execute()
+
+    @staticmethod
+    def _ops(op, offsets, *value):
+        args = []
+        for offset in offsets:
+            args += [op, 'u1', offset, *value]
+        return args
+
+
+_filter = None
+
+
+def get_seen_filter():
+    global _filter
+    if _filter is None:
+        _filter = SeenFilter(
+            settings.CRAWLER_SEEN_CAPACITY,
+            settings.CRAWLER_SEEN_ERROR_RATE,
+            settings.CRAWLER_SEEN_TTL,
+        )
+    return _filter
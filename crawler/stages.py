@@ -0,0 +1,55 @@
+import json
+import zlib
+import redis
+from django.conf import settings
+from . import frontier, pipeline
+from .leases import LeasedQueue
+from .redis_client import get_redis
+
+# Raw pages handed from the fetch stage to the parse stage, zlib-compressed.
+PARSE_QUEUE_KEY = 'crawler:parse:queue'
+# A claimed batch stays in its own in-flight list until the parse task acks it,
+# and goes back on the queue if that has not happened within CRAWLER_PARSE_LEASE.
+PARSE_INFLIGHT_KEY = 'crawler:parse:inflight:'
+PARSE_LEASES_KEY = 'crawler:parse:leases'
+_parse_queue = LeasedQueue(PARSE_QUEUE_KEY, PARSE_INFLIGHT_KEY, PARSE_LEASES_KEY)
+
+
+def push_raw(pages):
+    """Queue fetched pages (dicts holding the raw 'text') for the parse stage."""
+    items = [zlib.compress(json.dumps(page).encode(), settings.CRAWLER_PARSE_COMPRESSION) for page in pages]
+    return get_redis().rpush(PARSE_QUEUE_KEY, *items)
+
+
+def pop_raw(count):
+    """Claim up to count fetched pages; returns (token, pages). Call ack_raw(token) once they are handled."""
+    r = get_redis()
+    _parse_queue.requeue_expired(r)
+    token, items = _parse_queue.claim(r, count, settings.CRAWLER_PARSE_LEASE)
+    return token, [json.loads(zlib.decompress(item)) for item in items]
+
+
+def ack_raw(token):
+    _parse_queue.ack(get_redis(), token)
+
+
+def parse_backlog():
+    return get_redis().llen(PARSE_QUEUE_KEY)
+
+
+def queue_depths():
+    """Items waiting in front of each stage, plus the Celery broker queue lengths."""
+    depths = {
+        'frontier': frontier.size(),
+        'parse': parse_backlog(),
+        'persist': pipeline.buffer_size(),
+    }
+    # The Redis broker keeps each Celery queue in a list named after it.
+    if settings.CELERY_BROKER_URL.startswith('redis'):
+        if settings.CELERY_BROKER_URL == settings.CRAWLER_REDIS_URL:
+            broker = get_redis()
+        else:
+            broker = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+        for queue in settings.CRAWLER_STAGE_QUEUES:
+            depths[f'celery:{queue}'] = broker.llen(queue)
+    return depths
@@ -0,0 +1,136 @@
+import html
+import itertools
+import math
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A deterministic stand-in for the web, used by `manage.py benchmark_crawl`.
+# Pages are numbered 0..pages-1 and spread round-robin over `sites` servers,
+# one port each, so the crawler sees them as separate hosts. Page i links to
+# pages 2i+1 and 2i+2, which makes every page reachable from page 0 within
+# log2(pages) hops, plus `links` pseudo-random pages anywhere in the graph.
+
+VOCABULARY = [
+    ''.join(syllables)
+    for syllables in itertools.islice(
+        itertools.product(['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo'], repeat=4), 2000
+    )
+]
+# Each page writes about its own topic: TOPIC_WORDS words sampled from the
+# vocabulary, used with Zipf-like frequencies. Drawing every page from one
+# shared ranking would make the same few words dominate every page, and SimHash
+# would report unrelated pages as near-duplicates.
+TOPIC_WORDS = 200
+WORD_WEIGHTS = list(itertools.accumulate(1 / rank for rank in range(1, TOPIC_WORDS + 1)))
+
+ROBOTS_TXT = b'User-agent: *\nAllow: /\n'
+
+
+class SyntheticSite:
+    """The page graph; every page's links, size and status derive from (seed, page number)."""
+
+    def __init__(self, pages, sites=1, links=8, page_kb=20.0, latency_ms=50.0, jitter=0.5,
+                 error_rate=0.0, seed=0, prefix=''):
+        self.pages = pages
+        self.sites = sites
+        self.links = links
+        self.page_bytes = page_kb * 1024
+        self.latency = latency_ms / 1000
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.seed = seed
+        self.prefix = prefix
+        self.origins = [''] * sites
+        self.served = Counter()
+        self._lock = threading.Lock()
+
+    def url(self, page):
+        return f'{self.origins[page % self.sites]}{self.prefix}/p{page}'
+
+    def _page_number(self, site, path):
+        if not path.startswith(f'{self.prefix}/p'):
+            return None
+        number = path[len(self.prefix) + 2:]
+        if not number.isdigit() or int(number) >= self.pages or int(number) % self.sites != site:
+            return None
+        return int(number)
+
+    def render(self, site, path):
+        """Return (status, body) for path on site."""
+        if path == '/robots.txt':
+            return 200, ROBOTS_TXT
+        page = self._page_number(site, path)
+        if page is None:
+            return 404, b'Not found'
+        rng = random.Random(f'{self.seed}:{page}')
+        if rng.random() < self.error_rate:
+            return 500, b'Server error'
+        targets = [2 * page + 1, 2 * page + 2] + [rng.randrange(self.pages) for _ in range(self.links)]
+        anchors = ''.join(
+            f'<li><a href="{html.escape(self.url(target))}">Page {target}</a></li>'
+            for target in targets if target < self.pages
+        )
+        # Page weights are log-normal around page_kb; words are 9 bytes with the space.
+        words = max(1, int(rng.lognormvariate(math.log(self.page_bytes), 0.5) / 9))
+        topic = rng.sample(VOCABULARY, TOPIC_WORDS)
+        text = ' '.join(rng.choices(topic, cum_weights=WORD_WEIGHTS, k=words))
+        body = (
+            f'<!DOCTYPE html><html><head><title>Page {page}</title></head><body>'
+            f'<h1>Page {page}</h1><p>{text}</p><ul>{anchors}</ul></body></html>'
+        )
+        return 200, body.encode()
+
+    def count(self, status, size):
+        with self._lock:
+            self.served['requests'] += 1
+            self.served['pages' if status == 200 else 'errors' if status >= 500 else 'missing'] += 1
+            self.served['bytes'] += size
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Crawlers drop idle keep-alive connections; that is not worth a traceback.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def _handler(site, index):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            if site.latency:
+                time.sleep(site.latency * random.uniform(1 - site.jitter, 1 + site.jitter))
+            status, body = site.render(index, self.path)
+            if self.path != '/robots.txt':
+                site.count(status, len(body))
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/html; charset=utf-8' if status == 200 else 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(site, bind='127.0.0.1', host=None):
+    """Start one threaded server per site on free ports; returns the servers.
+
+    host is the name crawlers use to reach them, defaulting to bind.
+    """
+    servers = []
+    for index in range(site.sites):
+        server = _Server((bind, 0), _handler(site, index))
+        site.origins[index] = f'http://{host or bind}:{server.server_address[1]}'
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    return servers
@@ -1,36 +1,433 @@
 from celery import shared_task
+import logging
+import random
+import time
 import requests
-from bs4 import BeautifulSoup
-from .models import CrawledPage
+from django.conf import settings
+from . import (
+    archive, breaker, dedup, extractors, fetcher, freshness, frontier, jobs, metrics, partitions, pipeline, profiling,
+    seeds, stages,
+)
+from .politeness import host_of
+from .robots import get_robots_cache
+
+logger = logging.getLogger(__name__)
+
+# Shared across tasks in a worker process so keep-alive connections are reused.
+session = requests.Session()
+session.headers['User-Agent'] = settings.CRAWLER_USER_AGENT
+
+# Extracted text kept per page; fingerprints cover the same prefix.
+MAX_CONTENT_CHARS = 50000
+
+
+def parse_page(url, html):
+    page = extractors.extract(html)
+    # Collect outgoing links, resolved against the page URL
+    links = []
+    with profiling.stage('normalize_links', url):
+        for href in page.links:
+            link = frontier.normalize_url(href, base=url)
+            if link:
+                links.append(link)
+    return page.title or url, page.content, links
+
+
+def store_page(url, title, content, fetched, fingerprint=0, canonical_url=''):
+    should_flush = pipeline.enqueue_page({
+        'url': url,
+        'title': title[:1000],  # Limit title length
+        # Near-duplicates only link to their canonical page
+        'content': '' if canonical_url else content[:MAX_CONTENT_CHARS],
+        'status_code': fetched['status_code'],
+        'etag': fetched['etag'][:255],
+        'last_modified': fetched['last_modified'][:64],
+        'content_hash': fetched['content_hash'],
+        'checked_at': fetched['checked_at'],
+        'refresh_interval': fetched['refresh_interval'],
+        'archive_segment': fetched['archive_segment'],
+        'archive_offset': fetched['archive_offset'],
+        'archive_length': fetched['archive_length'],
+        'simhash': dedup.to_signed(fingerprint),
+        'simhash_bands': dedup.bands(fingerprint) if fingerprint else [],
+        'canonical_url': canonical_url,
+    })
+    if should_flush:
+        flush_crawl_results_task.delay()
+
+
+def store_pages(pages):
+    """Fingerprint (url, title, content, fetched) tuples, collapse near-duplicates and store them."""
+    fingerprints = {}
+    for url, _, content, _ in pages:
+        with profiling.stage('simhash', url):
+            fingerprints[url] = dedup.simhash(content[:MAX_CONTENT_CHARS])
+    with profiling.stage('find_canonicals'):
+        canonicals = dedup.find_canonicals(fingerprints)
+    for url, title, content, fetched in pages:
+        with profiling.stage('enqueue', url):
+            store_page(url, title, content, fetched, fingerprints[url], canonicals.get(url, ''))
+
+
+def fetched_page(result, state, store=True, crawl=None):
+    """Describe a fetched page for the parse stage.
+
+    store is False when only the page's links are wanted; crawl is the
+    (crawl_id, depth) whose frontier receives those links. Pages to be stored
+    have their raw response archived first.
+    """
+    with profiling.stage('archive', result.url):
+        archived = archive.archive_result(result) if store else {}
+    return {
+        **archived,
+        'url': result.url,
+        'text': result.text,
+        'status_code': result.status_code,
+        'etag': result.etag,
+        'last_modified': result.last_modified,
+        'content_hash': freshness.content_hash(result.text),
+        'checked_at': time.time(),
+        'refresh_interval': freshness.changed_interval(state),
+        'store': store,
+        'crawl': crawl,
+    }
+
+
+def retry_countdown(urls, attempt):
+    """Seconds before retry attempt (counted from 0) of urls.
+
+    The backoff doubles per attempt, with jitter so a batch that failed
+    together does not retry together, and waits out any open circuit breaker
+    of the urls' hosts.
+    """
+    delay = min(settings.CRAWLER_RETRY_BACKOFF * 2 ** attempt, settings.CRAWLER_RETRY_BACKOFF_MAX)
+    closes_at = max(breaker.open_until(urls).values(), default=0)
+    return max(random.uniform(delay / 2, delay), closes_at - time.time())
+
+
+def is_transient(error):
+    """Whether a requests exception is worth retrying, as FetchResult.transient is for the async engine."""
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code in fetcher.RETRY_STATUSES
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError))
+
+
+def _only(mapping, urls):
+    return {url: mapping[url] for url in urls if url in mapping}
+
+
+def crawl_urls(urls, follow=None, crawls=None, attempt=0):
+    """Fetch stage: fetch urls on the async engine and queue the pages for the parse stage.
+
+    Pages crawled before are fetched conditionally. When the server answers 304
+    or the body hash is unchanged, the page is neither parsed nor written and
+    only its freshness timestamp is touched. follow maps URLs whose links are
+    still wanted to their (crawl_id, depth); those are always fetched in full
+    and parsed. crawls maps URLs to the crawl whose progress counts them.
+
+    URLs on hosts whose circuit breaker is open are not fetched. They and
+    transient failures are handed back for retry until attempt reaches
+    CRAWLER_FETCH_MAX_RETRIES; other failures are recorded on the page.
+    Returns (pages queued for parsing, URLs to retry).
+    """
+    follow = follow or {}
+    crawls = crawls or {}
+    final = attempt >= settings.CRAWLER_FETCH_MAX_RETRIES
+    with profiling.stage('breaker'):
+        open_hosts = breaker.open_until(urls)
+    blocked = [url for url in urls if host_of(url) in open_hosts]
+    if blocked:
+        urls = [url for url in urls if host_of(url) not in open_hosts]
+    with profiling.stage('load_states'):
+        states = freshness.load_states(urls)
+    headers = {
+        url: freshness.conditional_headers(state)
+        for url, state in states.items() if url not in follow
+    }
+    pages = []
+    unchanged = []
+    retry = [] if final else blocked
+    failures = {url: (None, 'Circuit breaker open for host') for url in blocked} if final else {}
+    outcomes = breaker.Outcomes()
+    with metrics.recording() as recorder, jobs.tracking() as progress:
+        for result in fetcher.fetch_batch(urls, headers=headers) if urls else []:
+            url = result.url
+            recorder.fetched(result)
+            outcomes.add(url, failed=result.transient)
+            if not result.ok:
+                if result.transient and not final:
+                    retry.append(url)
+                else:
+                    failures[url] = (result.status_code, result.error)
+                    logger.warning('Crawl failed for %s: %s', url, result.error)
+                continue
+            if url in crawls:
+                progress.fetched(crawls[url], result)
+            state = states.get(url)
+            is_unchanged = freshness.is_unchanged(state, result.status_code, result.text)
+            if is_unchanged:
+                recorder.incr('pages_unchanged')
+                unchanged.append(url)
+                if url not in follow:
+                    continue
+            pages.append(fetched_page(result, state, store=not is_unchanged, crawl=follow.get(url)))
+        for url in failures:
+            if url in crawls:
+                progress.failed(crawls[url])
+        if retry:
+            recorder.incr('fetch_retries', len(retry))
+        if failures:
+            recorder.incr('fetch_failures', len(failures))
+        tripped = outcomes.record()
+        if tripped:
+            recorder.incr('breaker_trips', len(tripped))
+            logger.warning('Circuit breaker opened for %s', ', '.join(tripped))
+    freshness.touch(unchanged)
+    freshness.record_failures(failures)
+    if pages:
+        with profiling.stage('handoff'):
+            stages.push_raw(pages)
+        parse_pages_task.delay()
+    return len(pages), retry
+
+
+def queue_retry(urls, follow=None, crawls=None):
+    """Hand URLs that failed transiently on their first fetch to crawl_retry_task."""
+    if urls:
+        crawl_retry_task.apply_async(
+            (urls, _only(follow or {}, urls), _only(crawls or {}, urls)), countdown=retry_countdown(urls, 0)
+        )
+
+
+@shared_task
+@profiling.profiled()
+def parse_pages_task():
+    """Parse stage: drain a batch of raw pages, store them and queue their links."""
+    token, pages = stages.pop_raw(settings.CRAWLER_PARSE_BATCH_SIZE)
+    followed = False
+    to_store = []
+    with metrics.recording() as recorder:
+        for page in pages:
+            try:
+                start = time.perf_counter()
+                with profiling.domain(page['url']):
+                    title, content, links = parse_page(page['url'], page['text'])
+                recorder.observe('parse_seconds', time.perf_counter() - start)
+                recorder.incr('pages_parsed')
+                if page['store']:
+                    to_store.append((page['url'], title, content, page))
+                if page['crawl']:
+                    crawl_id, depth = page['crawl']
+                    with profiling.stage('frontier_add', page['url']):
+                        followed = frontier.add(crawl_id, links, depth + 1) or followed
+            except Exception as e:
+                recorder.incr('parse_errors')
+                logger.warning('Parse failed for %s: %s', page['url'], e)
+    store_pages(to_store)
+    # A worker lost before this point leaves the batch to be parsed again once its lease ends.
+    stages.ack_raw(token)
+    if followed:
+        dispatch_frontier_pullers()
+    # Another fetch batch may have landed while this one was parsed.
+    if len(pages) == settings.CRAWLER_PARSE_BATCH_SIZE and stages.parse_backlog():
+        parse_pages_task.delay()
+    return f"Parsed {len(pages)} pages"
+
+
+@shared_task(bind=True)
+@profiling.profiled()
+def crawl_page_task(self, url):
+    """Fetch and store one URL, retrying transient failures with backoff via Celery."""
+    attempt = self.request.retries
+    with metrics.recording() as recorder, profiling.domain(url):
+        if breaker.open_until([url]):
+            if attempt < settings.CRAWLER_FETCH_MAX_RETRIES:
+                raise self.retry(
+                    countdown=retry_countdown([url], attempt), max_retries=settings.CRAWLER_FETCH_MAX_RETRIES
+                )
+            freshness.record_failures({url: (None, 'Circuit breaker open for host')})
+            recorder.incr('fetch_failures')
+            return f"Circuit breaker open for {url}"
+        try:
+            with profiling.stage('robots'):
+                if not get_robots_cache().allowed(url):
+                    return f"Disallowed by robots.txt: {url}"
+            with profiling.stage('load_states'):
+                state = freshness.load_states([url]).get(url)
+            start = time.perf_counter()
+            with session.get(
+                url, timeout=settings.CRAWLER_FETCH_TIMEOUT, headers=freshness.conditional_headers(state), stream=True
+            ) as response:
+                # requests has no DNS/connect hooks, so 'request' covers everything up to the headers.
+                profiling.record('request', time.perf_counter() - start)
+                response.raise_for_status()
+                result = fetcher.FetchResult(
+                    url, response.status_code,
+                    etag=response.headers.get('ETag', ''),
+                    last_modified=response.headers.get('Last-Modified', ''),
+                )
+                if response.status_code != 304:
+                    max_bytes = settings.CRAWLER_MAX_BODY_BYTES
+                    result.content_type = fetcher.check_response(
+                        response.headers, settings.CRAWLER_ALLOWED_CONTENT_TYPES, max_bytes
+                    )
+                    with profiling.stage('download'):
+                        result.body, result.truncated = fetcher.read_capped(
+                            response.iter_content(fetcher.CHUNK_SIZE), max_bytes
+                        )
+                    result.text = fetcher.decode_body(result.body, result.content_type)
+            result.elapsed = time.perf_counter() - start
+            recorder.fetched(result)
+            outcomes = breaker.Outcomes()
+            outcomes.add(url, failed=False)
+            outcomes.record()
+
+            if freshness.is_unchanged(state, result.status_code, result.text):
+                recorder.incr('pages_unchanged')
+                freshness.touch([url])
+                return f"Unchanged: {url}"
+            start = time.perf_counter()
+            title, content, _ = parse_page(url, result.text)
+            recorder.observe('parse_seconds', time.perf_counter() - start)
+            recorder.incr('pages_parsed')
+            store_pages([(url, title, content, fetched_page(result, state))])
+            return f"Successfully crawled: {url}"
+        except (requests.RequestException, fetcher.RejectedResponse) as e:
+            recorder.incr('fetch_errors')
+            transient = is_transient(e)
+            outcomes = breaker.Outcomes()
+            outcomes.add(url, failed=transient)
+            if outcomes.record():
+                recorder.incr('breaker_trips')
+            if transient and attempt < settings.CRAWLER_FETCH_MAX_RETRIES:
+                recorder.incr('fetch_retries')
+                raise self.retry(
+                    exc=e, countdown=retry_countdown([url], attempt), max_retries=settings.CRAWLER_FETCH_MAX_RETRIES
+                )
+            response = getattr(e, 'response', None)
+            freshness.record_failures({url: (getattr(response, 'status_code', None), str(e))})
+            recorder.incr('fetch_failures')
+            logger.warning('Crawl failed for %s: %s', url, e)
+            return f"Crawl failed for {url}: {str(e)}"
+        except Exception as e:
+            recorder.incr('fetch_errors')
+            logger.exception('Crawl failed for %s', url)
+            return f"Crawl failed for {url}: {str(e)}"
+
 
 @shared_task
-def crawl_page_task(url):
+@profiling.profiled()
+def crawl_batch_task(urls):
+    """Fetch a batch of URLs concurrently on the async engine and hand them to the parse stage."""
+    queued, retry = crawl_urls(get_robots_cache().filter_allowed(urls))
+    queue_retry(retry)
+    return f"Fetched {queued}/{len(urls)} pages"
+
+
+@shared_task(bind=True)
+@profiling.profiled()
+def crawl_retry_task(self, urls, follow=None, crawls=None):
+    """Re-fetch URLs that failed transiently; what fails again is retried with a doubled backoff."""
+    attempt = self.request.retries + 1
+    queued, retry = crawl_urls(urls, follow, crawls, attempt)
+    if retry:
+        raise self.retry(
+            args=(retry, _only(follow or {}, retry), _only(crawls or {}, retry)),
+            countdown=retry_countdown(retry, attempt),
+            max_retries=settings.CRAWLER_FETCH_MAX_RETRIES,
+        )
+    return f"Retried {len(urls)} URLs (attempt {attempt}), {queued} fetched"
+
+
+def dispatch_frontier_pullers():
+    # Back off fetching while the parse stage is behind.
+    if stages.parse_backlog() > settings.CRAWLER_PARSE_MAX_BACKLOG:
+        return
+    pullers = frontier.acquire_pullers(settings.CRAWLER_FRONTIER_PULLERS, settings.CRAWLER_FRONTIER_BATCH_SIZE)
+    for token, countdown in pullers:
+        crawl_frontier_task.apply_async((token,), countdown=countdown)
+
+
+@shared_task
+@profiling.profiled()
+def crawl_frontier_task(token=None):
+    """Pull one batch from the shared frontier, crawl it and queue the discovered links."""
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+        with profiling.stage('frontier_pop'):
+            entries = frontier.pop(settings.CRAWLER_FRONTIER_BATCH_SIZE)
+        with profiling.stage('robots'):
+            allowed, unreachable = get_robots_cache().split_allowed([entry.url for entry in entries])
+        allowed, unreachable = set(allowed), set(unreachable)
+        # Hosts whose robots.txt could not be fetched get another try once the error expires.
+        deferred = [
+            entry for entry in entries
+            if entry.url in unreachable and entry.deferrals < settings.CRAWLER_ROBOTS_MAX_DEFERRALS
+        ]
+        frontier.defer(deferred, settings.CRAWLER_ROBOTS_ERROR_TTL)
+        deferred = {entry.url for entry in deferred}
+        with jobs.tracking() as progress:
+            for entry in entries:
+                if entry.url not in allowed and entry.url not in deferred:
+                    progress.failed(entry.crawl_id)
+        entries = [entry for entry in entries if entry.url in allowed]
+        max_depths = {}
+        for entry in entries:
+            if entry.crawl_id not in max_depths:
+                max_depths[entry.crawl_id] = int(frontier.crawl_info(entry.crawl_id).get('max_depth', 0))
+        follow = {
+            entry.url: (entry.crawl_id, entry.depth)
+            for entry in entries if entry.depth < max_depths[entry.crawl_id]
         }
-        response = requests.get(url, timeout=10, headers=headers)
-        response.raise_for_status()
-        
-        # Parse HTML to extract title
-        soup = BeautifulSoup(response.text, 'html.parser')
-        title = soup.title.string if soup.title else url
-        
-        # Extract text content (remove scripts and styles)
-        for script in soup(["script", "style"]):
-            script.decompose()
-        content = soup.get_text(separator=' ', strip=True)
-        
-        CrawledPage.objects.update_or_create(
-            url=url,
-            defaults={
-                'title': title[:1000],  # Limit title length
-                'content': content[:50000],  # Limit content length
-                'status_code': response.status_code
-            }
-        )
-        return f"Successfully crawled: {url}"
-    except Exception as e:
-        error_msg = f"Crawl failed for {url}: {str(e)}"
-        print(error_msg)
-        return error_msg
+        if entries:
+            crawls = {entry.url: entry.crawl_id for entry in entries}
+            _, retry = crawl_urls([entry.url for entry in entries], follow, crawls)
+            queue_retry(retry, follow, crawls)
+    finally:
+        frontier.release_puller(token)
+    dispatch_frontier_pullers()
+    return f"Crawled {len(entries)} frontier entries"
+
+
+@shared_task
+def ingest_seeds_task(crawl_id, path):
+    """Queue an uploaded seed file for crawl_id, starting pullers after each batch."""
+    result = seeds.ingest_file(crawl_id, path, on_batch=lambda result: dispatch_frontier_pullers())
+    return f"Queued {result.queued} of {result.read} seed URLs for crawl {crawl_id}"
+
+
+@shared_task
+def dispatch_frontier_task():
+    dispatch_frontier_pullers()
+
+
+@shared_task
+def refresh_due_pages_task():
+    """Queue pages whose adaptive refresh time has passed for a conditional re-crawl."""
+    urls = freshness.claim_due(settings.CRAWLER_REFRESH_BATCH_SIZE)
+    if urls:
+        frontier.start_refresh(urls)
+        dispatch_frontier_pullers()
+    return f"Queued {len(urls)} pages for refresh"
+
+
+@shared_task
+@profiling.profiled()
+def flush_crawl_results_task():
+    return pipeline.flush()
+
+
+@shared_task
+def flush_crawl_jobs_task():
+    return f"Saved progress of {jobs.flush()} crawls"
+
+
+@shared_task
+def maintain_partitions_task():
+    """Create upcoming content partitions and detach the ones past the retention window."""
+    created = partitions.ensure_content_partitions()
+    detached = []
+    if settings.CRAWLER_CONTENT_RETENTION_MONTHS:
+        for name in partitions.stale_partitions(settings.CRAWLER_CONTENT_RETENTION_MONTHS):
+            partitions.detach(name)
+            detached.append(name)
+    return f"Created {len(created)} and detached {len(detached)} content partitions"
@@ -0,0 +1,113 @@
+import hashlib
+import random
+from collections import Counter
+from django.test import SimpleTestCase, TestCase, override_settings
+from crawler import dedup
+from crawler.models import CrawledPage
+
+
+def _words(rng, count):
+    return ' '.join(f'word{rng.randrange(5000)}' for _ in range(count))
+
+
+def _flip(fingerprint, rng, bits):
+    for position in rng.sample(range(64), bits):
+        fingerprint ^= 1 << position
+    return fingerprint
+
+
+class SimHashTests(SimpleTestCase):
+    def test_matches_per_bit_definition(self):
+        rng = random.Random(1)
+        for _ in range(20):
+            text = _words(rng, rng.randrange(1, 300))
+            sums = [0] * 64
+            for token, weight in Counter(dedup.TOKEN_RE.findall(text.lower())).items():
+                value = int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), 'big')
+                for bit in range(64):
+                    sums[bit] += weight if value >> bit & 1 else -weight
+            expected = sum(1 << bit for bit in range(64) if sums[bit] > 0)
+            self.assertEqual(dedup.simhash(text), expected)
+
+    def test_empty_text(self):
+        self.assertEqual(dedup.simhash(''), 0)
+        self.assertEqual(dedup.simhash(' .,; '), 0)
+
+    def test_ignores_case_and_punctuation(self):
+        self.assertEqual(dedup.simhash('Hello, World!'), dedup.simhash('hello world'))
+
+    def test_small_edit_stays_near(self):
+        rng = random.Random(2)
+        words = _words(rng, 1000).split()
+        edited = words[:500] + ['changed'] + words[501:]
+        distance = dedup.distance(dedup.simhash(' '.join(words)), dedup.simhash(' '.join(edited)))
+        self.assertLessEqual(distance, 3)
+
+    def test_unrelated_texts_are_far(self):
+        rng = random.Random(3)
+        distance = dedup.distance(dedup.simhash(_words(rng, 1000)), dedup.simhash(_words(rng, 1000)))
+        self.assertGreater(distance, 10)
+
+
+class BandTests(SimpleTestCase):
+    def test_bands_fit_integer_column(self):
+        rng = random.Random(4)
+        for fingerprint in [0, (1 << 64) - 1] + [rng.getrandbits(64) for _ in range(100)]:
+            values = dedup.bands(fingerprint)
+            self.assertEqual(len(values), len(dedup.BAND_PAIRS))
+            self.assertTrue(all(0 <= value < 2 ** 31 for value in values))
+            self.assertEqual([value >> dedup.BAND_BITS for value in values], list(range(len(dedup.BAND_PAIRS))))
+
+    def test_fingerprints_within_three_bits_share_a_band(self):
+        rng = random.Random(5)
+        for _ in range(2000):
+            fingerprint = rng.getrandbits(64)
+            other = _flip(fingerprint, rng, rng.randint(0, 3))
+            self.assertTrue(set(dedup.bands(fingerprint)) & set(dedup.bands(other)))
+
+    def test_distance(self):
+        self.assertEqual(dedup.distance(0, 0), 0)
+        self.assertEqual(dedup.distance(0b1011, 0b0001), 2)
+        self.assertEqual(dedup.distance(0, (1 << 64) - 1), 64)
+
+    def test_signed_round_trip(self):
+        for fingerprint in (0, 1, (1 << 63) - 1, 1 << 63, (1 << 64) - 1):
+            signed = dedup.to_signed(fingerprint)
+            self.assertTrue(-(1 << 63) <= signed < 1 << 63)
+            self.assertEqual(dedup.to_unsigned(signed), fingerprint)
+
+
+@override_settings(CRAWLER_NEAR_DUPLICATE_DISTANCE=3)
+class FindCanonicalsTests(TestCase):
+    fingerprint = 0x0123456789ABCDEF
+
+    def _store(self, url, fingerprint, canonical_url=''):
+        CrawledPage.objects.create(
+            url=url, simhash=dedup.to_signed(fingerprint), simhash_bands=dedup.bands(fingerprint),
+            canonical_url=canonical_url,
+        )
+
+    def test_threshold(self):
+        self._store('https://example.com/a', self.fingerprint)
+        found = dedup.find_canonicals({
+            'https://example.com/three': self.fingerprint ^ 0b111,
+            'https://example.com/four': self.fingerprint ^ 0b1111 << 20,
+        })
+        self.assertEqual(found, {'https://example.com/three': 'https://example.com/a'})
+
+    def test_earlier_page_in_batch_is_canonical(self):
+        found = dedup.find_canonicals({
+            'https://example.com/first': self.fingerprint,
+            'https://example.com/second': self.fingerprint ^ 1,
+        })
+        self.assertEqual(found, {'https://example.com/second': 'https://example.com/first'})
+
+    def test_referenced_page_stays_canonical(self):
+        self._store('https://example.com/a', self.fingerprint)
+        self._store('https://example.com/dup', self.fingerprint ^ 1, canonical_url='https://example.com/b')
+        found = dedup.find_canonicals({'https://example.com/b': self.fingerprint ^ 2})
+        self.assertEqual(found, {})
+
+    def test_pages_without_fingerprint_are_skipped(self):
+        self._store('https://example.com/a', 0)
+        self.assertEqual(dedup.find_canonicals({'https://example.com/b': 0}), {})
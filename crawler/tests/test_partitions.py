@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta, timezone
+from django.db import connection
+from django.test import TestCase
+from crawler import partitions
+from crawler.models import PageContent
+
+
+class ContentPartitionTests(TestCase):
+    """Runs against the migrated schema, which has a default content partition."""
+
+    month = datetime(2001, 1, 1, tzinfo=timezone.utc)
+    url = 'https://example.com/old'
+
+    def _attached(self, name):
+        return {partition['name']: partition['attached'] for partition in partitions.content_partitions()}.get(name)
+
+    def test_default_partition_exists(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT to_regclass(%s)', [partitions.DEFAULT_PARTITION])
+            self.assertIsNotNone(cursor.fetchone()[0])
+
+    def test_ensure_moves_rows_out_of_default_partition(self):
+        PageContent.objects.create(url=self.url, content='old text', written_at=self.month + timedelta(days=3))
+        name = partitions.partition_name(self.month)
+        self.assertEqual(partitions.ensure_content_partitions(ahead=0, now=self.month), [name])
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {name} WHERE url = %s', [self.url])
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_detach_and_attach(self):
+        PageContent.objects.create(url=self.url, content='old text', written_at=self.month + timedelta(days=3))
+        name = partitions.partition_name(self.month)
+        partitions.ensure_content_partitions(ahead=0, now=self.month)
+
+        partitions.detach(name)
+        self.assertIs(self._attached(name), False)
+        self.assertFalse(PageContent.objects.filter(url=self.url).exists())
+
+        partitions.attach(name)
+        self.assertIs(self._attached(name), True)
+        self.assertTrue(PageContent.objects.filter(url=self.url).exists())
+
+    def test_stale_partitions(self):
+        partitions.ensure_content_partitions(ahead=0, now=self.month)
+        name = partitions.partition_name(self.month)
+        self.assertIn(name, partitions.stale_partitions(12))
+        self.assertNotIn(name, partitions.stale_partitions(12, now=self.month))
+
+    def test_rejects_other_tables(self):
+        with self.assertRaises(ValueError):
+            partitions.detach('crawler_crawledpage')
@@ -0,0 +1,81 @@
+from django.test import SimpleTestCase
+from crawler.robots import ALLOW_ALL, DISALLOW_ALL, RobotsRules, parse_robots, product_token
+
+ROBOTS_TXT = """
+# Comments and blank lines are ignored.
+User-agent: crawler-extra
+Disallow: /
+
+User-agent: Crawler
+User-agent: otherbot
+Disallow: /private  # trailing comment
+Allow: /private/open
+Crawl-delay: 2.5
+
+User-agent: *
+Disallow: /everyone
+Crawl-delay: fast
+"""
+
+
+def _allowed(text, agent, path):
+    return RobotsRules(parse_robots(text, agent)).allowed(path)
+
+
+class ProductTokenTests(SimpleTestCase):
+    def test_product_token(self):
+        self.assertEqual(product_token('Crawler/1.2 (+https://example.com/bot)'), 'crawler')
+        self.assertEqual(product_token('  crawler-extra/2'), 'crawler-extra')
+        self.assertEqual(product_token('/1.0'), '')
+
+
+class ParseRobotsTests(SimpleTestCase):
+    def test_matches_group_by_product_token(self):
+        rules = parse_robots(ROBOTS_TXT, 'crawler/1.0')
+        self.assertEqual(rules['delay'], 2.5)
+        self.assertFalse(_allowed(ROBOTS_TXT, 'crawler/1.0', '/private/page'))
+        self.assertTrue(_allowed(ROBOTS_TXT, 'crawler/1.0', '/everyone'))
+
+    def test_longer_token_does_not_match_prefix(self):
+        self.assertFalse(_allowed(ROBOTS_TXT, 'crawler-extra', '/anything'))
+        self.assertTrue(_allowed(ROBOTS_TXT, 'crawl', '/private'))
+
+    def test_falls_back_to_star_group(self):
+        rules = parse_robots(ROBOTS_TXT, 'unknownbot')
+        self.assertEqual(rules['rules'], [['/everyone', False]])
+        self.assertIsNone(rules['delay'])
+
+    def test_groups_for_the_same_agent_are_merged(self):
+        text = 'User-agent: crawler\nDisallow: /a\n\nUser-agent: crawler\nDisallow: /b\n'
+        self.assertFalse(_allowed(text, 'crawler', '/a'))
+        self.assertFalse(_allowed(text, 'crawler', '/b'))
+        self.assertTrue(_allowed(text, 'crawler', '/c'))
+
+    def test_most_specific_rule_wins(self):
+        self.assertTrue(_allowed(ROBOTS_TXT, 'crawler', '/private/open/file'))
+        self.assertFalse(_allowed(ROBOTS_TXT, 'crawler', '/private/closed'))
+
+    def test_allow_wins_ties(self):
+        text = 'User-agent: *\nDisallow: /page\nAllow: /page\n'
+        self.assertTrue(_allowed(text, 'crawler', '/page'))
+
+    def test_wildcards_and_anchors(self):
+        text = 'User-agent: *\nDisallow: /*.pdf$\nDisallow: /tmp*/\n'
+        self.assertFalse(_allowed(text, 'crawler', '/docs/file.pdf'))
+        self.assertTrue(_allowed(text, 'crawler', '/docs/file.pdf?download=1'))
+        self.assertFalse(_allowed(text, 'crawler', '/tmp123/x'))
+        self.assertTrue(_allowed(text, 'crawler', '/tmp'))
+
+    def test_empty_disallow_allows_everything(self):
+        text = 'User-agent: *\nDisallow:\n'
+        self.assertEqual(parse_robots(text, 'crawler')['rules'], [])
+
+    def test_rules_before_any_user_agent_are_ignored(self):
+        text = 'Disallow: /\nUser-agent: *\nDisallow: /x\n'
+        self.assertTrue(_allowed(text, 'crawler', '/y'))
+
+    def test_fallback_rules(self):
+        self.assertTrue(RobotsRules(ALLOW_ALL).allowed('/anything'))
+        self.assertFalse(RobotsRules(ALLOW_ALL).unreachable)
+        self.assertFalse(RobotsRules(DISALLOW_ALL).allowed('/anything'))
+        self.assertTrue(RobotsRules(DISALLOW_ALL).unreachable)
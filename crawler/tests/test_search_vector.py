@@ -0,0 +1,44 @@
+import time
+from django.contrib.postgres.search import SearchQuery
+from django.test import TestCase
+from crawler import pipeline
+from crawler.models import CrawledPage, PageContent
+
+URL = 'https://example.com/page'
+
+
+def _page(title, content):
+    return {
+        'url': URL, 'title': title, 'content': content, 'status_code': 200,
+        'etag': '', 'last_modified': '', 'content_hash': '', 'checked_at': time.time(),
+        'refresh_interval': 86400, 'archive_segment': '', 'archive_offset': None, 'archive_length': None,
+        'simhash': None, 'simhash_bands': [], 'canonical_url': '',
+    }
+
+
+class SearchVectorTriggerTests(TestCase):
+    """The search_vector triggers of migrations 0007 and 0013."""
+
+    def _matches(self, word):
+        return CrawledPage.objects.filter(url=URL, search_vector=SearchQuery(word)).exists()
+
+    def test_insert_covers_title_and_content(self):
+        pipeline.write_pages([_page('Falcon', 'migration routes')])
+        self.assertTrue(self._matches('falcon'))
+        self.assertTrue(self._matches('migration'))
+
+    def test_upsert_replaces_content(self):
+        pipeline.write_pages([_page('Falcon', 'migration routes')])
+        pipeline.write_pages([_page('Falcon', 'nesting cliffs')])
+        self.assertFalse(self._matches('migration'))
+        self.assertTrue(self._matches('cliffs'))
+
+    def test_content_written_alone_refreshes_vector(self):
+        pipeline.write_pages([_page('Falcon', 'migration routes')])
+        PageContent.objects.create(url=URL, content='hunting dives')
+        self.assertTrue(self._matches('dives'))
+
+    def test_nul_bytes_are_stripped(self):
+        pipeline.write_pages([_page('Fal\x00con', 'migra\x00tion')])
+        self.assertEqual(CrawledPage.objects.get(url=URL).title, 'Falcon')
+        self.assertEqual(CrawledPage.objects.get(url=URL).content, 'migration')
@@ -4,5 +4,9 @@ from . import views
 urlpatterns = [
     path('', views.home, name='home'),
     path('crawl/', views.start_crawl, name='start_crawl'),
+    path('crawl/seeds/', views.seed_crawl, name='seed_crawl'),
+    path('api/search', views.api_search, name='api_search'),
+    path('api/crawls/<str:crawl_id>', views.api_crawl, name='api_crawl'),
+    path('metrics', views.metrics_view, name='metrics'),
     path('presentation/', views.crawler_presentation, name='crawler_presentation'),
 ]
@@ -1,39 +1,86 @@
+import logging
 from django.shortcuts import render, redirect
-from django.contrib.postgres.search import SearchQuery, SearchRank, SearchHeadline, SearchVector
+from django.urls import reverse
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.http import require_GET
+from django.conf import settings
 from django.contrib import messages
 from .models import CrawledPage
-from .tasks import crawl_page_task
-import json
-from celery import current_app
+from .search import API_FIELDS, cached_latest_pages, cached_search_pages, search_after
+from . import frontier, jobs, metrics, seeds, stages
+from .db_router import read_from_replica, stick_to_primary
+from .tasks import dispatch_frontier_pullers, ingest_seeds_task
 
+logger = logging.getLogger(__name__)
+
+@read_from_replica
 def home(request):
     query = request.GET.get('q', '')
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
     results = []
+    has_next = False
 
     if query:
         try:
-            search_query = SearchQuery(query)
-            vector = SearchVector('title', weight='A') + SearchVector('content', weight='B')
-            results = CrawledPage.objects.annotate(
-                rank=SearchRank(vector, search_query),
-                headline=SearchHeadline('content', search_query, start_sel='<mark>', stop_sel='</mark>')
-            ).filter(rank__gte=0.1).order_by('-rank')
+            results, has_next = cached_search_pages(query, page)
         except Exception as e:
             messages.error(request, f'Search error: {str(e)}')
     else:
-        results = CrawledPage.objects.all().order_by('-crawled_at')[:20]
+        results = cached_latest_pages()
+
+    return render(request, 'dashboard.html', {
+        'results': results,
+        'query': query,
+        'page': page,
+        'has_next': has_next,
+    })
 
-    return render(request, 'dashboard.html', {'results': results, 'query': query})
+@require_GET
+@read_from_replica
+def api_search(request):
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return JsonResponse({'error': 'Missing q parameter'}, status=400)
+    fields = [f for f in request.GET.get('fields', '').split(',') if f] or list(API_FIELDS)
+    unknown = set(fields) - set(API_FIELDS)
+    if unknown:
+        return JsonResponse({'error': f'Unknown fields: {", ".join(sorted(unknown))}'}, status=400)
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), settings.CRAWLER_API_MAX_LIMIT)
+        snippet_words = min(max(int(request.GET.get('snippet_words', 35)), 2), 100)
+        results, next_cursor = search_after(
+            query, request.GET.get('cursor'), limit, fields, snippet_words
+        )
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'results': results, 'next_cursor': next_cursor})
+
+@require_GET
+def api_crawl(request, crawl_id):
+    job = jobs.progress(crawl_id)
+    if job is None:
+        return JsonResponse({'error': 'Unknown crawl'}, status=404)
+    job['created_at'] = job['created_at'].isoformat()
+    return JsonResponse(job)
 
 def start_crawl(request):
     if request.method == "POST":
         url = request.POST.get('url')
         print(f"DEBUG: Received crawl request for URL: {url}")
+        url = frontier.normalize_url(url)
         if url:
             try:
-                task = crawl_page_task.delay(url)
-                print(f"DEBUG: Task created with ID: {task.id}")
-                messages.success(request, f'✅ Crawl task started for: {url} (Task ID: {task.id})')
+                crawl_id = frontier.start_crawl(url)
+                dispatch_frontier_pullers()
+                stick_to_primary(request)
+                print(f"DEBUG: Crawl created with ID: {crawl_id}")
+                progress_url = reverse('api_crawl', args=[crawl_id])
+                messages.success(
+                    request, f'✅ Crawl started for: {url} (Crawl ID: {crawl_id}, progress: {progress_url})'
+                )
             except Exception as e:
                 print(f"DEBUG: Error starting crawl: {str(e)}")
                 messages.error(request, f'❌ Failed to start crawl: {str(e)}')
@@ -41,29 +88,59 @@ def start_crawl(request):
             messages.warning(request, '⚠️ Please provide a valid URL')
     return redirect('home')
 
-def crawler_presentation(request):
-    top_pages = CrawledPage.objects.order_by('-crawled_at')[:5]
+def seed_crawl(request):
+    if request.method == "POST":
+        upload = request.FILES.get('urls')
+        if upload:
+            try:
+                # Lists can hold millions of URLs, so a worker queues them.
+                crawl_id = frontier.start_seeded_crawl()
+                ingest_seeds_task.delay(crawl_id, seeds.save_upload(crawl_id, upload))
+                stick_to_primary(request)
+                progress_url = reverse('api_crawl', args=[crawl_id])
+                messages.success(
+                    request, f'✅ Crawl started, queueing seed URLs (Crawl ID: {crawl_id}, progress: {progress_url})'
+                )
+            except Exception as e:
+                messages.error(request, f'❌ Failed to load seeds: {str(e)}')
+        else:
+            messages.warning(request, '⚠️ Please upload a URL list')
+    return redirect('home')
 
-    crawl_times = ["10:00", "10:05", "10:10", "10:15", "10:20"]
-    crawl_counts = [5, 12, 18, 25, 30]
+@require_GET
+def metrics_view(request):
+    try:
+        queue_depths = stages.queue_depths()
+    except Exception:
+        queue_depths = None
+    try:
+        # Web processes record no task metrics, so refresh their pool stats per scrape.
+        metrics.record_process()
+    except Exception:
+        logger.warning('Could not record process metrics', exc_info=True)
+    return HttpResponse(
+        metrics.render_prometheus(queue_depths), content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+@read_from_replica
+def crawler_presentation(request):
+    top_pages = CrawledPage.objects.filter(failed_at=None).order_by('-crawled_at')[:5]
 
-    # Try to get worker info, but don't fail if Celery is unavailable
-    worker_names = []
-    worker_task_counts = []
+    # Throughput comes from the counters workers record in Redis, so rendering
+    # this page never has to query the workers themselves.
     try:
-        i = current_app.control.inspect()
-        active = i.active() or {}
-        worker_names = list(active.keys())
-        worker_task_counts = [len(active[w]) for w in worker_names]
+        series = metrics.series(settings.CRAWLER_METRICS_DASHBOARD_BUCKETS)
+        summary = metrics.window(settings.CRAWLER_METRICS_DASHBOARD_BUCKETS)
     except Exception as e:
-        # If Celery is not available, use mock data for presentation
-        worker_names = ['worker@crawler-1', 'worker@crawler-2']
-        worker_task_counts = [3, 5]
+        messages.error(request, f'Metrics unavailable: {str(e)}')
+        series, summary = [], None
+    peak = max([point['pages_fetched'] for point in series] + [1])
+    workers = sorted((summary or {}).get('workers', {}).items(), key=lambda item: -item[1])
+    worker_peak = max([count for _, count in workers] + [1])
 
     return render(request, 'web_crawler_architecture.html', {
         'top_pages': top_pages,
-        'crawl_times': json.dumps(crawl_times),
-        'crawl_counts': json.dumps(crawl_counts),
-        'worker_names': json.dumps(worker_names),
-        'worker_task_counts': json.dumps(worker_task_counts),
+        'series': [dict(point, percent=100 * point['pages_fetched'] // peak) for point in series],
+        'summary': summary,
+        'workers': [(name, count, 100 * count // worker_peak) for name, count in workers],
     })
@@ -57,6 +57,58 @@ DATABASES = {
     }
 }
 
+# Every process keeps its database connections open for DB_CONN_MAX_AGE seconds
+# and checks them before reuse. With DB_POOL=True it uses Django's psycopg pool
+# instead, sized by CRAWLER_PROCESS_ROLE (web, fetch, parse, persist or beat) as
+# (min, max) connections per process; DB_POOL_MIN_SIZE / DB_POOL_MAX_SIZE
+# override the role's sizes. Pool usage is exported on /metrics.
+CRAWLER_PROCESS_ROLE = os.environ.get('CRAWLER_PROCESS_ROLE', 'web')
+DB_POOL = os.environ.get('DB_POOL', 'False') == 'True'
+DB_POOL_SIZES = {
+    # runserver and gunicorn threads share one process pool.
+    'web': (2, 10),
+    # Prefork children run one task at a time.
+    'fetch': (1, 2),
+    'parse': (1, 2),
+    'persist': (1, 2),
+    'beat': (0, 1),
+}
+if DB_POOL:
+    from psycopg_pool import ConnectionPool
+
+    pool_min, pool_max = DB_POOL_SIZES.get(CRAWLER_PROCESS_ROLE, DB_POOL_SIZES['web'])
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', pool_min)),
+            'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', pool_max)),
+            # Seconds to wait for a free connection before failing.
+            'timeout': float(os.environ.get('DB_POOL_TIMEOUT', '10')),
+            'max_idle': float(os.environ.get('DB_POOL_MAX_IDLE', '600')),
+            'check': ConnectionPool.check_connection,
+        },
+    }
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', '60'))
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# Read replicas for search and listing traffic (see crawler.db_router).
+# DB_REPLICA_HOSTS is a comma-separated list of host[:port], each added as a
+# 'replica_N' alias with the primary's credentials. Sessions that start a
+# crawl read from the primary for CRAWLER_REPLICA_STICKY_SECONDS (0 disables).
+for number, address in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(',')), 1):
+    replica_host, _, replica_port = address.strip().partition(':')
+    DATABASES[f'replica_{number}'] = {
+        **DATABASES['default'],
+        'HOST': replica_host,
+        'PORT': replica_port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['crawler.db_router.ReplicaRouter']
+CRAWLER_REPLICA_STICKY_SECONDS = int(os.environ.get('CRAWLER_REPLICA_STICKY_SECONDS', '30'))
+# Cached search results read from a replica expire after this many seconds,
+# which should cover the replicas' usual lag.
+CRAWLER_REPLICA_CACHE_TTL = int(os.environ.get('CRAWLER_REPLICA_CACHE_TTL', '10'))
+
 AUTH_PASSWORD_VALIDATORS = []
 
 LANGUAGE_CODE = 'en-us'
@@ -67,6 +119,191 @@ USE_TZ = True
 STATIC_URL = '/static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.environ.get('CACHE_URL', 'redis://redis:6379/1'),
+        'OPTIONS': {'CLIENT_CLASS': 'django_redis.client.DefaultClient'},
+    }
+}
+
 # Celery
 CELERY_BROKER_URL = os.environ.get('CELERY_BROKER', 'redis://redis:6379/0')
 CELERY_RESULT_BACKEND = os.environ.get('CELERY_BROKER', 'redis://redis:6379/0')
+# Crawl tasks run by the million and nothing reads their return values, so none
+# are stored; a task that opts back in with ignore_result=False keeps its result
+# for CELERY_RESULT_EXPIRES seconds. Crawl progress lives in CrawlJob instead.
+CELERY_TASK_IGNORE_RESULT = True
+CELERY_RESULT_EXPIRES = int(os.environ.get('CELERY_RESULT_EXPIRES', '3600'))
+CELERY_BEAT_SCHEDULE = {}
+
+# Fetching is I/O-bound and parsing CPU-bound, so they run on separate queues
+# served by separately sized workers (see docker-compose.yml).
+CELERY_TASK_ROUTES = {
+    'crawler.tasks.crawl_*': {'queue': 'fetch'},
+    'crawler.tasks.parse_pages_task': {'queue': 'parse'},
+    # Bulk upserts get their own worker so its connections are sized separately.
+    'crawler.tasks.flush_crawl_results_task': {'queue': 'persist'},
+}
+
+# Crawler
+CRAWLER_REDIS_URL = os.environ.get('CRAWLER_REDIS', CELERY_BROKER_URL)
+
+CRAWLER_USER_AGENT = os.environ.get(
+    'CRAWLER_USER_AGENT', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+)
+CRAWLER_FETCH_TIMEOUT = float(os.environ.get('CRAWLER_FETCH_TIMEOUT', '10'))
+
+# Bodies are streamed and cut at CRAWLER_MAX_BODY_BYTES; responses whose
+# Content-Type is not in the allowlist are dropped before the body is read.
+CRAWLER_MAX_BODY_BYTES = int(os.environ.get('CRAWLER_MAX_BODY_BYTES', str(5 * 1024 * 1024)))
+CRAWLER_ALLOWED_CONTENT_TYPES = os.environ.get(
+    'CRAWLER_ALLOWED_CONTENT_TYPES', 'text/html,application/xhtml+xml'
+).split(',')
+
+# Raw responses are appended to gzipped WARC segments in this directory (empty
+# disables archiving), each segment rolling over at CRAWLER_ARCHIVE_SEGMENT_BYTES.
+CRAWLER_ARCHIVE_DIR = os.environ.get('CRAWLER_ARCHIVE_DIR', str(BASE_DIR / 'archive'))
+CRAWLER_ARCHIVE_SEGMENT_BYTES = int(os.environ.get('CRAWLER_ARCHIVE_SEGMENT_BYTES', str(1024 ** 3)))
+
+# Pages whose content SimHash is within this many bits of a stored page are
+# collapsed onto it. Band lookups only guarantee matches up to 3 bits.
+CRAWLER_NEAR_DUPLICATE_DISTANCE = int(os.environ.get('CRAWLER_NEAR_DUPLICATE_DISTANCE', '3'))
+
+# HTML extractor: 'lxml' (fast, falls back to BeautifulSoup on failure) or 'bs4'.
+CRAWLER_EXTRACTOR = os.environ.get('CRAWLER_EXTRACTOR', 'lxml')
+
+# Async fetch engine used by crawl_batch_task: total in-flight requests per
+# worker process and keep-alive connections per host.
+CRAWLER_FETCH_CONCURRENCY = int(os.environ.get('CRAWLER_FETCH_CONCURRENCY', '200'))
+CRAWLER_FETCH_PER_HOST = int(os.environ.get('CRAWLER_FETCH_PER_HOST', '8'))
+
+# Fetched pages wait in a compressed Redis queue for the parse stage, which
+# takes CRAWLER_PARSE_BATCH_SIZE at a time. Frontier pullers pause while more
+# than CRAWLER_PARSE_MAX_BACKLOG pages are waiting.
+CRAWLER_PARSE_BATCH_SIZE = int(os.environ.get('CRAWLER_PARSE_BATCH_SIZE', '50'))
+CRAWLER_PARSE_MAX_BACKLOG = int(os.environ.get('CRAWLER_PARSE_MAX_BACKLOG', '10000'))
+CRAWLER_PARSE_COMPRESSION = int(os.environ.get('CRAWLER_PARSE_COMPRESSION', '1'))
+# Seconds a parse task may hold a batch before it is put back on the queue.
+CRAWLER_PARSE_LEASE = int(os.environ.get('CRAWLER_PARSE_LEASE', '300'))
+CRAWLER_STAGE_QUEUES = ['fetch', 'parse', 'persist', 'celery']
+
+# Crawls follow links up to CRAWLER_MAX_DEPTH levels from the seed and queue at
+# most CRAWLER_MAX_PAGES URLs. Up to CRAWLER_FRONTIER_PULLERS tasks pull batches
+# of CRAWLER_FRONTIER_BATCH_SIZE URLs from the shared Redis frontier.
+CRAWLER_MAX_DEPTH = int(os.environ.get('CRAWLER_MAX_DEPTH', '2'))
+CRAWLER_MAX_PAGES = int(os.environ.get('CRAWLER_MAX_PAGES', '1000'))
+CRAWLER_FRONTIER_BATCH_SIZE = int(os.environ.get('CRAWLER_FRONTIER_BATCH_SIZE', '100'))
+CRAWLER_FRONTIER_PULLERS = int(os.environ.get('CRAWLER_FRONTIER_PULLERS', '8'))
+CRAWLER_FRONTIER_LEASE = int(os.environ.get('CRAWLER_FRONTIER_LEASE', '300'))
+# Bulk seed lists (manage.py seed_urls, /crawl/seeds/) are queued in batches of
+# this many URLs, each a handful of pipelined Redis round trips.
+CRAWLER_SEED_BATCH_SIZE = int(os.environ.get('CRAWLER_SEED_BATCH_SIZE', '10000'))
+# Seed files uploaded through /crawl/seeds/ wait here for ingest_seeds_task, so
+# the directory must be shared by the web and worker containers.
+CRAWLER_SEED_UPLOAD_DIR = os.environ.get('CRAWLER_SEED_UPLOAD_DIR', str(BASE_DIR / 'seeds'))
+# Crawl progress counters are copied from Redis to CrawlJob rows this often (seconds).
+CELERY_BEAT_SCHEDULE['flush-crawl-jobs'] = {
+    'task': 'crawler.tasks.flush_crawl_jobs_task',
+    'schedule': float(os.environ.get('CRAWLER_JOB_FLUSH_INTERVAL', '30')),
+}
+# Minimum seconds between fetches to the same host; a longer robots.txt
+# Crawl-delay takes precedence.
+CRAWLER_DEFAULT_CRAWL_DELAY = float(os.environ.get('CRAWLER_DEFAULT_CRAWL_DELAY', '1'))
+CELERY_BEAT_SCHEDULE['dispatch-frontier'] = {
+    'task': 'crawler.tasks.dispatch_frontier_task',
+    'schedule': float(os.environ.get('CRAWLER_FRONTIER_POLL_INTERVAL', '10')),
+}
+
+# Transient fetch failures (timeouts, connection errors, 408, 429 and 5xx) are
+# retried up to CRAWLER_FETCH_MAX_RETRIES times, waiting CRAWLER_RETRY_BACKOFF
+# seconds doubled per attempt (jittered, at most CRAWLER_RETRY_BACKOFF_MAX).
+# Pages that still fail are marked failed and re-checked after
+# CRAWLER_FAILED_RECHECK_INTERVAL seconds, doubling per further failure, until
+# CRAWLER_FAILED_MAX_RECHECKS failures in a row stop the re-checks.
+CRAWLER_FETCH_MAX_RETRIES = int(os.environ.get('CRAWLER_FETCH_MAX_RETRIES', '3'))
+CRAWLER_RETRY_BACKOFF = float(os.environ.get('CRAWLER_RETRY_BACKOFF', '30'))
+CRAWLER_RETRY_BACKOFF_MAX = float(os.environ.get('CRAWLER_RETRY_BACKOFF_MAX', '3600'))
+CRAWLER_FAILED_RECHECK_INTERVAL = int(os.environ.get('CRAWLER_FAILED_RECHECK_INTERVAL', str(24 * 3600)))
+CRAWLER_FAILED_MAX_RECHECKS = int(os.environ.get('CRAWLER_FAILED_MAX_RECHECKS', '5'))
+# A host whose transient failures reach CRAWLER_BREAKER_FAILURE_RATE of at least
+# CRAWLER_BREAKER_MIN_REQUESTS fetches within CRAWLER_BREAKER_WINDOW seconds is
+# not fetched for CRAWLER_BREAKER_COOLDOWN seconds, doubling on each repeat trip
+# up to CRAWLER_BREAKER_MAX_COOLDOWN.
+CRAWLER_BREAKER_WINDOW = int(os.environ.get('CRAWLER_BREAKER_WINDOW', '300'))
+CRAWLER_BREAKER_MIN_REQUESTS = int(os.environ.get('CRAWLER_BREAKER_MIN_REQUESTS', '10'))
+CRAWLER_BREAKER_FAILURE_RATE = float(os.environ.get('CRAWLER_BREAKER_FAILURE_RATE', '0.5'))
+CRAWLER_BREAKER_COOLDOWN = float(os.environ.get('CRAWLER_BREAKER_COOLDOWN', '300'))
+CRAWLER_BREAKER_MAX_COOLDOWN = float(os.environ.get('CRAWLER_BREAKER_MAX_COOLDOWN', '3600'))
+
+# robots.txt rules are cached in Redis per host (CRAWLER_ROBOTS_ERROR_TTL when
+# the file could not be fetched) and in a per-process LRU of CRAWLER_ROBOTS_LRU_SIZE hosts.
+CRAWLER_ROBOTS_AGENT = os.environ.get('CRAWLER_ROBOTS_AGENT', 'crawler')
+CRAWLER_ROBOTS_TTL = int(os.environ.get('CRAWLER_ROBOTS_TTL', str(24 * 3600)))
+CRAWLER_ROBOTS_ERROR_TTL = int(os.environ.get('CRAWLER_ROBOTS_ERROR_TTL', '600'))
+# Frontier URLs of such hosts are put back for another try after the error TTL,
+# up to this many times, before they count as failed.
+CRAWLER_ROBOTS_MAX_DEFERRALS = int(os.environ.get('CRAWLER_ROBOTS_MAX_DEFERRALS', '6'))
+CRAWLER_ROBOTS_LRU_SIZE = int(os.environ.get('CRAWLER_ROBOTS_LRU_SIZE', '10000'))
+
+# Shared Bloom filter of recently seen URLs, sized for CRAWLER_SEEN_CAPACITY URLs
+# at CRAWLER_SEEN_ERROR_RATE false positives; entries expire after roughly
+# CRAWLER_SEEN_TTL seconds (between 1x and 2x).
+CRAWLER_SEEN_CAPACITY = int(os.environ.get('CRAWLER_SEEN_CAPACITY', '100000000'))
+CRAWLER_SEEN_ERROR_RATE = float(os.environ.get('CRAWLER_SEEN_ERROR_RATE', '0.001'))
+CRAWLER_SEEN_TTL = int(os.environ.get('CRAWLER_SEEN_TTL', str(24 * 3600)))
+
+# Crawled pages are re-checked with conditional requests. The interval halves
+# when a page changes and doubles when it doesn't, within the bounds below
+# (seconds). Every refresh poll queues up to CRAWLER_REFRESH_BATCH_SIZE due pages.
+CRAWLER_REFRESH_DEFAULT_INTERVAL = int(os.environ.get('CRAWLER_REFRESH_DEFAULT_INTERVAL', str(24 * 3600)))
+CRAWLER_REFRESH_MIN_INTERVAL = int(os.environ.get('CRAWLER_REFRESH_MIN_INTERVAL', '3600'))
+CRAWLER_REFRESH_MAX_INTERVAL = int(os.environ.get('CRAWLER_REFRESH_MAX_INTERVAL', str(30 * 24 * 3600)))
+CRAWLER_REFRESH_BATCH_SIZE = int(os.environ.get('CRAWLER_REFRESH_BATCH_SIZE', '1000'))
+CRAWLER_REFRESH_CLAIM_LEASE = int(os.environ.get('CRAWLER_REFRESH_CLAIM_LEASE', '3600'))
+CELERY_BEAT_SCHEDULE['refresh-due-pages'] = {
+    'task': 'crawler.tasks.refresh_due_pages_task',
+    'schedule': float(os.environ.get('CRAWLER_REFRESH_POLL_INTERVAL', '300')),
+}
+
+# Search results are cached until the next persistence flush or this many seconds.
+CRAWLER_SEARCH_CACHE_TTL = int(os.environ.get('CRAWLER_SEARCH_CACHE_TTL', '300'))
+CRAWLER_API_MAX_LIMIT = int(os.environ.get('CRAWLER_API_MAX_LIMIT', '100'))
+
+# Parsed pages are buffered in Redis and upserted in batches, flushed when the
+# buffer reaches the batch size or every flush interval (seconds), whichever first.
+CRAWLER_PERSIST_BATCH_SIZE = int(os.environ.get('CRAWLER_PERSIST_BATCH_SIZE', '500'))
+CRAWLER_PERSIST_FLUSH_INTERVAL = float(os.environ.get('CRAWLER_PERSIST_FLUSH_INTERVAL', '5'))
+# Seconds a batch may take to write before another flush puts it back on the buffer.
+CRAWLER_PERSIST_LEASE = int(os.environ.get('CRAWLER_PERSIST_LEASE', '600'))
+CELERY_BEAT_SCHEDULE['flush-crawl-results'] = {
+    'task': 'crawler.tasks.flush_crawl_results_task',
+    'schedule': CRAWLER_PERSIST_FLUSH_INTERVAL,
+}
+
+# Workers record throughput and latency into Redis buckets of this many seconds,
+# kept for CRAWLER_METRICS_RETENTION seconds. /metrics serves the running totals
+# to Prometheus; the presentation charts the last DASHBOARD_BUCKETS buckets.
+CRAWLER_METRICS_BUCKET_SECONDS = int(os.environ.get('CRAWLER_METRICS_BUCKET_SECONDS', '60'))
+CRAWLER_METRICS_RETENTION = int(os.environ.get('CRAWLER_METRICS_RETENTION', str(24 * 3600)))
+CRAWLER_METRICS_DASHBOARD_BUCKETS = int(os.environ.get('CRAWLER_METRICS_DASHBOARD_BUCKETS', '30'))
+# Per-process gauges (peak memory, connection pool stats) expire this many seconds after the process
+# last recorded them, so exited and restarted workers drop off /metrics.
+CRAWLER_METRICS_PROCESS_TTL = int(os.environ.get('CRAWLER_METRICS_PROCESS_TTL', '600'))
+
+# Opt-in per-stage timings (DNS, connect, download, parse, text, dedup, write...)
+# aggregated per worker and domain; see `manage.py profile_report`. A
+# CRAWLER_PROFILE_SAMPLE_RATE share of profiled tasks also runs under cProfile.
+CRAWLER_PROFILE = os.environ.get('CRAWLER_PROFILE', 'False') == 'True'
+CRAWLER_PROFILE_SAMPLE_RATE = float(os.environ.get('CRAWLER_PROFILE_SAMPLE_RATE', '0'))
+
+# Page text is stored in monthly partitions (see crawler.partitions). A daily beat
+# keeps CRAWLER_CONTENT_PARTITIONS_AHEAD months created in advance and, when
+# CRAWLER_CONTENT_RETENTION_MONTHS is set, detaches partitions older than that
+# many months for archiving (0 keeps every partition attached).
+CRAWLER_CONTENT_PARTITIONS_AHEAD = int(os.environ.get('CRAWLER_CONTENT_PARTITIONS_AHEAD', '2'))
+CRAWLER_CONTENT_RETENTION_MONTHS = int(os.environ.get('CRAWLER_CONTENT_RETENTION_MONTHS', '0'))
+CELERY_BEAT_SCHEDULE['maintain-partitions'] = {
+    'task': 'crawler.tasks.maintain_partitions_task',
+    'schedule': 24 * 3600.0,
+}
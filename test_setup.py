@@ -16,7 +16,7 @@ def check_imports():
         'redis',
         'requests',
         'bs4',
-        'psycopg2',
+        'psycopg',
         'django_redis',
         'django_celery_results',
         'lxml'